@@ -1,21 +1,151 @@
-from click import group
-import pandas as pd
+import importlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from functools import partial
+
+# NESD_FAST_BOOT=1: start up for scale-to-zero deploys, where every wake-up is a
+# cold start. The page is served from files prebuilt by nesd_build_boot.py while
+# the data loads in the background (README "Fast boot").
+fast_boot = os.environ.get("NESD_FAST_BOOT", "0") not in ("", "0")
+if fast_boot and "IPython" not in sys.modules:
+    # dash imports IPython for its notebook support whenever it's installed
+    # (~0.3s); a server never uses it
+    sys.modules["IPython"] = None
+    try:
+        import dash
+    finally:
+        del sys.modules["IPython"]
+
 import dash
-from dash import State, dcc, html, Input, Output
-import plotly.express as px
+from dash import State, dcc, html, Input, Output, Patch, no_update
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
+from flask import jsonify
 
-# --------------Load & Prep Data-------------#
+import nesd_metrics
+import nesd_trace
+from nesd_cache import FigureBundle, FigureCache, SharedFigureCache
+from nesd_data import load_tables, preload, tables_version
+from nesd_query import AggregateCube, dem_labels, metrics, owner_label_map, table_columns, version_fingerprint
+from nesd_registry import DataRegistry, Dataset
+from nesd_trace import span
 
-# change: table5
-table1 = pd.read_excel("table_5_new.xlsx")
+# --------------Load & Prep Data-------------#
 
-dem_labels = ["SEX_LABEL", "RACE_GROUP_LABEL", "ETH_GROUP_LABEL", "FOREIGN_BORN_GROUP_LABEL", "LFO_LABEL",
-              "VET_GROUP_LABEL", "W2_GROUP_LABEL" ]
+# data-layer messages (snapshot rebuilds, memory report) go to stderr
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s: %(message)s")
+
+# name -> (workbook, columns coerced to numbers)
+# change: table5; owner table: OWNNOPD has "N < 15"-style cells
+data_sources = {
+    "table1": ("table_5_new.xlsx", []),
+    "table_owner": ("table_O1_new.xlsx", ["OWNNOPD"]),
+}
+
+# prefer the extractor's partitioned Parquet output when it's there (typed,
+# and only the columns the views use are read)
+parquet_dir = os.environ.get("NESD_PARQUET_DIR", "nesd_parquet")
+if os.path.isdir(os.path.join(parquet_dir, "table_5")) and os.path.isdir(os.path.join(parquet_dir, "table_O1")):
+    data_sources = {
+        "table1": (os.path.join(parquet_dir, "table_5"), []),
+        "table_owner": (os.path.join(parquet_dir, "table_O1"), ["OWNNOPD"]),
+    }
 
-# owner table:
-table_owner = pd.read_excel("table_O1_new.xlsx")
-table_owner["OWNNOPD"] = pd.to_numeric(table_owner["OWNNOPD"], errors='coerce')
+# workbooks are read through cached .feather snapshots, then normalized (categorical
+# labels, downcast counts, unused columns dropped). The normalized tables are published
+# once as Arrow files that every gunicorn worker memory-maps read-only, so the box holds
+# one copy of the data however many workers run. Point NESD_SHARED_DATA_DIR at /dev/shm
+# to keep them in RAM; set it to "" for private per-process copies.
+shared_data_dir = os.environ.get("NESD_SHARED_DATA_DIR", os.path.join(tempfile.gettempdir(), "nesd-dashboard-data"))
+
+# a fast boot maps the normalized tables and the cube from NESD_BOOT_DIR and takes the
+# dropdown options from its boot.json, all written by nesd_build_boot.py at build time
+# (a deploy's disk starts empty, and building them at boot takes ~40s)
+boot_dir = os.environ.get("NESD_BOOT_DIR", "nesd_boot")
+BOOT_INFO = "boot.json"
+if fast_boot:
+    shared_data_dir = os.environ.get("NESD_SHARED_DATA_DIR", boot_dir)
+
+
+def read_boot_info():
+    # {"version": data version, "years": [...], "sectors": [...]}, None if not built
+    try:
+        with open(os.path.join(boot_dir, BOOT_INFO)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+boot_info = read_boot_info() if fast_boot else None
+
+# NESD_QUERY_BACKEND=duckdb: chart queries run as SQL over the Parquet tables in an
+# embedded DuckDB (nesd_duckdb) and the tables are never loaded into memory -- for
+# data that doesn't fit in a worker. Needs duckdb and the extractor's Parquet output.
+query_backend = os.environ.get("NESD_QUERY_BACKEND", "pandas")
+if query_backend == "duckdb" and not all(os.path.isdir(path) for path, _ in data_sources.values()):
+    logging.warning("NESD_QUERY_BACKEND=duckdb needs the Parquet tables (nesd_extract_tables.py); using pandas")
+    query_backend = "pandas"
+
+
+def load_dataset(version):
+    # the owner table is only read for OWNNOPD views the cube doesn't cover, so it
+    # loads on first use (table1 feeds the layout and the default view); with DuckDB
+    # neither is loaded unless something asks for the frames themselves
+    engine, lazy, cube_path = None, ["table_owner"], "nesd_cube.bin"
+    if query_backend == "duckdb":
+        from nesd_duckdb import DuckDBEngine
+        engine = DuckDBEngine({"firms": data_sources["table1"][0], "owners": data_sources["table_owner"][0]})
+        lazy, cube_path = ["table1", "table_owner"], "nesd_cube.duckdb.bin"
+    if fast_boot:
+        cube_path = os.path.join(boot_dir, cube_path)
+    load_start = time.perf_counter()
+    tables = load_tables(data_sources, keep_columns=table_columns, shared_dir=shared_data_dir, lazy=lazy)
+    nesd_metrics.observe_load("tables", time.perf_counter() - load_start)
+
+    # every chart aggregate, precomputed once per data version (rebuilt when the tables
+    # change); the cube file is memory-mapped too, so workers share it
+    load_start = time.perf_counter()
+    cube = AggregateCube.load_or_build(tables["table1"], tables["table_owner"], cube_path,
+                                       data_version=version, engine=engine)
+    nesd_metrics.observe_load("cube", time.perf_counter() - load_start)
+
+    # NESD_FIGURE_BUNDLE=<file from nesd_build_bundle.py>: serve pre-rendered
+    # figures, no pandas / plotly work per request (a bundle built from other
+    # data is ignored)
+    bundle = None
+    if os.environ.get("NESD_FIGURE_BUNDLE"):
+        try:
+            bundle = FigureBundle(os.environ["NESD_FIGURE_BUNDLE"], data_version=cube.fingerprint)
+        except (OSError, ValueError) as e:
+            logging.warning("not using figure bundle: %s", e)
+    return Dataset(version, tables, cube, bundle)
+
+
+# the current dataset; requests take `registry.current` once and read only that.
+# Every NESD_RELOAD_INTERVAL seconds (default 30, "" = never) the sources are
+# checked, and changed files are loaded in the background and swapped in whole.
+# A fast boot loads the first dataset in the background too.
+registry = DataRegistry(
+    load_dataset,
+    version=lambda: tables_version(data_sources, table_columns),
+    warm=lambda dataset: dataset.cube.warm(),
+    background=fast_boot,
+)
+reload_interval = os.environ.get("NESD_RELOAD_INTERVAL", "30")
+if reload_interval:
+    registry.watch(float(reload_interval))
+
+# the row indexes / owner table (and plotly.express, for the first render) are warmed up
+# in the background once the server is up (seconds after import; NESD_PRELOAD_DELAY=""
+# leaves it to the first request that needs it)
+preload_delay = os.environ.get("NESD_PRELOAD_DELAY", "2")
+if preload_delay:
+    preload(lambda: registry.current.cube.warm(), partial(importlib.import_module, "plotly.express"),
+            delay=float(preload_delay))
 
 # standardize labeling:
 def standardize_label(col):
@@ -40,258 +170,276 @@ server = app.server
 
 
 #-----Add Bootstrap Wrapper for layout---#
-app.layout = dbc.Container([
-
-    # --- Header/Navbar --- #
-    dbc.NavbarSimple(
-        brand=html.Strong("NES-D Dashboard: Nonemployer Firms by Demographics"),
-        style={"borderRadius": "10px", "backgroundColor": "#1A73E8"},
-        color="primary",  
-        dark=True,
-        fluid=True
-    ),
+def dropdown_values():
+    # -> (years, sectors); at a fast boot the prebuilt lists, so the page doesn't wait
+    # for the data (as long as it's the data they were built from)
+    if boot_info is not None and boot_info.get("version") == registry.version:
+        return boot_info["years"], boot_info["sectors"]
+    engine = registry.current.cube.engine
+    return engine.values("firms", "YEAR"), engine.values("firms", "NAICS2017_LABEL")
+
+
+def serve_layout(options=None):
+    # a function, so a page loaded after a data reload offers the new sectors / years
+    years, sectors = options or dropdown_values()
+    return dbc.Container([
+
+        # --- Header/Navbar --- #
+        dbc.NavbarSimple(
+            brand=html.Strong("NES-D Dashboard: Nonemployer Firms by Demographics"),
+            style={"borderRadius": "10px", "backgroundColor": "#1A73E8"},
+            color="primary",  
+            dark=True,
+            fluid=True
+        ),
+
+        html.Br(),
+
+        # ------- About Section ------ #
+        dbc.Card(
+            [
+                dbc.CardHeader(
+                    dbc.Button(
+                        "About this Data",
+                        id="about-toggle",
+                        color="primary",
+                        n_clicks=0,
+                        style={"width": "100%", "textAlign": "left"}
+                    ),
+                    style={"padding": "0"}
+                ),
+                dbc.Collapse(
+                    dbc.CardBody(
+                        [
+                            html.P(
+                                "This dashboard visualizes data from the U.S. Census Bureau's Nonemployer Statistics by Demographics (NES-D) Experimental Dataset for the years 2017 to 2019."
+                            ),
+                            html.P(
+                                "The NES-D provides new insights into nonemployer businesses, which are businesses that have no paid employees, are subject to federal income tax."
+                            ),
+                            html.P(
+                                "Nonemployers contribute significantly to the U.S. economy despite not having payroll employees, and they are often freelancers, gig workers, independent contractors, or self-employed individuals."
+                            ),
+                            html.P(
+                                "The NES-D experimental dataset reports statistics on nonemployer business activity with (demographic) characteristics of business owners including:"
+                            ),
+                            html.Ul(
+                                [
+                                    html.Li("Sex"),
+                                    html.Li("Race"),
+                                    html.Li("Ethnicity"),
+                                    html.Li("Veteran Status"),
+                                    html.Li("Foreign-Born Status"),
+                                    html.Li("Wage Work Status")
+                                ]
+                            ),
+                            html.P(
+                                "The NES-D experimental dataset additionally reports statistics by nonemployer business characteristics including: "
+                            ),
+                            html.Ul(
+                                [
+                                    html.Li("Sector"),
+                                    html.Li("Legal Form of Organization (LFO) ")
+                                ]
+                            ),
+                            html.P(
+                                [
+                                    "For more information, visit the ",
+                                    html.A(
+                                        "NES-D experimental data site",
+                                        href="https://www.census.gov/data/experimental-data-products/nes-d-wage-work-tables.html",
+                                        target="_blank",
+                                    ),
+                                    " or read the ",
+                                    html.A(
+                                        "experimental methodology",
+                                        href="https://www2.census.gov/data/experimental-data-products/nes-d-wage-work-tables/methodology.pdf",
+                                        target="_blank",
+                                    ),
+                                    ".",
+                                ]
+                            ),
+                        ]
+                    ),
+                    id="about-collapse",
+                    is_open=False,
+                ),
+            ],
+            style={"borderRadius": "10px"},
+        ),
 
-    html.Br(),
+        html.Br(),
 
-    # ------- About Section ------ #
-    dbc.Card(
-        [
+        # --- Filters Section --- #
+        dbc.Card([
             dbc.CardHeader(
-                dbc.Button(
-                    "About this Data",
-                    id="about-toggle",
-                    color="primary",
-                    n_clicks=0,
-                    style={"width": "100%", "textAlign": "left"}
-                ),
-                style={"padding": "0"}
+                "Filter Options",
+                style={"backgroundColor": "#1A73E8", "color": "white"},
+                className="shadow-sm"
             ),
-            dbc.Collapse(
-                dbc.CardBody(
-                    [
-                        html.P(
-                            "This dashboard visualizes data from the U.S. Census Bureau's Nonemployer Statistics by Demographics (NES-D) Experimental Dataset for the years 2017 to 2019."
-                        ),
-                        html.P(
-                            "The NES-D provides new insights into nonemployer businesses, which are businesses that have no paid employees, are subject to federal income tax."
-                        ),
-                        html.P(
-                            "Nonemployers contribute significantly to the U.S. economy despite not having payroll employees, and they are often freelancers, gig workers, independent contractors, or self-employed individuals."
-                        ),
-                        html.P(
-                            "The NES-D experimental dataset reports statistics on nonemployer business activity with (demographic) characteristics of business owners including:"
-                        ),
-                        html.Ul(
-                            [
-                                html.Li("Sex"),
-                                html.Li("Race"),
-                                html.Li("Ethnicity"),
-                                html.Li("Veteran Status"),
-                                html.Li("Foreign-Born Status"),
-                                html.Li("Wage Work Status")
-                            ]
-                        ),
-                        html.P(
-                            "The NES-D experimental dataset additionally reports statistics by nonemployer business characteristics including: "
+            dbc.CardBody([
+                dbc.Row([
+                    dbc.Col([
+                        html.Label("Filter by Year:", className="me-2 fw-semibold"),
+                        dcc.Dropdown(
+                            id="year-dropdown",
+                            options=[{"label": y, "value": y} for y in years],
+                            value=2019,
+                            placeholder="Select year...",
+                            multi=False
                         ),
-                        html.Ul(
-                            [
-                                html.Li("Sector"),
-                                html.Li("Legal Form of Organization (LFO) ")
-                            ]
+                    ], md=6),
+
+                    dbc.Col([
+                        html.Label("Filter by Sector:", className="me-2 fw-semibold"),
+                        dcc.Dropdown(
+                            id="industry-dropdown",
+                            options=[{"label": industry, "value": industry}
+                                     for industry in sectors] +
+                                    [{"label": "All Sectors", "value": "All"}],
+                            value="All",
+                            clearable=False
+                        )
+                    ], md=6),
+                ]),
+
+                html.Br(),
+
+                # Bar-plot controls
+                dbc.Row([
+                    dbc.Col([
+                        html.Label("Select Demographic (X-Axis):", className="me-2 fw-semibold"),
+                        dcc.Dropdown(
+                            id='bar-dem-dropdown',
+                            options=[{'label': standardize_label_map[col], 'value': col} for col in dem_labels],
+                            value="SEX_LABEL",
+                            clearable=False,
                         ),
-                        html.P(
+                
+                    # ], md=4),
+                    # dbc.Col([
+                    #     # Label + checkbox on one line
+                        html.Div(
                             [
-                                "For more information, visit the ",
-                                html.A(
-                                    "NES-D experimental data site",
-                                    href="https://www.census.gov/data/experimental-data-products/nes-d-wage-work-tables.html",
-                                    target="_blank",
+                                html.Span("Color by Second Demographic?", className="me-2 fw-semibold"),
+                                dbc.Checkbox(
+                                    id="compare-toggle",
+                                    value=False,
+                                    label="",
+                                    label_class_name="mb-0", 
                                 ),
-                                " or read the ",
-                                html.A(
-                                    "experimental methodology",
-                                    href="https://www2.census.gov/data/experimental-data-products/nes-d-wage-work-tables/methodology.pdf",
-                                    target="_blank",
-                                ),
-                                ".",
-                            ]
+                            ],
+                            className="d-flex align-items-center gap-2"
                         ),
-                    ]
-                ),
-                id="about-collapse",
-                is_open=False,
-            ),
-        ],
-        style={"borderRadius": "10px"},
-    ),
-
-    html.Br(),
 
-    # --- Filters Section --- #
-    dbc.Card([
-        dbc.CardHeader(
-            "Filter Options",
-            style={"backgroundColor": "#1A73E8", "color": "white"},
-            className="shadow-sm"
-        ),
-        dbc.CardBody([
-            dbc.Row([
-                dbc.Col([
-                    html.Label("Filter by Year:", className="me-2 fw-semibold"),
-                    dcc.Dropdown(
-                        id="year-dropdown",
-                        options=[{"label": y, "value": y} for y in sorted(table1["YEAR"].unique())],
-                        value=2019,
-                        placeholder="Select year...",
-                        multi=False
-                    ),
-                ], md=6),
-
-                dbc.Col([
-                    html.Label("Filter by Sector:", className="me-2 fw-semibold"),
-                    dcc.Dropdown(
-                        id="industry-dropdown",
-                        options=[{"label": industry, "value": industry}
-                                 for industry in sorted(table1["NAICS2017_LABEL"].unique())] +
-                                [{"label": "All Sectors", "value": "All"}],
-                        value="All",
-                        clearable=False
-                    )
-                ], md=6),
-            ]),
-
-            html.Br(),
-
-            # Bar-plot controls
-            dbc.Row([
-                dbc.Col([
-                    html.Label("Select Demographic (X-Axis):", className="me-2 fw-semibold"),
-                    dcc.Dropdown(
-                        id='bar-dem-dropdown',
-                        options=[{'label': standardize_label_map[col], 'value': col} for col in dem_labels],
-                        value="SEX_LABEL",
-                        clearable=False,
-                    ),
-                
-                # ], md=4),
-                # dbc.Col([
-                #     # Label + checkbox on one line
-                    html.Div(
-                        [
-                            html.Span("Color by Second Demographic?", className="me-2 fw-semibold"),
-                            dbc.Checkbox(
-                                id="compare-toggle",
-                                value=False,
-                                label="",
-                                label_class_name="mb-0", 
+                        # The dropdown lives in its own container so we can hide/show it
+                        html.Div(
+                            dcc.Dropdown(
+                                id='color-dem-dropdown',
+                                options=[{'label': standardize_label(col), 'value': col} for col in dem_labels],
+                                value="RACE_GROUP_LABEL",
+                                clearable=False,
                             ),
-                        ],
-                        className="d-flex align-items-center gap-2"
-                    ),
+                            id="color-dem-container",
+                            className="mt-2"
+                        ),
+                    ], md=6),
 
-                    # The dropdown lives in its own container so we can hide/show it
-                    html.Div(
+                    dbc.Col([
+                        html.Label("Select Measure (Y-Axis):", className="me-2 fw-semibold"),
                         dcc.Dropdown(
-                            id='color-dem-dropdown',
-                            options=[{'label': standardize_label(col), 'value': col} for col in dem_labels],
-                            value="RACE_GROUP_LABEL",
-                            clearable=False,
-                        ),
-                        id="color-dem-container",
-                        className="mt-2"
-                    ),
-                ], md=6),
-
-                dbc.Col([
-                    html.Label("Select Measure (Y-Axis):", className="me-2 fw-semibold"),
-                    dcc.Dropdown(
-                        id='yaxis-metric-dropdown',
-                        options=[
-                            {'label': 'Firm Counts', 'value': 'FIRMNOPD'},
-                            {'label': 'Owner Counts', 'value': 'OWNNOPD'},
-                            {'label': 'Business Receipts', 'value': 'RCPNOPD'},
-                            {'label': 'Avg Receipts per Firm', 'value': 'AVG_REVENUE_PER_FIRM'}
-                        ],
-                        value='FIRMNOPD',
-                        clearable=False
-                    )
-                ], md=6),
-            ]),
-
-            html.Br(),
-
-            # --- Tabs --- #
-            dbc.Tabs([
-                dbc.Tab(label='Bar Plot', tab_id='bar'),
-                dbc.Tab(label='Time Series', tab_id='line'),
-                dbc.Tab(label='Stacked Area Plot', tab_id='stacked-plot')
-            ], id='plot-tabs', active_tab='bar'),
-
-            html.Br(),
-
-            # --- Plots --- #
-            dbc.Card([
-                dbc.CardBody([
-                    dcc.Loading(
-                        id="loading-plot",
-                        type="default",
-                        children=html.Div(id='plot-content')
-                    )
-                ])
-            ], style={"backgroundColor": "#f9f9f9"}),
+                            id='yaxis-metric-dropdown',
+                            options=[
+                                {'label': 'Firm Counts', 'value': 'FIRMNOPD'},
+                                {'label': 'Owner Counts', 'value': 'OWNNOPD'},
+                                {'label': 'Business Receipts', 'value': 'RCPNOPD'},
+                                {'label': 'Avg Receipts per Firm', 'value': 'AVG_REVENUE_PER_FIRM'}
+                            ],
+                            value='FIRMNOPD',
+                            clearable=False
+                        )
+                    ], md=6),
+                ]),
+
+                html.Br(),
+
+                # --- Tabs --- #
+                dbc.Tabs([
+                    dbc.Tab(label='Bar Plot', tab_id='bar'),
+                    dbc.Tab(label='Time Series', tab_id='line'),
+                    dbc.Tab(label='Stacked Area Plot', tab_id='stacked-plot')
+                ], id='plot-tabs', active_tab='bar'),
+
+                html.Br(),
+
+                # --- Plots --- #
+                dbc.Card([
+                    dbc.CardBody([
+                        dcc.Loading(
+                            id="loading-plot",
+                            type="default",
+                            # spinner + progress text of a chart rendered as a background job
+                            custom_spinner=html.Div([
+                                dbc.Spinner(color="primary"),
+                                html.Div(id="plot-render-progress", className="mt-2 text-muted"),
+                            ], className="text-center"),
+                            children=html.Div([
+                                # title + info icon, filled in by the plot callback
+                                html.Div(
+                                    [
+                                        html.Span(
+                                            id="plot-title",
+                                            className="fw-bold",
+                                            style={"fontSize": "1.5rem", "textAlign": "center", "flex": "1"}
+                                        ),
+                                        html.Span(
+                                            "ℹ",
+                                            id="plot-info",
+                                            className="ms-2",
+                                            style={"cursor": "pointer", "color": "#0d6efd", "fontWeight": "600", "fontSize": "1.3rem"}
+                                        ),
+                                        dbc.Tooltip(
+                                            id="plot-info-tooltip",
+                                            target="plot-info",
+                                            placement="right",
+                                        ),
+                                    ],
+                                    className="d-flex align-items-center justify-content-center mb-2"
+                                ),
+                                dcc.Graph(id="plot-graph"),
+                                # inputs of the figure on screen, so the next update can be sent as a diff
+                                dcc.Store(id="plot-figure-inputs"),
+                                # inputs of a figure handed to a background job (not rendered yet)
+                                dcc.Store(id="plot-render-request"),
+                            ], id='plot-content')
+                        )
+                    ])
+                ], style={"backgroundColor": "#f9f9f9"}),
+            ])
         ])
-    ])
-], fluid=True)
+    ], fluid=True)
 
-#------------------- Bar Plot ---------------#
-def update_plot(group_by, year_select, selected_industry, y_metric="AVG_REVENUE_PER_FIRM", color_group=None):
-
-    if y_metric == "OWNNOPD":
 
-        owner_label_map = {
-        "SEX_LABEL": "OWNER_SEX_LABEL",
-        "RACE_GROUP_LABEL": "OWNER_RACE_LABEL",
-        "ETH_GROUP_LABEL": "OWNER_ETH_LABEL",
-        "VET_GROUP_LABEL": "OWNER_VET_LABEL",
-        "FOREIGN_BORN_GROUP_LABEL": "OWNER_FOREIGN_BORN_LABEL",
-        "W2_GROUP_LABEL": "OWNER_W2_LABEL"
-        }
+# the page without its data-dependent options, for dash to check the callback ids
+# against (it would otherwise call serve_layout right here, waiting for the data)
+app.validation_layout = serve_layout(options=([], []))
+app.layout = serve_layout
 
-        df = table_owner.copy()
-
-        
-        group_by_owner = owner_label_map.get(group_by, group_by)
-        color_group_owner = owner_label_map.get(color_group, color_group) if color_group else None
 
-        unused_owner_cols = ["OWNER_AGE_LABEL", "OWNER_USCITIZEN_LABEL"]
-        df = df.drop(columns=[col for col in unused_owner_cols if col in df.columns], errors="ignore")
-
-        df = df[df["OWNER_RACE_LABEL"] != "All owners of nonemployer firms"]
-        df = df[df["NAICS2017_LABEL"] != "Total for all sectors"]
-
-     
-        # remove totals from active dimensions  
-        if group_by_owner in df.columns:
-            df = df[df[group_by_owner] != "All owners of nonemployer firms"]
+#------------------- Bar Plot ---------------#
+def update_plot(group_by, year_select, selected_industry, y_metric="AVG_REVENUE_PER_FIRM", color_group=None, cube=None):
+    import plotly.express as px  # on first use: a page served from the caches never needs it
 
-        if color_group_owner and color_group_owner != group_by_owner and color_group_owner in df.columns:
-            df = df[df[color_group_owner] != "All owners of nonemployer firms"]
+    if cube is None:
+        cube = registry.current.cube
 
-        
-        for owner_col in owner_label_map.values():
-            # if owner dem is not being actively used
-            if owner_col in df.columns and owner_col not in [group_by_owner, color_group_owner]:
-                if df[owner_col].nunique() > 1:
-                    df = df[df[owner_col] != "All owners of nonemployer firms"]
+    # filtering + groupby happen at ingest (nesd_query); this is a cube lookup
+    bar_df = cube.bar(group_by, year_select, selected_industry, y_metric, color_group)
 
-        group_cols = [group_by_owner]
-        if color_group_owner and color_group_owner != group_by_owner:
-            group_cols.append(color_group_owner)
+    if y_metric == "OWNNOPD":
 
-        bar_df = df.groupby(group_cols, as_index=False).agg(
-            y_value=("OWNNOPD", "sum")
-        )
+        group_by_owner = owner_label_map.get(group_by, group_by)
+        color_group_owner = owner_label_map.get(color_group, color_group) if color_group else None
 
         # title label
         x_pretty = standardize_label(group_by_owner)
@@ -303,75 +451,26 @@ def update_plot(group_by, year_select, selected_industry, y_metric="AVG_REVENUE_
         )
 
         # px.bar for OWNER:
-        fig = px.bar(
-            bar_df,
-            x=group_by_owner,
-            y="y_value",
-            color=color_group_owner if color_group_owner and color_group_owner in bar_df.columns else None,
-            barmode="group",
-            labels={
-                "y_value": "Owner Counts",
-                group_by_owner: x_pretty,
-                color_group_owner: c_pretty if color_group_owner else None
-            },
-            color_discrete_sequence=px.colors.qualitative.Safe
-        )
-        fig.update_layout(
-            title={"text": dynamic_title, "x": 0.5, "xanchor": "center"}
-        )
+        with span("px"):
+            fig = px.bar(
+                bar_df,
+                x=group_by_owner,
+                y="y_value",
+                color=color_group_owner if color_group_owner and color_group_owner in bar_df.columns else None,
+                barmode="group",
+                labels={
+                    "y_value": "Owner Counts",
+                    group_by_owner: x_pretty,
+                    color_group_owner: c_pretty if color_group_owner else None
+                },
+                color_discrete_sequence=px.colors.qualitative.Safe
+            )
+        with span("layout"):
+            fig.update_layout(
+                title={"text": dynamic_title, "x": 0.5, "xanchor": "center"}
+            )
 
     else:
-        df = table1.copy()
-
-        # remove minority, nonminority, and equally
-        if "RACE_GROUP_LABEL" in df.columns:
-            exclude_terms = ["minority", "nonminority", "equally"]
-            df = df[~df["RACE_GROUP_LABEL"].str.lower().str.contains('|'.join(exclude_terms), na=False)]
-
-        if "ETH_GROUP_LABEL" in df.columns:
-            exclude_terms = ["equally"]
-            df = df[~df["ETH_GROUP_LABEL"].str.lower().str.contains('|'.join(exclude_terms), na=False)]
-        
-        
-        if year_select:
-            if not isinstance(year_select, list):
-                year_select = [year_select]
-            df = df[df["YEAR"].isin(year_select)]
-
-        if selected_industry != "All":
-            df = df[df["NAICS2017_LABEL"] == selected_industry]
-        else:
-            if "Total for all sectors" in df["NAICS2017_LABEL"].unique():
-                df = df[df["NAICS2017_LABEL"] == "Total for all sectors"]
-  
-        # filtering out Totals for active dems used: 
-        if group_by in df.columns:
-            df = df[df[group_by] != "Total"]
-        if color_group and color_group != group_by and color_group in df.columns:
-            df = df[df[color_group] != "Total"]
-
-        for col in dem_labels:
-            if col in df.columns and col not in [group_by, color_group]:
-                # skip LFO unless it's being used
-                if col == "LFO_LABEL":
-                    continue
-                if "Total" in df[col].unique():
-                    # keep only Total vals in unused cols to avoid double counts
-                    df = df[df[col] == "Total"]
-                
-        
-        group_cols = [group_by, color_group] if color_group else [group_by]
-        group_cols = list(dict.fromkeys(group_cols))
-
-        # update to handle diff metrics:
-        if y_metric == "FIRMNOPD":
-            bar_df = df.groupby(group_cols, as_index=False).agg(y_value=("FIRMNOPD", "sum"))
-        elif y_metric == "RCPNOPD":
-            bar_df = df.groupby(group_cols, as_index=False).agg(y_value=("RCPNOPD", "sum"))
-        elif y_metric == "AVG_REVENUE_PER_FIRM":
-            bar_df = df.groupby(group_cols, as_index=False).agg(y_value=("AVG_REVENUE_PER_FIRM", "mean"))
-
-            
         # plotting for FIRM LEVEL:
         y_axis_labels = {
             "FIRMNOPD": "Firm Counts",
@@ -388,39 +487,43 @@ def update_plot(group_by, year_select, selected_industry, y_metric="AVG_REVENUE_
             + (f" and Colored by {c_pretty}" if color_group and color_group != group_by else "")
         )
 
-        fig = px.bar(
-            bar_df,
-            x=group_by,
-            y="y_value",
-            color=color_group if color_group and color_group in bar_df.columns else None,
-            barmode="group",
-            labels={
-                "y_value": y_axis_labels.get(y_metric, y_metric),
-                group_by: x_pretty,
-                color_group: c_pretty if color_group else None
-            },
-            color_discrete_sequence=px.colors.qualitative.Safe
-        )
-        fig.update_layout(
-            title={"text": dynamic_title, "x": 0.5, "xanchor": "center"}
-        )
+        with span("px"):
+            fig = px.bar(
+                bar_df,
+                x=group_by,
+                y="y_value",
+                color=color_group if color_group and color_group in bar_df.columns else None,
+                barmode="group",
+                labels={
+                    "y_value": y_axis_labels.get(y_metric, y_metric),
+                    group_by: x_pretty,
+                    color_group: c_pretty if color_group else None
+                },
+                color_discrete_sequence=px.colors.qualitative.Safe
+            )
+        with span("layout"):
+            fig.update_layout(
+                title={"text": dynamic_title, "x": 0.5, "xanchor": "center"}
+            )
     
 
-    fig.update_layout(
-        transition_duration=500,
-        xaxis_tickangle=-45,
-        title_x=0.5,
-        plot_bgcolor="#f9f9f9",
-        paper_bgcolor="#ffffff",
-        font=dict(family="Segoe UI", size=13),
-    )
-    fig.update_traces(marker=dict(line=dict(width=1, color='#d4d2d2')))
+    with span("layout"):
+        fig.update_layout(
+            transition_duration=500,
+            xaxis_tickangle=-45,
+            title_x=0.5,
+            plot_bgcolor="#f9f9f9",
+            paper_bgcolor="#ffffff",
+            font=dict(family="Segoe UI", size=13),
+        )
+        fig.update_traces(marker=dict(line=dict(width=1, color='#d4d2d2')))
 
     return fig
 
 
 #------------------- Line Plot ---------------#
-def update_line_plot(selected_industry, y_metric, x_dem):
+def update_line_plot(selected_industry, y_metric, x_dem, cube=None):
+    import plotly.express as px
  
  # using same structure as bar plot -> add x_dem filtering
     
@@ -433,186 +536,82 @@ def update_line_plot(selected_industry, y_metric, x_dem):
         "OWNNOPD": "Owner Counts",
     }
 
+    if cube is None:
+        cube = registry.current.cube
+    line_df = cube.line(selected_industry, y_metric, x_dem)
+
     # owner level
     if y_metric == "OWNNOPD":
-        owner_label_map = {
-            "SEX_LABEL": "OWNER_SEX_LABEL",
-            "RACE_GROUP_LABEL": "OWNER_RACE_LABEL",
-            "ETH_GROUP_LABEL": "OWNER_ETH_LABEL",
-            "VET_GROUP_LABEL": "OWNER_VET_LABEL",
-            "FOREIGN_BORN_GROUP_LABEL": "OWNER_FOREIGN_BORN_LABEL",
-            "W2_GROUP_LABEL": "OWNER_W2_LABEL",
-        }
-
-        df = table_owner.copy()
-
-        
-        unused_owner_cols = ["OWNER_AGE_LABEL", "OWNER_USCITIZEN_LABEL"]
-        df = df.drop(columns=[c for c in unused_owner_cols if c in df.columns], errors="ignore")
-
-        
-        if selected_industry and selected_industry != "All":
-            df = df[df["NAICS2017_LABEL"] == selected_industry]
-        else:
-            if "Total for all sectors" in df["NAICS2017_LABEL"].unique():
-                df = df[df["NAICS2017_LABEL"] == "Total for all sectors"]
-
         group_by_owner = owner_label_map.get(x_dem, x_dem)
 
- 
-        if group_by_owner in df.columns:
-            df = df[df[group_by_owner] != "All owners of nonemployer firms"]
-
-        for owner_col in owner_label_map.values():
-            if owner_col in df.columns and owner_col != group_by_owner:
-                if df[owner_col].nunique() > 1:
-                    df = df[df[owner_col] != "All owners of nonemployer firms"]
-
-        group_cols = ["YEAR"]
-        if group_by_owner in df.columns:
-            group_cols.append(group_by_owner)
-
-        line_df = df.groupby(group_cols, as_index=False).agg(y_value=("OWNNOPD", "sum"))
-
-        g_pretty = standardize_label(group_by_owner) if group_by_owner in df.columns else None
+        g_pretty = standardize_label(group_by_owner) if group_by_owner in line_df.columns else None
         title = "Owner Counts over Time" + (f" by {g_pretty}" if g_pretty else "")
 
-        fig = px.line(
-            line_df,
-            x="YEAR",
-            y="y_value",
-            color=(group_by_owner if group_by_owner in line_df.columns else None),
-            markers=True,
-            labels={"YEAR": "Year", "y_value": y_axis_labels["OWNNOPD"], group_by_owner: g_pretty if g_pretty else None},
-            title=title,
-            color_discrete_sequence=px.colors.qualitative.Safe
-        )
+        with span("px"):
+            fig = px.line(
+                line_df,
+                x="YEAR",
+                y="y_value",
+                color=(group_by_owner if group_by_owner in line_df.columns else None),
+                markers=True,
+                labels={"YEAR": "Year", "y_value": y_axis_labels["OWNNOPD"], group_by_owner: g_pretty if g_pretty else None},
+                title=title,
+                color_discrete_sequence=px.colors.qualitative.Safe
+            )
 
     # Firm level counts:
     else:
-        df = table1.copy()
-
-        # remove "equally" for race/eth
-        if "RACE_GROUP_LABEL" in df.columns:
-            df = df[~df["RACE_GROUP_LABEL"].str.lower().str.contains("minority|nonminority|equally", na=False)]
-        if "ETH_GROUP_LABEL" in df.columns:
-            df = df[~df["ETH_GROUP_LABEL"].str.lower().str.contains("equally", na=False)]
-
-        if selected_industry and selected_industry != "All":
-            df = df[df["NAICS2017_LABEL"] == selected_industry]
-        else:
-            if "Total for all sectors" in df["NAICS2017_LABEL"].unique():
-                df = df[df["NAICS2017_LABEL"] == "Total for all sectors"]
-
         group_by = x_dem
 
-        # Remove "Total" 
-        if group_by in df.columns:
-            df = df[df[group_by] != "Total"]
-
-       # keep only totals for unused dem cols
-        for col in dem_labels:
-            if col in df.columns and col != group_by:
-                if col == "LFO_LABEL":
-                    continue
-                if "Total" in df[col].unique():
-                    df = df[df[col] == "Total"]
-
-        # group by + year agg
-        group_cols = ["YEAR"]
-        if group_by in df.columns:
-            group_cols.append(group_by)
-
-        if y_metric == "FIRMNOPD":
-            line_df = df.groupby(group_cols, as_index=False).agg(y_value=("FIRMNOPD", "sum"))
-        elif y_metric == "RCPNOPD":
-            line_df = df.groupby(group_cols, as_index=False).agg(y_value=("RCPNOPD", "sum"))
-        elif y_metric == "AVG_REVENUE_PER_FIRM":
-            line_df = df.groupby(group_cols, as_index=False).agg(y_value=("AVG_REVENUE_PER_FIRM", "mean"))
-        else:
-            line_df = df.groupby(group_cols, as_index=False).agg(y_value=(y_metric, "sum"))
-
-        g_pretty = standardize_label(group_by) if group_by in df.columns else None
+        g_pretty = standardize_label(group_by) if group_by in line_df.columns else None
         y_pretty = y_axis_labels.get(y_metric, y_metric)
         title = f"{y_pretty} over Time" + (f" by {g_pretty}" if g_pretty else "")
 
-        fig = px.line(
-            line_df,
-            x="YEAR",
-            y="y_value",
-            color=(group_by if group_by in line_df.columns else None),
-            markers=True,
-            labels={"YEAR": "Year", "y_value": y_pretty, group_by: g_pretty if g_pretty else None},
-            title=title,
-            color_discrete_sequence=px.colors.qualitative.Safe
-        )
+        with span("px"):
+            fig = px.line(
+                line_df,
+                x="YEAR",
+                y="y_value",
+                color=(group_by if group_by in line_df.columns else None),
+                markers=True,
+                labels={"YEAR": "Year", "y_value": y_pretty, group_by: g_pretty if g_pretty else None},
+                title=title,
+                color_discrete_sequence=px.colors.qualitative.Safe
+            )
 
     
-    fig.update_traces(mode="lines+markers", marker=dict(size=6, line=dict(width=1, color="#d4d2d2")))
-    fig.update_layout(
-        template="plotly_white",
-        transition_duration=500,
-        xaxis_tickangle=-45,
-        title_x=0.5,
-        plot_bgcolor="#f9f9f9",
-        paper_bgcolor="#ffffff",
-        font=dict(family="Segoe UI", size=13),
-    )
+    with span("layout"):
+        fig.update_traces(mode="lines+markers", marker=dict(size=6, line=dict(width=1, color="#d4d2d2")))
+        fig.update_layout(
+            template="plotly_white",
+            transition_duration=500,
+            xaxis_tickangle=-45,
+            title_x=0.5,
+            plot_bgcolor="#f9f9f9",
+            paper_bgcolor="#ffffff",
+            font=dict(family="Segoe UI", size=13),
+        )
 
     return fig
 
 
 
 #------------------ Stacked Area Plot ---------------#
-def update_stacked_area_plot(industry, y_metric, x_dem):
-    # owner count ratio:
-    if y_metric == "OWNNOPD":
-
-        owner_label_map = {
-            "SEX_LABEL": "OWNER_SEX_LABEL",
-            "RACE_GROUP_LABEL": "OWNER_RACE_LABEL",
-            "ETH_GROUP_LABEL": "OWNER_ETH_LABEL",
-            "VET_GROUP_LABEL": "OWNER_VET_LABEL",
-            "FOREIGN_BORN_GROUP_LABEL": "OWNER_FOREIGN_BORN_LABEL",
-            "W2_GROUP_LABEL": "OWNER_W2_LABEL",
-        }
-
-        df = table_owner.copy()
+def update_stacked_area_plot(industry, y_metric, x_dem, cube=None):
+    import plotly.express as px
 
-        df = df[df["NAICS2017_LABEL"] != "Total for all sectors"]
+    if cube is None:
+        cube = registry.current.cube
+    group_df = cube.area(industry, y_metric, x_dem)
 
-        if industry and industry != "All":
-            df = df[df["NAICS2017_LABEL"] == industry]
-        
-        df = df[df[owner_label_map.get(x_dem, x_dem)] != "All owners of nonemployer firms"]
+    # owner count ratio:
+    if y_metric == "OWNNOPD":
         group_col = owner_label_map.get(x_dem, x_dem)
-        
-        # group by year + x_dem (group_col) 
-        group_df = df.groupby(["YEAR", group_col], as_index=False)["OWNNOPD"].sum()
-        # calc total and percentage (ratio):
-        group_df["TOTAL"] = group_df.groupby("YEAR")["OWNNOPD"].transform("sum")
-        group_df["PERCENTAGE"] = (group_df["OWNNOPD"] / group_df["TOTAL"]) * 100
         # y metric:
         y_label = "Owner Share (%)"
 
     # firm count ratio + business receipt ratio:
     else:
-        df = table1.copy()
-
-        if industry and industry != "All":
-                df = df[df["NAICS2017_LABEL"] == industry]
-
-        df = df[df[x_dem] != "Total"]
-
-        # df = df[df["NAICS2017_LABEL"] != "Total for all sectors"]
-
-        # Group by year and industry and sum firm counts
-        group_df = df.groupby(["YEAR", x_dem], as_index=False)[y_metric].sum()
-        # Calculate total firms per year
-        group_df["TOTAL"] = group_df.groupby("YEAR")[y_metric].transform("sum")
-        # Calculate percentage (ratio)
-        group_df["PERCENTAGE"] = (group_df[y_metric] / group_df["TOTAL"]) * 100
-
         # choose which y_metric to use:
         y_label = {
             "FIRMNOPD": "Firm Share (%)",
@@ -622,213 +621,439 @@ def update_stacked_area_plot(industry, y_metric, x_dem):
     # Plot
     x_pretty = standardize_label(x_dem)
 
-    fig = px.area(
-        group_df,
-        x="YEAR",
-        y="PERCENTAGE",
-        color=group_col if y_metric == "OWNNOPD" else x_dem,
-        line_group=group_col if y_metric == "OWNNOPD" else x_dem,
-        labels={
-            "PERCENTAGE": y_label,
-            **({group_col: x_pretty} if y_metric == "OWNNOPD" else {x_dem: x_pretty})
-        },
-        title=f"{y_label.replace(' (%)', '')} by {x_pretty} Over Time",
-        color_discrete_sequence=px.colors.qualitative.Safe
-    )
+    with span("px"):
+        fig = px.area(
+            group_df,
+            x="YEAR",
+            y="PERCENTAGE",
+            color=group_col if y_metric == "OWNNOPD" else x_dem,
+            line_group=group_col if y_metric == "OWNNOPD" else x_dem,
+            labels={
+                "PERCENTAGE": y_label,
+                **({group_col: x_pretty} if y_metric == "OWNNOPD" else {x_dem: x_pretty})
+            },
+            title=f"{y_label.replace(' (%)', '')} by {x_pretty} Over Time",
+            color_discrete_sequence=px.colors.qualitative.Safe
+        )
 
-    fig.update_layout(
-        title_x=0.5,
-        template="plotly_white",
-        yaxis_ticksuffix="%",
-        xaxis_tickangle=-45,
-        font=dict(family="Segoe UI", size=13)
-    )
+    with span("layout"):
+        fig.update_layout(
+            title_x=0.5,
+            template="plotly_white",
+            yaxis_ticksuffix="%",
+            xaxis_tickangle=-45,
+            font=dict(family="Segoe UI", size=13)
+        )
 
     return fig
 
 
 
 #-------------  Plot Callback with Tabs ----------------#
-@app.callback(
-    Output('plot-content', 'children'),
-    Input('plot-tabs', 'active_tab'), # update tab callback
-    Input('bar-dem-dropdown', 'value'),
-    Input('color-dem-dropdown', 'value'),
-    Input('yaxis-metric-dropdown', 'value'),
-    Input('industry-dropdown', 'value'),
-    Input('year-dropdown', 'value'),
-    Input('compare-toggle', 'value') 
+# rendered figures are cached as JSON (LRU, bounded by entries and MB)
+figure_cache = FigureCache(
+    max_entries=int(os.environ.get("NESD_FIGURE_CACHE_ENTRIES", 256)),
+    max_bytes=int(os.environ.get("NESD_FIGURE_CACHE_MB", 64)) * 1024 * 1024,
 )
-def render_tab_content(tab, x_dem, color_dem, y_metric, industry, year, compare_on):
+
+# ...backed by a SQLite cache every gunicorn worker shares; figures are tagged
+# with the data fingerprint, so new data files invalidate them.
+# NESD_SHARED_CACHE_DIR="" turns it off
+shared_cache_dir = os.environ.get("NESD_SHARED_CACHE_DIR", os.path.join(tempfile.gettempdir(), "nesd-dashboard-cache"))
+shared_cache = SharedFigureCache(
+    shared_cache_dir,
+    data_version=version_fingerprint(registry.version),
+    ttl=int(os.environ.get("NESD_SHARED_CACHE_TTL", 24 * 3600)),
+    max_bytes=int(os.environ.get("NESD_SHARED_CACHE_MB", 256)) * 1024 * 1024,
+) if shared_cache_dir else None
+
+
+@registry.on_swap
+def drop_old_figures(old, new):
+    # cache keys carry the data version, so nothing stale can be served even
+    # by a request still finishing on the old dataset; this frees the memory
+    figure_cache.clear()
+    if shared_cache is not None:
+        shared_cache.set_data_version(new.cube.fingerprint)
+
+# per tab: fallback title, tooltip text
+plot_info = {
+    'bar': (
+        "Bar Plot",
+        "This chart shows values grouped by the selected demographic. "
+        "Enable 'Color by demographic' to compare two demographic groups at once.",
+    ),
+    'line': (
+        "Time Series Plot",
+        "This chart shows selected measure trends over time based on the selected demographic.",
+    ),
+    'stacked-plot': (
+        "Stacked Area Plot",
+        "Displays the proportion of each category in the selected demographic "
+        "across the time period shown for the selected demographic.",
+    ),
+}
+
+
+def figure_key(tab, x_dem, color_dem, y_metric, industry, year, compare_on):
+    # only the inputs a tab actually uses, normalized the same way the cube is
+    # (color is dropped while compare is off, year/sector for owner bars, ...)
     if tab == 'bar':
-        # add toggle handling
         color_value = color_dem if (compare_on and color_dem and color_dem != x_dem) else None
-        fig = update_plot(x_dem, year, industry, y_metric, color_value)
+        return AggregateCube.bar_key(x_dem, year, industry, y_metric, color_value)
+    elif tab == 'line':
+        return AggregateCube.line_key(industry, y_metric, x_dem)
+    elif tab == 'stacked-plot':
+        return AggregateCube.area_key(industry, y_metric, x_dem)
+    return None
 
-        title_text = getattr(fig.layout.title, "text", None) or "Bar Plot"
-        fig.update_layout(title=None)
 
-        return html.Div([
-            html.Div(
-                [
-                    html.Span(
-                        title_text,
-                        className="fw-bold",
-                        style={"fontSize": "1.5rem", "textAlign": "center", "flex": "1"}
-                    ),
-                    html.Span(
-                        "ℹ",
-                        id="barplot-info",
-                        className="ms-2",
-                        style={"cursor": "pointer", "color": "#0d6efd", "fontWeight": "600", "fontSize": "1.3rem"}
-                    ),
-                    dbc.Tooltip(
-                        "This chart shows values grouped by the selected demographic. "
-                        "Enable 'Color by demographic' to compare two demographic groups at once.",
-                        target="barplot-info",
-                        placement="right",
-                    ),
-                ],
-                className="d-flex align-items-center justify-content-center mb-2"
-            ),
-            dcc.Graph(figure=fig)
-        ])
+def valid_inputs(inputs):
+    # the plot inputs as the page's dropdowns can send them; anything else is a forged request
+    if not isinstance(inputs, (list, tuple)) or len(inputs) != 7:
+        return False
+    tab, x_dem, color_dem, y_metric, industry, year, _ = inputs
+    years = year if isinstance(year, list) else [year]
+    return (
+        tab in plot_info and x_dem in dem_labels and y_metric in metrics
+        and (color_dem is None or color_dem in dem_labels)
+        and isinstance(industry, str)
+        and all(y is None or (isinstance(y, int) and not isinstance(y, bool)) for y in years)
+    )
+
+
+def no_data_content(message="No data for this selection"):
+    # (title, info, figure, figure inputs) for a combination that can't be rendered;
+    # no figure inputs, so the next chart is sent whole rather than diffed against this
+    figure = {
+        "data": [],
+        "layout": {
+            "xaxis": {"visible": False},
+            "yaxis": {"visible": False},
+            "annotations": [{"text": message, "showarrow": False, "font": {"size": 16},
+                             "xref": "paper", "yref": "paper", "x": 0.5, "y": 0.5}],
+        },
+    }
+    return message, no_update, figure, None
 
+
+def build_figure(tab, x_dem, color_dem, y_metric, industry, year, compare_on, cube=None):
+    # -> '{"title": ..., "figure": ...}' JSON, the form the figure caches hold
+    if tab == 'bar':
+        # add toggle handling
+        color_value = color_dem if (compare_on and color_dem and color_dem != x_dem) else None
+        fig = update_plot(x_dem, year, industry, y_metric, color_value, cube=cube)
     elif tab == 'line':
-        fig = update_line_plot(industry, y_metric, x_dem)
-    
-        title_text = getattr(fig.layout.title, "text", None) or "Time Series Plot"
+        fig = update_line_plot(industry, y_metric, x_dem, cube=cube)
+    else:
+        fig = update_stacked_area_plot(industry, y_metric, x_dem, cube=cube)
+
+    title_text = getattr(fig.layout.title, "text", None) or plot_info[tab][0]
+    with span("layout"):
         fig.update_layout(title=None)
 
-        return html.Div([
-            html.Div(
-                [
-                    html.Span(
-                        title_text,
-                        className="fw-bold",
-                        style={"fontSize": "1.5rem", "textAlign": "center", "flex": "1"}
-                    ),
-                    html.Span(
-                        "ℹ",
-                        id="lineplot-info",
-                        className="ms-2",
-                        style={"cursor": "pointer", "color": "#0d6efd",
-                            "fontWeight": "600", "fontSize": "1.3rem"}
-                    ),
-                    dbc.Tooltip(
-                        "This chart shows selected measure trends over time based on the selected demographic.",
-                        target="lineplot-info",
-                        placement="right",
-                    ),
-                ],
-                className="d-flex align-items-center justify-content-center mb-2"
-            ),
-            dcc.Graph(figure=fig)
-        ])
-    
-    elif tab == 'stacked-plot':
-        fig = update_stacked_area_plot(industry, y_metric, x_dem)
-        # return dcc.Graph(figure=fig)
+    with span("serialize"):
+        return '{"title": %s, "figure": %s}' % (json.dumps(title_text), fig.to_json())
+
+
+class NeedsQuery(Exception):
+    pass
+
+
+def cached_figure(inputs, data=None, run_queries=True):
+    # data: the Dataset to render from (default: the current one);
+    # run_queries=False -> None if the figure isn't cached and its data isn't in the cube
+    data = data or registry.current
+    chart_key = figure_key(*inputs)
+    key = (data.version, chart_key) if chart_key is not None else None
+
+    def build():
+        if not run_queries and chart_key not in data.cube:
+            raise NeedsQuery
+        return build_figure(*inputs, cube=data.cube)
+
+    compute = build
+    if data.bundle is not None:
+        # anything the bundle lacks (e.g. multi-year selections) is rendered live
+        compute = lambda: data.bundle.get(chart_key) or build()
+    elif shared_cache is not None:
+        compute = partial(shared_cache.get_or_compute, key, build)
+    try:
+        rendered = figure_cache.get_or_compute(key, compute)
+    except NeedsQuery:
+        return None
+    with span("decode"):
+        return json.loads(rendered)
+
+
+def diff_figure(patch, old, new):
+    # record on `patch` the assignments / deletions that turn `old` into `new`:
+    # dicts and equal-length lists of dicts (the trace list, annotations) are
+    # diffed item by item, anything else that changed is replaced whole
+    if isinstance(old, dict):
+        for k in old.keys() - new.keys():
+            del patch[k]
+        items = new.items()
+    else:
+        items = enumerate(new)
+
+    for k, value in items:
+        if isinstance(old, dict) and k not in old:
+            patch[k] = value
+        elif old[k] != value:
+            both_dicts = isinstance(old[k], dict) and isinstance(value, dict)
+            trace_lists = (
+                isinstance(old[k], list) and isinstance(value, list) and len(old[k]) == len(value)
+                and all(isinstance(v, dict) for v in old[k] + value)
+            )
+            if both_dicts or trace_lists:
+                diff_figure(patch[k], old[k], value)
+            else:
+                patch[k] = value
+
+
+def tab_content(inputs, shown_inputs, data, run_queries=True):
+    # -> (title, info, figure, figure inputs) for the plot area; None if
+    # run_queries=False and the figure needs a live query
+    rendered = cached_figure(tuple(inputs), data, run_queries)
+    if rendered is None:
+        return None
+    _, info_text = plot_info[inputs[0]]
+    on_screen = list(inputs) + [data.version]
+
+    # first render / tab switch / figure from older data: send everything
+    if not shown_inputs or shown_inputs[0] != inputs[0] or shown_inputs[-1] != data.version:
+        return rendered["title"], info_text, rendered["figure"], on_screen
+
+    # same tab: send only the traces / layout fields that differ from the figure on screen
+    shown = cached_figure(tuple(shown_inputs[:-1]), data, run_queries)
+    if shown is None:
+        return rendered["title"], info_text, rendered["figure"], on_screen
+    title = rendered["title"] if rendered["title"] != shown["title"] else no_update
+    if rendered["figure"] == shown["figure"]:
+        return title, no_update, no_update, on_screen
+    figure = Patch()
+    with span("diff"):
+        diff_figure(figure, shown["figure"], rendered["figure"])
+    return title, no_update, figure, on_screen
+
+
+# Charts whose data isn't in the cube (a live filter + groupby over the tables)
+# are rendered by a Dash background callback: a job process of a
+# diskcache-backed manager, so a burst of slow queries doesn't hold up the
+# request threads that serve cheap interactions. A job is cancelled when the
+# user changes the inputs again. Cube-backed charts stay inline: starting and
+# polling a job costs more than rendering them.
+# Needs diskcache + multiprocess; NESD_BACKGROUND_DIR="" runs everything inline.
+background_dir = os.environ.get("NESD_BACKGROUND_DIR", os.path.join(tempfile.gettempdir(), "nesd-dashboard-jobs"))
+background_manager = None
+if background_dir:
+    try:
+        import diskcache
+        background_manager = dash.DiskcacheManager(diskcache.Cache(background_dir))
+    except ImportError:
+        logging.info("diskcache / multiprocess not installed: rendering charts inline")
+
+plot_inputs = [
+    Input('plot-tabs', 'active_tab'), # update tab callback
+    Input('bar-dem-dropdown', 'value'),
+    Input('color-dem-dropdown', 'value'),
+    Input('yaxis-metric-dropdown', 'value'),
+    Input('industry-dropdown', 'value'),
+    Input('year-dropdown', 'value'),
+    Input('compare-toggle', 'value'),
+]
 
-        title_text = getattr(fig.layout.title, "text", None) or "Stacked Area Plot"
-        fig.update_layout(title=None)
 
-        return html.Div([
-            html.Div(
-                [
-                    html.Span(
-                        title_text,
-                        className="fw-bold",
-                        style={"fontSize": "1.5rem", "textAlign": "center", "flex": "1"}
-                    ),
-                    html.Span(
-                        "ℹ",
-                        id="stackedplot-info",
-                        className="ms-2",
-                        style={"cursor": "pointer", "color": "#0d6efd",
-                            "fontWeight": "600", "fontSize": "1.3rem"}
-                    ),
-                    dbc.Tooltip(
-                        "Displays the proportion of each category in the selected demographic "
-                        "across the time period shown for the selected demographic.",
-                        target="stackedplot-info",
-                        placement="right",
-                    ),
-                ],
-                className="d-flex align-items-center justify-content-center mb-2"
-            ),
-            dcc.Graph(figure=fig)
-        ])
+@app.callback(
+    Output('plot-title', 'children'),
+    Output('plot-info-tooltip', 'children'),
+    Output('plot-graph', 'figure'),
+    Output('plot-figure-inputs', 'data'),
+    Output('plot-render-request', 'data'),
+    *plot_inputs,
+    State('plot-figure-inputs', 'data')
+)
+def render_tab_content(tab, x_dem, color_dem, y_metric, industry, year, compare_on, shown_inputs):
+    inputs = [tab, x_dem, color_dem, y_metric, industry, year, compare_on]
+    if not valid_inputs(inputs):
+        raise PreventUpdate
+
+    data = registry.current  # one dataset for the whole request, even across a reload
+    if data.cube.failed(figure_key(*inputs)):
+        # the cube build already ran this query and it errored (e.g. owner counts
+        # by LFO): a live query or a background job would only fail the same way
+        return (*no_data_content(), no_update)
+    content = tab_content(inputs, shown_inputs, data, run_queries=background_manager is None)
+    if content is None:
+        # needs a live query: hand it to render_tab_content_background
+        return no_update, no_update, no_update, no_update, inputs
+    return (*content, no_update)
+
+
+if background_manager is not None:
+    @app.callback(
+        Output('plot-title', 'children', allow_duplicate=True),
+        Output('plot-info-tooltip', 'children', allow_duplicate=True),
+        Output('plot-graph', 'figure', allow_duplicate=True),
+        Output('plot-figure-inputs', 'data', allow_duplicate=True),
+        Input('plot-render-request', 'data'),
+        State('plot-figure-inputs', 'data'),
+        background=True,
+        manager=background_manager,
+        interval=250,  # ms between the page's polls for the result
+        progress=Output('plot-render-progress', 'children'),
+        progress_default="",
+        cancel=plot_inputs,  # superseded by newer inputs
+        prevent_initial_call=True,
+    )
+    def render_tab_content_background(set_progress, inputs, shown_inputs):
+        if not valid_inputs(inputs):
+            raise PreventUpdate
+        set_progress(f"Rendering {plot_info[inputs[0]][0].lower()}...")
+        # a job process has no request to trace: log its stages as a line of their own
+        with nesd_trace.trace_job("render_tab_content_background"):
+            return tab_content(inputs, shown_inputs, registry.current)
+
+
+# liveness: answers as soon as the app is importable, lazy tables or not
+@server.route("/_health")
+def health():
+    if not registry.loaded:  # fast boot, first dataset still loading
+        return jsonify({"status": "loading", "data_version": registry.version})
+    data = registry.current
+    return jsonify({
+        "status": "ok",
+        "data_version": data.version,
+        "loaded_at": data.loaded_at,
+        "reloads": registry.reloads,
+        "reload_error": registry.last_error,
+        "table_owner_loaded": data.tables["table_owner"].loaded,
+    })
+
+
+# hit/miss/eviction counters for sizing the figure caches
+@server.route("/_figure-cache-stats")
+def figure_cache_stats():
+    return jsonify({
+        "local": figure_cache.stats(),
+        "shared": shared_cache.stats() if shared_cache is not None else None,
+        "bundle": registry.current.bundle.stats() if registry.current.bundle is not None else None,
+    })
+
+
+# Prometheus /metrics: per-callback calls / errors / latency / payload size,
+# load times and cache counters (aggregated across gunicorn workers)
+def process_cache_stats():
+    stats = {"local": figure_cache.stats()}
+    if shared_cache is not None:
+        # this worker's lookups only; the shared size is read at scrape time
+        stats["shared"] = {"hits": shared_cache.hits, "misses": shared_cache.misses, "evictions": shared_cache.evictions}
+    bundle = registry.current.bundle
+    if bundle is not None:
+        stats["bundle"] = {"hits": bundle.hits, "misses": bundle.misses}
+    return stats
+
+
+nesd_metrics.instrument(
+    app,
+    process_stats=process_cache_stats,
+    shared_stats=shared_cache.stats if shared_cache is not None else None,
+)
+
+# one JSON timing line per callback (stages: cube / px / layout / serialize / ...)
+# and opt-in cProfile dumps; see nesd_trace
+nesd_trace.instrument(app, nesd_metrics.callback_namer(app), on_stages=nesd_metrics.observe_stages)
+
 
+# The callbacks below only reshape their inputs, so they run in the browser as
+# clientside callbacks (no round trip to /_dash-update-component).
 
 #------Hide Dropdown when Checkbox--------
-@app.callback(
+app.clientside_callback(
+    """
+    function(compare_on) {
+        // show when checked, hide when unchecked
+        return compare_on ? {} : {"display": "none"};
+    }
+    """,
     Output("color-dem-container", "style"),
     Input("compare-toggle", "value"),
 )
-def toggle_color_container(compare_on):
-    # show when checked, hide when unchecked
-    return {} if compare_on else {"display": "none"}
 
 # ----------------Clear Year Filter Callback=----------------#
-@app.callback(
+app.clientside_callback(
+    """
+    function(tab) {
+        // clear year for line + stacked area plots
+        if (tab === "line" || tab === "stacked-plot") {
+            return null;
+        }
+        // default as 2019
+        return 2019;
+    }
+    """,
     Output('year-dropdown', 'value'),
     Input('plot-tabs', 'active_tab')
 )
-def clear_year_filter(tab):
-    # clear year for line + stacked area plots
-    if tab in ['line', 'stacked-plot']:
-        return None  
-    else:
-        # default as 2019
-        return 2019
 
 # ---------------Update Select Demogrpaghic (X-axis) Dropdown options ---------------#
-@app.callback(
+x_dem_options = [
+    {"label": "Sex", "value": "SEX_LABEL"},
+    {"label": "Race", "value": "RACE_GROUP_LABEL"},
+    {"label": "Ethnicity", "value": "ETH_GROUP_LABEL"},
+    {"label": "Veteran Status", "value": "VET_GROUP_LABEL"},
+    {"label": "Foreign Born Status", "value": "FOREIGN_BORN_GROUP_LABEL"},
+    {"label": "W2 Status", "value": "W2_GROUP_LABEL"},
+    {"label": "Legal Form of Organization", "value": "LFO_LABEL"}
+]
+
+app.clientside_callback(
+    """
+    function(y_metric, graph_type) {
+        var dem_options = %s;
+
+        // take out LFO label if using owner counts
+        if (y_metric === "OWNNOPD" && ["bar", "line", "stacked-plot"].includes(graph_type)) {
+            dem_options = dem_options.filter(function(opt) { return opt.value !== "LFO_LABEL"; });
+        }
+        return dem_options;
+    }
+    """ % json.dumps(x_dem_options),
     Output("bar-dem-dropdown", "options"),
     Input("yaxis-metric-dropdown", "value"),
     Input("plot-tabs", "active_tab")
 )
-def update_x_dem_options(y_metric, graph_type):
-    dem_options = [
-        {"label": "Sex", "value": "SEX_LABEL"},
-        {"label": "Race", "value": "RACE_GROUP_LABEL"},
-        {"label": "Ethnicity", "value": "ETH_GROUP_LABEL"},
-        {"label": "Veteran Status", "value": "VET_GROUP_LABEL"},
-        {"label": "Foreign Born Status", "value": "FOREIGN_BORN_GROUP_LABEL"},
-        {"label": "W2 Status", "value": "W2_GROUP_LABEL"},
-        {"label": "Legal Form of Organization", "value": "LFO_LABEL"}
-    ]
-
-    # take out LFO label if using owner counts
-    if y_metric == "OWNNOPD" and graph_type in ["bar", "line", "stacked-plot"]:  
-        dem_options = [opt for opt in dem_options if opt["value"] != "LFO_LABEL"]
-
-    return dem_options    
 
 #------Reset Checkbox when switiching tabs--------#
-@app.callback(
+app.clientside_callback(
+    """
+    function(tab) {
+        if (tab === "line" || tab === "stacked-plot") {
+            return false;
+        }
+        return window.dash_clientside.no_update;
+    }
+    """,
     Output("compare-toggle", "value"),
     Input("plot-tabs", "active_tab"),
     prevent_initial_call=True
 )
-def reset_compare_toggle(tab):
-    
-    if tab in ["line", "stacked-plot"]:
-        return False
-    
-    return dash.no_update
 
 #-------------About Section Click Callback-------------#
-@app.callback(
+app.clientside_callback(
+    """
+    function(n_clicks, is_open) {
+        if (n_clicks) {
+            return !is_open;
+        }
+        return is_open;
+    }
+    """,
     Output("about-collapse", "is_open"),
     Input("about-toggle", "n_clicks"),
     State("about-collapse", "is_open")
 )
-def toggle_about_collapse(n_clicks, is_open):
-    if n_clicks:
-        return not is_open
-    return is_open
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,28 @@
+# gunicorn reads this file from the working directory (`gunicorn app_v3:server`)
+import os
+import shutil
+import tempfile
+
+# per-worker Prometheus samples go here and /metrics aggregates them (nesd_metrics.py);
+# must be set before the workers import prometheus_client
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "nesd-prometheus"))
+
+# the master binds the port before any worker imports the app, so a platform's port
+# check passes at once and early requests queue until a worker is up (README "Fast
+# boot"); preloading the app in the master would hold the bind back until it's imported
+preload_app = False
+
+
+def on_starting(server):
+    # samples left over from a previous run would be added to this one
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,61 @@
+"""
+Prebuild everything a fast boot (NESD_FAST_BOOT=1) reads.
+
+    python nesd_build_boot.py [--out nesd_boot]
+
+Loads the dataset once, the way the app does, and keeps the results in --out:
+the normalized tables as Arrow files (memory-mapped at boot), the aggregate
+cube, and boot.json with the data version and the year / sector dropdown
+options, so the page can be served before any table is read. Run it in the
+deploy's build step (after nesd_extract_tables.py when serving the Parquet
+output). A boot whose sources changed since builds what it needs itself.
+"""
+import argparse
+import os
+import time
+
+from nesd_data import write_json_atomic
+
+
+def _plain(value):
+    # numpy scalars -> JSON-able Python values
+    return value.item() if hasattr(value, "item") else value
+
+
+def build(out):
+    # app_v3 reads the boot settings at import time
+    os.environ["NESD_FAST_BOOT"] = "1"
+    os.environ["NESD_BOOT_DIR"] = out
+    os.environ.pop("NESD_SHARED_DATA_DIR", None)
+    os.environ["NESD_RELOAD_INTERVAL"] = ""
+    os.environ["NESD_PRELOAD_DELAY"] = ""
+    os.makedirs(out, exist_ok=True)
+
+    import app_v3
+
+    data = app_v3.registry.current  # tables published to `out`, cube built there
+    engine = data.cube.engine
+    info = {
+        "version": data.version,
+        "years": [_plain(y) for y in engine.values("firms", "YEAR")],
+        "sectors": [_plain(s) for s in engine.values("firms", "NAICS2017_LABEL")],
+    }
+    write_json_atomic(os.path.join(out, app_v3.BOOT_INFO), info)
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prebuild the files a fast boot (NESD_FAST_BOOT=1) reads.")
+    parser.add_argument("--out", default="nesd_boot", help="boot directory (NESD_BOOT_DIR)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    info = build(args.out)
+    size = sum(os.path.getsize(os.path.join(args.out, f)) for f in os.listdir(args.out))
+    print(f"{args.out}: data version {info['version'][:16]}, {len(info['years'])} years, "
+          f"{len(info['sectors'])} sectors, {size / 1e6:.1f} MB")
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
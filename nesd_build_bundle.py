@@ -0,0 +1,104 @@
+"""
+Pre-render every chart the dashboard can show into a figure bundle.
+
+    python nesd_build_bundle.py [--out nesd_figures.bundle] [--workers N]
+
+Walks the UI's input space (tab x demographic x color x metric x sector x
+year), renders each distinct figure through app_v3.build_figure in a process
+pool and writes them to one compressed, content-addressed file. Run the app
+with NESD_FIGURE_BUNDLE=nesd_figures.bundle to serve figures straight from
+it. The bundle is tagged with the data fingerprint; rebuild it after new data
+or changes to the plot functions.
+"""
+import argparse
+import hashlib
+import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+# render from the plot functions, not from an older bundle / the shared cache,
+# and from one dataset (no reloads mid-build)
+os.environ["NESD_FIGURE_BUNDLE"] = ""
+os.environ["NESD_SHARED_CACHE_DIR"] = ""
+os.environ["NESD_RELOAD_INTERVAL"] = ""
+
+from nesd_cache import write_bundle  # noqa: E402
+from nesd_query import dem_labels, metrics  # noqa: E402
+
+BUNDLE = "nesd_figures.bundle"
+
+
+def ui_inputs(years, sectors):
+    """Every render_tab_content input tuple the dropdowns can produce."""
+    inputs = []
+    for x_dem in dem_labels:
+        for y_metric in metrics:
+            if y_metric == "OWNNOPD" and x_dem == "LFO_LABEL":
+                continue  # the page drops LFO from the options for owner counts
+            for sector in sectors:
+                for color in [None] + [c for c in dem_labels if c != x_dem]:
+                    for year in years:
+                        inputs.append(("bar", x_dem, color, y_metric, sector, year, color is not None))
+                inputs.append(("line", x_dem, None, y_metric, sector, None, False))
+                inputs.append(("stacked-plot", x_dem, None, y_metric, sector, None, False))
+    return inputs
+
+
+def render_chunk(chunk):
+    # -> [(key, digest, compressed figure JSON)], skipping combos that fail to render
+    import app_v3
+
+    out = []
+    for inputs in chunk:
+        try:
+            text = app_v3.build_figure(*inputs).encode()
+        except Exception:
+            continue
+        out.append((app_v3.figure_key(*inputs), hashlib.sha256(text).hexdigest(), zlib.compress(text, 9)))
+    return out
+
+
+def build(out=BUNDLE, workers=None, chunk_size=64):
+    import app_v3  # forked workers inherit the loaded tables / cube
+
+    cube = app_v3.registry.current.cube
+    years, sectors = cube.input_space()
+    years = [int(y) if y is not None else None for y in years]
+
+    # one render per distinct figure key (e.g. a color equal to x is no color)
+    unique = {}
+    for inputs in ui_inputs(years, sectors):
+        unique.setdefault(app_v3.figure_key(*inputs), inputs)
+    todo = list(unique.values())
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+
+    figures = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for rendered in pool.map(render_chunk, chunks):
+            figures.extend(rendered)
+    figures.sort(key=lambda f: repr(f[0]))  # same data -> same file
+
+    stats = write_bundle(out, figures, cube.fingerprint)
+    stats["inputs"] = len(todo)
+    stats["raw_bytes"] = sum(len(zlib.decompress(blob)) for _, _, blob in {f[1]: f for f in figures}.values())
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render every dashboard chart into a figure bundle.")
+    parser.add_argument("--out", default=BUNDLE, help="bundle file to write")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size (default: all cores)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = build(args.out, args.workers)
+    print(f"{stats['figures']} figures ({stats['inputs'] - stats['figures']} failed to render), "
+          f"{stats['objects']} unique")
+    print(f"{args.out}: {stats['bytes'] / 1e6:.1f} MB "
+          f"({stats['raw_bytes'] / 1e6:.1f} MB of figure JSON, {stats['raw_bytes'] / stats['bytes']:.1f}x)")
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Caches for rendered dashboard figures.
+
+FigureCache is a bounded, thread-safe LRU keyed on normalized callback
+inputs. It holds serialized figure JSON, is capped both by entry count and
+by total bytes, and counts hits / misses / evictions so it can be sized.
+
+SharedFigureCache is the same idea backed by a SQLite file, so every
+gunicorn worker on the box reads what any one of them computed.
+
+FigureBundle is a read-only file of figures pre-rendered for the whole input
+space (see nesd_build_bundle.py), memory-mapped so workers share it.
+"""
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+class FigureCache:
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, nbytes), oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """Store a str value; values bigger than max_bytes (UTF-8 encoded) are skipped."""
+        nbytes = len(value.encode())
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Cached value for key, else compute() (stored); key None bypasses the cache."""
+        if key is None:
+            return compute()
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _key_text(key):
+    # stable text form of a cache key tuple (numpy scalars -> plain numbers)
+    return json.dumps(key, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+
+
+class SharedFigureCache:
+    """Figure cache shared by every process on the box via a SQLite file.
+
+    Rows are tagged with the data version they were rendered from; rows of
+    any other version are never served and are deleted on open, so new data
+    files invalidate the cache. Entries expire after `ttl` seconds and the
+    least recently used ones are evicted once the file holds more than
+    `max_bytes` of figures. The file is only measured every `check_every`
+    puts (or sooner when this process's own puts could push it over), so a
+    put doesn't scan the table.
+    """
+
+    def __init__(self, directory, data_version, ttl=24 * 3600, max_bytes=256 * 1024 * 1024, check_every=32):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "figures.sqlite3")
+        self.data_version = data_version
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.check_every = check_every
+        self._local = threading.local()
+        self._approx_bytes = None  # file size at the last check + what this process put since
+        self._puts_since_check = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        with self._conn() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS figures ("
+                " key TEXT PRIMARY KEY, version TEXT, value TEXT,"
+                " nbytes INTEGER, created REAL, accessed REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS figures_accessed ON figures (accessed)")
+            db.execute("DELETE FROM figures WHERE version != ?", (data_version,))
+
+    def _conn(self):
+        # one connection per thread and process (connections don't survive a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        now = time.time()
+        try:
+            with self._conn() as db:
+                row = db.execute(
+                    "SELECT value, created, accessed FROM figures WHERE key = ? AND version = ?",
+                    (_key_text(key), self.data_version),
+                ).fetchone()
+                if row is not None and row[1] + self.ttl < now:
+                    row = None
+                elif row is not None and now - row[2] > 60:
+                    # coarse LRU bookkeeping: at most one write per entry per minute
+                    db.execute("UPDATE figures SET accessed = ? WHERE key = ?", (now, _key_text(key)))
+        except sqlite3.Error:
+            row = None  # a busy / broken cache file must never fail a request
+
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, key, value):
+        nbytes = len(value.encode())
+        if nbytes > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            with self._conn() as db:
+                db.execute(
+                    "INSERT OR REPLACE INTO figures VALUES (?, ?, ?, ?, ?, ?)",
+                    (_key_text(key), self.data_version, value, nbytes, now, now),
+                )
+                self._puts_since_check += 1
+                if self._approx_bytes is not None:
+                    self._approx_bytes += nbytes
+                if (self._approx_bytes is None or self._approx_bytes > self.max_bytes
+                        or self._puts_since_check >= self.check_every):
+                    self._evict(db, now)
+        except sqlite3.Error:
+            pass
+
+    def _evict(self, db, now):
+        # drop expired rows, then the least recently used ones until the file fits
+        db.execute("DELETE FROM figures WHERE created < ?", (now - self.ttl,))
+        total = db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM figures").fetchone()[0]
+        while total > self.max_bytes:
+            key_text, evicted = db.execute(
+                "SELECT key, nbytes FROM figures ORDER BY accessed LIMIT 1"
+            ).fetchone()
+            db.execute("DELETE FROM figures WHERE key = ?", (key_text,))
+            total -= evicted
+            self.evictions += 1
+        self._approx_bytes, self._puts_since_check = total, 0
+
+    def get_or_compute(self, key, compute):
+        if key is None:
+            return compute()
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        try:
+            with self._conn() as db:
+                db.execute("DELETE FROM figures")
+            self._approx_bytes, self._puts_since_check = 0, 0
+        except sqlite3.Error:
+            pass
+
+    def set_data_version(self, data_version):
+        """Serve (and keep) only figures of `data_version` from now on."""
+        self.data_version = data_version
+        try:
+            with self._conn() as db:
+                db.execute("DELETE FROM figures WHERE version != ?", (data_version,))
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        try:
+            entries, nbytes = self._conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM figures WHERE version = ?", (self.data_version,)
+            ).fetchone()
+        except sqlite3.Error:
+            entries = nbytes = None
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": nbytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# ---------------- Pre-rendered bundle ---------------- #
+BUNDLE_VERSION = 1
+
+
+def write_bundle(path, figures, data_version):
+    """Write (key, sha256 of the figure JSON, zlib-compressed JSON) triples to `path`.
+
+    Figures are stored once per digest (content-addressed), so inputs that
+    render the same chart share one blob. File layout:
+    <u64 header length><JSON header: keys -> digest, digest -> (offset, length)><blobs>
+    """
+    keys, objects, chunks, offset = {}, {}, [], 0
+    for key, digest, blob in figures:
+        keys[_key_text(key)] = digest
+        if digest not in objects:
+            objects[digest] = (offset, len(blob))
+            chunks.append(blob)
+            offset += len(blob)
+
+    header = json.dumps({"version": BUNDLE_VERSION, "data_version": data_version,
+                         "figures": keys, "objects": objects}).encode()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for blob in chunks:
+            f.write(blob)
+    os.replace(tmp, path)
+    return {"figures": len(keys), "objects": len(objects), "bytes": os.path.getsize(path)}
+
+
+class FigureBundle:
+    """Pre-rendered figure JSON for every input combination, read from a bundle file.
+
+    Raises ValueError if the file was built from other data than
+    `data_version` (or by another bundle format).
+    """
+
+    def __init__(self, path, data_version=None):
+        with open(path, "rb") as f:
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_len))
+            if header.get("version") != BUNDLE_VERSION:
+                raise ValueError(f"{path}: unsupported bundle version {header.get('version')}")
+            if data_version is not None and header["data_version"] != data_version:
+                raise ValueError(f"{path} was built from other data files")
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = 8 + header_len
+        self.path = path
+        self._figures = header["figures"]
+        self._objects = {digest: (start + offset, length) for digest, (offset, length) in header["objects"].items()}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._figures)
+
+    def get(self, key):
+        digest = self._figures.get(_key_text(key))
+        if digest is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        offset, length = self._objects[digest]
+        return zlib.decompress(self._data[offset:offset + length]).decode()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._figures),
+            "objects": len(self._objects),
+            "bytes": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,484 @@
+"""
+Data loading for the NES-D dashboard.
+
+Parsing the xlsx workbooks with openpyxl is most of the app's cold start, so
+every workbook gets a columnar snapshot (Arrow/Feather) written next to it.
+The snapshot is keyed by the workbook's mtime/size and sha256: it is reused
+while the workbook is unchanged and rebuilt from the xlsx when it changes.
+
+load_tables can additionally publish the normalized tables as uncompressed
+Arrow IPC files that every worker process memory-maps read-only, so the
+column data lives once in the page cache instead of once per worker.
+
+load_tables can also hand back a table as a LazyTable, loaded on first use
+(once, thread-safe), and preload() warms such tables up in the background.
+
+A source can also be a table directory of the extractor's partitioned
+Parquet output (nesd_extract_tables.py), read with column / YEAR pruning.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import warnings
+import weakref
+from functools import partial
+
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # no pyarrow -> always read the workbook directly
+    pyarrow = None
+
+SNAPSHOT_VERSION = 1
+
+log = logging.getLogger("nesd")
+
+
+# ---------------- Snapshot helpers ---------------- #
+def snapshot_paths(xlsx_path):
+    base = os.path.splitext(xlsx_path)[0]
+    return base + ".feather", base + ".snapshot.json"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json_atomic(path, payload):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp, path)
+
+
+def snapshot_status(xlsx_path, options=None):
+    """Return (fresh, sha256) for the workbook's snapshot.
+
+    mtime + size is the fast path; if they moved we fall back to the content
+    hash so a `touch` or a re-copy of the same file doesn't force a rebuild.
+    sha256 is None when it wasn't needed to decide.
+    """
+    snap_path, meta_path = snapshot_paths(xlsx_path)
+    meta = _read_meta(meta_path)
+    if (
+        meta is None
+        or not os.path.exists(snap_path)
+        or meta.get("version") != SNAPSHOT_VERSION
+        or meta.get("options") != (options or {})
+    ):
+        return False, None
+
+    stamp = _stamp(xlsx_path)
+    if meta.get("source_mtime_ns") == stamp["mtime_ns"] and meta.get("source_size") == stamp["size"]:
+        return True, meta.get("source_sha256")
+
+    sha = file_sha256(xlsx_path)
+    if sha != meta.get("source_sha256"):
+        return False, sha
+
+    # same content, new mtime: refresh the stamp so the next boot takes the fast path
+    meta.update(source_mtime_ns=stamp["mtime_ns"], source_size=stamp["size"])
+    write_json_atomic(meta_path, meta)
+    return True, sha
+
+
+def read_workbook(xlsx_path, numeric_cols=()):
+    df = pd.read_excel(xlsx_path)
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df
+
+
+def arrow_safe(df):
+    # code columns like NAICS2017 mix ints (23) and strings ("31-33"), which
+    # Arrow can't store; keep them as text (none of these feed a numeric calc)
+    for col in df.columns[df.dtypes == object]:
+        values = df[col].dropna()
+        if values.map(type).nunique() > 1:
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def build_snapshot(xlsx_path, numeric_cols=(), sha=None):
+    """Parse the workbook and (re)write its snapshot. Returns the DataFrame."""
+    df = read_workbook(xlsx_path, numeric_cols)
+    if pyarrow is None:
+        return df
+    # same frame whether it comes from this parse or from the snapshot later
+    df = arrow_safe(df)
+
+    snap_path, meta_path = snapshot_paths(xlsx_path)
+    options = {"numeric_cols": list(numeric_cols)}
+    tmp = f"{snap_path}.{os.getpid()}.tmp"
+    try:
+        # write to a temp file + rename so other workers never read half a file
+        df.to_feather(tmp)
+        os.replace(tmp, snap_path)
+    except Exception as e:  # unwritable dir, odd dtypes, ...: serve the parse anyway
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        warnings.warn(f"could not snapshot {xlsx_path}: {e}")
+        return df
+
+    stamp = _stamp(xlsx_path)
+    write_json_atomic(meta_path, {
+        "version": SNAPSHOT_VERSION,
+        "source": os.path.basename(xlsx_path),
+        "source_sha256": sha or file_sha256(xlsx_path),
+        "source_mtime_ns": stamp["mtime_ns"],
+        "source_size": stamp["size"],
+        "options": options,
+        "rows": len(df),
+    })
+    return df
+
+
+# ---------------- Public loader ---------------- #
+def load_table(xlsx_path, numeric_cols=(), columns=None):
+    """Load a workbook via its snapshot, rebuilding the snapshot if stale.
+
+    numeric_cols are coerced with pd.to_numeric(errors="coerce") before the
+    snapshot is written (Arrow can't store mixed int/str columns like
+    OWNNOPD's "N < 15" cells). A directory is read as a Parquet table (only
+    `columns`, if given; Parquet columns are typed already).
+    """
+    if os.path.isdir(xlsx_path):
+        return read_parquet_table(xlsx_path, columns)
+    if pyarrow is None:
+        return read_workbook(xlsx_path, numeric_cols)
+
+    options = {"numeric_cols": list(numeric_cols)}
+    fresh, sha = snapshot_status(xlsx_path, options)
+    if fresh:
+        try:
+            return pd.read_feather(snapshot_paths(xlsx_path)[0])
+        except Exception as e:  # corrupt / truncated snapshot -> rebuild
+            warnings.warn(f"bad snapshot for {xlsx_path}, rebuilding: {e}")
+    return build_snapshot(xlsx_path, numeric_cols, sha=sha)
+
+
+# ---------------- Derived metrics ---------------- #
+# name -> (numerator, denominator). Charts aggregate a ratio as sum(numerator) /
+# sum(denominator) of the group (nesd_query), which is right at every level of
+# aggregation; a sum or mean of row ratios isn't. So only the two parts are
+# stored -- a per-row ratio column would never be read.
+derived_metrics = {
+    "AVG_REVENUE_PER_FIRM": ("RCPNOPD", "FIRMNOPD"),
+}
+
+
+def add_derived_inputs(df, metrics=None):
+    """df plus the numerator of every derived metric it publishes only as a ratio.
+
+    A source with the ratio and its denominator but not the numerator gets
+    it back as ratio x denominator, so the metric still aggregates as a
+    ratio of sums.
+    """
+    metrics = derived_metrics if metrics is None else metrics
+    new = {}
+    for name, (num, den) in metrics.items():
+        if num not in df.columns and name in df.columns and den in df.columns:
+            new[num] = pd.to_numeric(df[name], errors="coerce") * pd.to_numeric(df[den], errors="coerce")
+    return df.assign(**new) if new else df
+
+
+# ---------------- In-memory normalization ---------------- #
+# count/receipt columns that are integral and NaN-free get the narrowest int
+# dtype; anything with NaN (OWNNOPD's suppressed cells) or fractions stays
+# float64 -- float32 would round large receipt totals
+DOWNCAST_COLS = ("FIRMNOPD", "OWNNOPD", "RCPNOPD")
+
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 1e6
+
+
+def _downcast(series):
+    if not pd.api.types.is_integer_dtype(series):
+        return series
+    return pd.to_numeric(series, downcast="integer")
+
+
+def normalize_tables(tables, keep_columns=None, downcast_cols=DOWNCAST_COLS):
+    """Compact in-memory form of the loaded tables.
+
+    tables maps name -> DataFrame, keep_columns maps name -> the columns the
+    views read (everything else is dropped); a derived metric's missing
+    numerator is filled in before that (add_derived_inputs). *_LABEL string columns become
+    Categoricals with one sorted category list per column name across the
+    tables passed in, so codes are stable between loads of the same data.
+    load_normalized passes one table at a time: categories are not shared
+    between table1 and table_owner (no view compares their codes).
+    Returns a dict of new frames and logs memory before/after per table.
+    """
+    keep_columns = keep_columns or {}
+    trimmed = {}
+    for name, df in tables.items():
+        df = add_derived_inputs(df)
+        if name in keep_columns:
+            df = df[[c for c in keep_columns[name] if c in df.columns]]
+        trimmed[name] = df
+
+    categories = {}
+    for df in trimmed.values():
+        for col in df.columns:
+            if col.endswith("_LABEL") and (df[col].dtype == object or isinstance(df[col].dtype, pd.CategoricalDtype)):
+                categories.setdefault(col, set()).update(df[col].dropna().unique())
+    categories = {col: sorted(values, key=str) for col, values in categories.items()}
+
+    out = {}
+    for name, df in trimmed.items():
+        converted = {col: pd.Categorical(df[col], categories=categories[col]) for col in df.columns if col in categories}
+        converted.update({col: _downcast(df[col]) for col in downcast_cols if col in df.columns})
+        out[name] = df.assign(**converted)
+
+        before, after = memory_mb(tables[name]), memory_mb(out[name])
+        log.info("%s: %.1f MB -> %.1f MB (%d -> %d columns)",
+                 name, before, after, tables[name].shape[1], out[name].shape[1])
+    return out
+
+
+# ---------------- Shared (memory-mapped) tables ---------------- #
+SHARED_VERSION = 3
+
+
+def source_sha256(xlsx_path, numeric_cols=()):
+    if os.path.isdir(xlsx_path):
+        return parquet_fingerprint(xlsx_path)
+    # the snapshot metadata usually knows it already (no hashing needed)
+    fresh, sha = snapshot_status(xlsx_path, {"numeric_cols": list(numeric_cols)})
+    return sha if fresh and sha else file_sha256(xlsx_path)
+
+
+def _to_arrow(df):
+    table = pyarrow.Table.from_pandas(df, preserve_index=None)
+    # store NaN as a float value rather than a null: columns without a
+    # validity bitmap convert to pandas as zero-copy views of the mapping
+    for i, col in enumerate(df.columns):
+        if pd.api.types.is_float_dtype(df[col].dtype):
+            table = table.set_column(i, table.schema.field(i), pyarrow.array(df[col].to_numpy(), from_pandas=False))
+    return table
+
+
+def write_shared_table(df, path):
+    table = _to_arrow(df)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with pyarrow.OSFile(tmp, "wb") as sink:
+        with pyarrow.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+
+def map_shared_table(path):
+    """pandas frame over a memory-mapped Arrow file.
+
+    Numeric columns are read-only views into the mapping, so every process
+    mapping the same file shares those pages; only label codes and the small
+    category lists are materialized per process.
+    """
+    source = pyarrow.memory_map(path, "r")
+    return pyarrow.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+
+
+def table_version(name, path, numeric_cols=(), keep_columns=None):
+    """Version of a normalized table: its source's hash plus the load options."""
+    h = hashlib.sha256(json.dumps([SHARED_VERSION, name, keep_columns, list(numeric_cols), list(DOWNCAST_COLS)],
+                                  sort_keys=True).encode())
+    h.update(source_sha256(path, numeric_cols).encode())
+    return h.hexdigest()[:16]
+
+
+def load_normalized(name, path, numeric_cols=(), keep_columns=None, shared_dir=None):
+    """One table, loaded + normalized (see load_tables for shared_dir)."""
+    if not shared_dir or pyarrow is None:
+        df = load_table(path, numeric_cols, keep_columns)
+        return normalize_tables({name: df}, {name: keep_columns} if keep_columns else None)[name]
+
+    shared = os.path.join(shared_dir, f"{name}-{table_version(name, path, numeric_cols, keep_columns)}.arrow")
+    if not os.path.exists(shared):
+        os.makedirs(shared_dir, exist_ok=True)
+        df = load_table(path, numeric_cols, keep_columns)
+        write_shared_table(normalize_tables({name: df}, {name: keep_columns} if keep_columns else None)[name], shared)
+        log.info("published %s to %s", name, shared)
+        _remove_stale(shared_dir, {name: shared})
+    return map_shared_table(shared)
+
+
+def load_tables(sources, keep_columns=None, shared_dir=None, lazy=()):
+    """Load + normalize every table; sources maps name -> (xlsx_path, numeric_cols).
+
+    With shared_dir, each normalized table is published there as
+    <name>-<version>.arrow (version = workbook hash + load options) and
+    returned as a memory-mapped view. The first process to boot publishes,
+    later ones only map. Without it (or without pyarrow) every process
+    keeps its own copy.
+
+    Tables named in `lazy` come back as LazyTable objects that load on first
+    use instead.
+    """
+    keep_columns = keep_columns or {}
+    tables = {}
+    for name, (path, numeric_cols) in sources.items():
+        load = partial(load_normalized, name, path, numeric_cols, keep_columns.get(name), shared_dir)
+        tables[name] = LazyTable(name, load) if name in lazy else load()
+    return tables
+
+
+def tables_version(sources, keep_columns=None):
+    """One version string for a set of sources (changes when any table would)."""
+    keep_columns = keep_columns or {}
+    return hashlib.sha256("".join(
+        table_version(name, path, numeric_cols, keep_columns.get(name))
+        for name, (path, numeric_cols) in sorted(sources.items())
+    ).encode()).hexdigest()
+
+
+# a fork while another thread holds a LazyTable's lock would leave it held forever
+# in the child, so every live instance gets a fresh lock after a fork. One hook for
+# all of them: a per-instance hook can't be unregistered and would keep every
+# LazyTable -- and whatever it loaded -- alive for good.
+_lazy_tables = weakref.WeakSet()
+
+
+def _reset_lazy_locks():
+    for table in list(_lazy_tables):
+        table._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_lazy_locks)
+
+
+class LazyTable:
+    """A table (or anything else) loaded by `load()` on first use, exactly once.
+
+    Concurrent first callers wait for the one load; a load that raises is
+    retried by the next caller.
+    """
+
+    def __init__(self, name, load):
+        self.name = name
+        self._load = load
+        self._value = None
+        self._lock = threading.Lock()
+        _lazy_tables.add(self)
+
+    @property
+    def loaded(self):
+        return self._value is not None
+
+    def get(self):
+        value = self._value
+        if value is None:
+            with self._lock:
+                if self._value is None:
+                    start = time.perf_counter()
+                    self._value = self._load()
+                    log.info("loaded %s on first use in %.2fs", self.name, time.perf_counter() - start)
+                value = self._value
+        return value
+
+    __call__ = get
+
+
+def preload(*loaders, delay=0.0):
+    """Call each loader (e.g. a LazyTable) on a daemon thread after `delay` seconds."""
+    def run():
+        time.sleep(delay)
+        for load in loaders:
+            try:
+                load()
+            except Exception:  # the request that needs it will load (and report) it again
+                log.exception("background preload failed")
+
+    thread = threading.Thread(target=run, name="nesd-preload", daemon=True)
+    thread.start()
+    return thread
+
+
+def _remove_stale(shared_dir, current_paths):
+    # older versions of our tables; processes still mapping them keep their
+    # pages (unlinking a mapped file is safe on Linux)
+    current = {os.path.basename(p) for p in current_paths.values()}
+    for name in current_paths:
+        for fname in os.listdir(shared_dir):
+            if fname.startswith(f"{name}-") and fname.endswith(".arrow") and fname not in current:
+                try:
+                    os.remove(os.path.join(shared_dir, fname))
+                except OSError:
+                    pass
+
+
+# ---------------- Partitioned Parquet ---------------- #
+# written by nesd_extract_tables.py: <table dir>/YEAR=<year>/part-0.parquet,
+# with YEAR only in the directory name (hive partitioning)
+def write_parquet_partition(df, path, numeric_cols=DOWNCAST_COLS):
+    """Write one table/year partition with typed columns.
+
+    Count columns are coerced to numbers, other all-number columns get a
+    numeric dtype, mixed code columns become text and *_LABEL columns
+    dictionary-encoded (categorical) columns.
+    """
+    # object columns left over from the annotation rows get their real dtype back
+    df = df.drop(columns=["YEAR"], errors="ignore").infer_objects()
+    df = df.assign(**{col: pd.to_numeric(df[col], errors="coerce") for col in numeric_cols if col in df.columns})
+    df = arrow_safe(df.copy())
+    df = df.assign(**{col: df[col].astype("category") for col in df.columns
+                      if col.endswith("_LABEL") and df[col].dtype == object})
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # dot-prefixed: a leftover from an interrupted write is skipped by dataset readers
+    tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}.tmp")
+    pyarrow.parquet.write_table(pyarrow.Table.from_pandas(df, preserve_index=False), tmp)
+    os.replace(tmp, path)
+
+
+def read_parquet_table(dataset_dir, columns=None, years=None):
+    """One table of the partitioned Parquet output as a DataFrame (YEAR first).
+
+    Only `columns` are read from the files (column pruning) and only the
+    YEAR=<year> directories in `years` are opened (partition pruning).
+    """
+    dataset = pyarrow.dataset.dataset(
+        dataset_dir, format="parquet",
+        partitioning=pyarrow.dataset.partitioning(pyarrow.schema([("YEAR", pyarrow.int64())]), flavor="hive"),
+    )
+    names = dataset.schema.names
+    columns = ["YEAR"] + [c for c in (columns or names) if c != "YEAR" and c in names]
+    year_filter = pyarrow.dataset.field("YEAR").isin(list(years)) if years is not None else None
+    return dataset.to_table(columns=columns, filter=year_filter).to_pandas()
+
+
+def parquet_fingerprint(dataset_dir):
+    # cheap version stamp of a Parquet table: every data file's path, size and mtime
+    # (dot / underscore names are skipped, as the dataset reader skips them)
+    h = hashlib.sha256()
+    for root, _, fnames in sorted(os.walk(dataset_dir)):
+        for fname in sorted(f for f in fnames if not f.startswith((".", "_"))):
+            st = os.stat(os.path.join(root, fname))
+            h.update(f"{os.path.relpath(os.path.join(root, fname), dataset_dir)}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()
@@ -0,0 +1,172 @@
+"""
+Out-of-core query engine: chart queries as SQL over Parquet files (DuckDB).
+
+DuckDBEngine is a nesd_query.QueryEngine whose filters and groupbys run in
+an embedded DuckDB (no server) straight over the extractor's partitioned
+Parquet output. Only the columns a query uses are read, YEAR filters prune
+whole partitions, and just the aggregated rows come back as a DataFrame --
+the tables are never loaded into pandas, so the data can outgrow memory.
+
+Each Query compiles to one statement. Plain filters become WHERE terms; the
+conditional ones (eq_if_present / ne_if_varies) depend on the rows left so
+far, so each starts a new CTE that checks the previous one. Filters keep the
+RowIndex semantics (a NULL never equals a value, `ne` keeps NULLs, contains
+matches the lower-cased value). Groups are sorted like pandas' groupby
+(NULL groups dropped), and the share of total is added by QueryEngine.run on
+the aggregated rows, exactly as on the pandas path.
+
+Needs the duckdb package (optional: app_v3 only imports this module for
+NESD_QUERY_BACKEND=duckdb).
+"""
+import os
+import threading
+
+import duckdb
+import pandas as pd
+
+from nesd_query import QueryEngine
+from nesd_trace import span
+
+SQL_AGGS = {"sum": "sum", "mean": "avg"}
+
+
+def _ident(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _literal(text):
+    return "'" + str(text).replace("'", "''") + "'"
+
+
+def _param(value):
+    # numpy scalars -> Python values DuckDB can bind
+    return value.item() if hasattr(value, "item") else value
+
+
+def parquet_glob(path):
+    # a hive-partitioned directory (<dir>/YEAR=<year>/part-0.parquet) or a file / glob
+    return os.path.join(path, "**", "*.parquet") if os.path.isdir(path) else path
+
+
+class DuckDBEngine(QueryEngine):
+    """QueryEngine over Parquet files; sources maps table -> Parquet directory, file or glob."""
+
+    def __init__(self, sources, threads=None, memory_limit=None):
+        self._sources = dict(sources)
+        self._settings = {"threads": threads, "memory_limit": memory_limit}
+        self._local = threading.local()
+        self._schemas = {}
+
+    def _conn(self):
+        # one DuckDB connection per thread and per process (connections don't survive a fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = duckdb.connect()
+            for name, value in self._settings.items():
+                if value is not None:
+                    conn.execute(f"SET {name} = {_literal(value)}")
+            for table, path in self._sources.items():
+                conn.execute(f"CREATE VIEW {_ident(table)} AS SELECT * FROM "
+                             f"read_parquet({_literal(parquet_glob(path))}, hive_partitioning = true)")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def schema(self, table):
+        """{column: DuckDB type} of a table."""
+        if table not in self._schemas:
+            if table not in self._sources:
+                raise KeyError(table)
+            rows = self._conn().execute(f"DESCRIBE {_ident(table)}").fetchall()
+            self._schemas[table] = {row[0]: row[1] for row in rows}
+        return self._schemas[table]
+
+    def columns(self, table):
+        return pd.Index(list(self.schema(table)))
+
+    def values(self, table, col):
+        self._check(table, [col])
+        rows = self._conn().execute(
+            f"SELECT DISTINCT {_ident(col)} FROM {_ident(table)} WHERE {_ident(col)} IS NOT NULL ORDER BY 1"
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def warm(self):
+        for table in self._sources:
+            self.schema(table)
+
+    def _check(self, table, cols):
+        # a missing column is a KeyError, as on the RowIndex
+        schema = self.schema(table)
+        for col in cols:
+            if col not in schema:
+                raise KeyError(col)
+
+    # ---- SQL ---- #
+    def _condition(self, op, col, value, relation, params):
+        c = _ident(col)
+        if op == "eq":
+            params.append(_param(value))
+            return f"coalesce({c} = ?, false)"
+        if op == "ne":
+            params.append(_param(value))
+            return f"NOT coalesce({c} = ?, false)"
+        if op == "isin":
+            values = [_param(v) for v in value]
+            if not values:
+                return "false"
+            params.extend(values)
+            return f"coalesce({c} IN ({', '.join('?' * len(values))}), false)"
+        if op == "not_contains":
+            params.append(value)
+            return f"NOT coalesce(regexp_matches(lower({c}), ?), false)"
+        if op == "eq_if_present":
+            params.extend([_param(value), _param(value)])
+            return f"(coalesce({c} = ?, false) OR NOT EXISTS (SELECT 1 FROM {relation} WHERE {c} = ?))"
+        if op == "ne_if_varies":
+            params.append(_param(value))
+            return f"(NOT coalesce({c} = ?, false) OR (SELECT count(DISTINCT {c}) FROM {relation}) <= 1)"
+        raise ValueError(f"unknown filter op: {op}")
+
+    def compile(self, table, where, rules, dims, aggs):
+        """-> (sql, params) for one filtered groupby (see QueryEngine.aggregate)."""
+        filters = list(where) + list(rules)
+        self._check(table, [col for _, col, _ in filters] + list(dims) + [m for m, _ in aggs])
+        schema = self.schema(table)
+
+        params, ctes, terms = [], [], []
+        relation = _ident(table)
+        for op, col, value in filters:
+            if op in ("eq_if_present", "ne_if_varies"):
+                # depends on the rows left so far: close them into a CTE first
+                if terms:
+                    ctes.append(f"s{len(ctes)} AS (SELECT * FROM {relation} WHERE {' AND '.join(terms)})")
+                    relation, terms = f"s{len(ctes) - 1}", []
+                ctes.append(f"s{len(ctes)} AS (SELECT * FROM {relation} "
+                            f"WHERE {self._condition(op, col, value, relation, params)})")
+                relation = f"s{len(ctes) - 1}"
+            else:
+                terms.append(self._condition(op, col, value, relation, params))
+
+        columns = [_ident(d) for d in dims]
+        for i, (metric, agg) in enumerate(aggs):
+            if agg not in SQL_AGGS:
+                raise ValueError(f"unsupported reduction: {agg}")
+            expr = f"{SQL_AGGS[agg]}({_ident(metric)})"
+            if agg == "sum":
+                # pandas: sum of an empty / all-NaN group is 0, ints stay ints
+                expr = f"CAST(coalesce({expr}, 0) AS {'BIGINT' if 'INT' in schema[metric] else 'DOUBLE'})"
+            columns.append(f"{expr} AS _{i}")
+
+        terms += [f"{_ident(d)} IS NOT NULL" for d in dims]  # groupby drops NaN keys
+        group = ", ".join(_ident(d) for d in dims)
+        sql = (("WITH " + ", ".join(ctes) + " ") if ctes else "") + (
+            f"SELECT {', '.join(columns)} FROM {relation} WHERE {' AND '.join(terms)} "
+            f"GROUP BY {group} ORDER BY {group}"
+        )
+        return sql, params
+
+    def aggregate(self, table, where, rules, dims, aggs):
+        sql, params = self.compile(table, where, rules, dims, aggs)
+        # filter and groupby are one statement here, so one stage
+        with span("sql"):
+            return self._conn().execute(sql, params).df()
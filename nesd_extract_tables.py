@@ -1,5 +1,19 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import xml.etree.ElementTree as ET
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 
+from nesd_data import add_derived_inputs, file_sha256, pyarrow, write_json_atomic, write_parquet_partition
+
 # experimental data tables used:
 files = [
     "2017-nes-d-experimental-tables.xlsx",
@@ -10,31 +24,280 @@ files = [
 # adding tables you want (table_5 + table_O1)
 target_tables = ["table_5", "table_O1"]
 
-# Loop through tables
-for t in target_tables:
-    all_years = []
-
-    for f in files:
-        year = f[:4]
-        sheets = pd.read_excel(f, sheet_name=None)
-
-        if t in sheets:  
-            df = sheets[t].dropna(how="all")
-            df = df[~df.apply(lambda row: row.astype(str).str.contains("Meaning|code", case=False).any(), axis=1)]
-            df.insert(0, "YEAR", year)
-
-            # create avg receipts per firm col:
-            if "RCPNOPD" in df.columns and "FIRMNOPD" in df.columns:
-                df["AVG_RECEIPTS_PER_FIRM"] = df["RECEIPTS"] / df["FIRMS"].replace(0, pd.NA)
-
-            all_years.append(df)
-
-    # combine years for selected tables
-    if all_years:
-        combined_df = pd.concat(all_years, ignore_index=True)
-        # name as _new.xlsx
-        out_file = f"{t}_new.xlsx"
-        combined_df.to_excel(out_file, sheet_name=t, index=False)
-        print(f"Saved {out_file}")
-    else: # check
-        print(f"Not found for {t}")
\ No newline at end of file
+
+# ---------------- Per-sheet cleaning ---------------- #
+# Census puts "Meaning of ... code" annotation rows under the header
+METADATA_ROW_PATTERN = re.compile("Meaning|code", re.IGNORECASE)
+
+
+def metadata_row_mask(df, pattern=METADATA_ROW_PATTERN):
+    """True for rows where any cell, as text, matches `pattern`.
+
+    Same rows as df.apply(lambda row: row.astype(str).str.contains(pattern).any(), axis=1),
+    but column by column: numeric / datetime / bool columns can't spell a word
+    and are skipped, and text columns are matched once per distinct value.
+    """
+    mask = np.zeros(len(df), dtype=bool)
+    for col in range(df.shape[1]):
+        values = df.iloc[:, col]
+        if not (values.dtype == object or isinstance(values.dtype, (pd.CategoricalDtype, pd.StringDtype))):
+            continue
+        codes, uniques = pd.factorize(values)
+        hits = np.fromiter((pattern.search(str(u)) is not None for u in uniques), dtype=bool, count=len(uniques))
+        mask |= hits[codes] & (codes >= 0)  # NaN reads "nan": never a match
+    return mask
+
+
+def clean_sheet(df, year):
+    df = df.dropna(how="all")
+    df = df[~metadata_row_mask(df)]
+    df.insert(0, "YEAR", year)
+
+    # the parts of derived metrics (average receipts per firm, ...), see nesd_data.derived_metrics
+    return add_derived_inputs(df)
+
+
+# ---------------- One workbook, one parse ---------------- #
+def extract_year(path, tables=target_tables):
+    """Open a yearly workbook once and return {table: cleaned df} for the wanted sheets present."""
+    year = os.path.basename(path)[:4]
+    with pd.ExcelFile(path) as xl:
+        wanted = [t for t in tables if t in xl.sheet_names]
+        sheets = pd.read_excel(xl, sheet_name=wanted) if wanted else {}
+    return {t: clean_sheet(df, year) for t, df in sheets.items()}
+
+
+# ---------------- Incremental extraction ---------------- #
+# The manifest records, per source workbook, its sha256 and one hash per sheet,
+# and per (table, year) partition the sheet hash it was extracted from. Each
+# partition is kept as a pickle under PARTITION_DIR, so a run only re-parses
+# the (table, year) sheets that are new or changed and restacks the rest.
+MANIFEST = "nesd_extract_manifest.json"
+PARTITION_DIR = ".nesd_partitions"
+PARQUET_DIR = "nesd_parquet"
+MANIFEST_VERSION = 3  # bumped whenever clean_sheet's output changes
+
+_XLSX_NS = {
+    "m": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+_REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+
+
+def sheet_hashes(path):
+    """sha256 per worksheet, read from the xlsx zip without parsing any cells.
+
+    A sheet's hash covers its own XML plus the workbook-wide shared strings and
+    styles its cells point into, so a text edit anywhere marks every sheet of
+    that workbook as changed (conservative, never stale).
+    """
+    with zipfile.ZipFile(path) as z:
+        members = set(z.namelist())
+        rels = ET.fromstring(z.read("xl/_rels/workbook.xml.rels"))
+        targets = {r.get("Id"): r.get("Target") for r in rels.findall("rel:Relationship", _XLSX_NS)}
+
+        common = hashlib.sha256()
+        for member in ("xl/sharedStrings.xml", "xl/styles.xml"):
+            if member in members:
+                common.update(z.read(member))
+
+        out = {}
+        for sheet in ET.fromstring(z.read("xl/workbook.xml")).find("m:sheets", _XLSX_NS):
+            target = targets[sheet.get(_REL_ID)]
+            member = target.lstrip("/") if target.startswith("/") else "xl/" + target
+            h = common.copy()
+            h.update(z.read(member))
+            out[sheet.get("name")] = h.hexdigest()
+    return out
+
+
+def load_manifest(out_dir="."):
+    try:
+        with open(os.path.join(out_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"version": MANIFEST_VERSION, "sources": {}, "partitions": {}}
+
+
+def partition_path(out_dir, table, year):
+    return os.path.join(out_dir, PARTITION_DIR, table, f"{year}.pkl")
+
+
+def parquet_partition_path(out_dir, table, year):
+    # hive layout: <PARQUET_DIR>/<table>/YEAR=<year>/part-0.parquet (see nesd_data.read_parquet_table)
+    return os.path.join(out_dir, PARQUET_DIR, table, f"YEAR={year}", "part-0.parquet")
+
+
+def source_info(path, known=None):
+    """Manifest entry for a workbook; reuses `known` when mtime/size or the sha256 still match."""
+    st = os.stat(path)
+    stamp = {"path": os.path.abspath(path), "mtime_ns": st.st_mtime_ns, "size": st.st_size}
+    if known and known.get("mtime_ns") == stamp["mtime_ns"] and known.get("size") == stamp["size"]:
+        return dict(known, path=stamp["path"])
+    sha = file_sha256(path)
+    if known and known.get("sha256") == sha:
+        return dict(known, **stamp)
+    return {"sha256": sha, **stamp, "sheets": sheet_hashes(path)}
+
+
+def plan_extraction(paths, tables, manifest, out_dir=".", force=False, prune=False):
+    """Decide what each (table, year) partition needs.
+
+    `paths` add to the workbooks the manifest already records (those still on
+    disk are checked for changes too), so a run over just a new vintage keeps
+    the older years. Returns (plan, sources): plan is a list of (table, year,
+    path, status) with status "new", "changed", "unchanged", "kept" (its
+    workbook is gone, the cached partition stays) or, with prune, "removed";
+    sources the refreshed manifest entry per workbook.
+    """
+    names = {os.path.basename(p) for p in paths}
+    recorded = [info["path"] for name, info in sorted(manifest["sources"].items())
+                if name not in names and info.get("path") and os.path.exists(info["path"])]
+    paths = list(paths) + recorded
+
+    plan, sources, seen = [], {}, set()
+    for path in paths:
+        name = os.path.basename(path)
+        info = sources[name] = source_info(path, manifest["sources"].get(name))
+        year = name[:4]
+        for t in tables:
+            if t not in info["sheets"]:
+                continue
+            seen.add((t, year))
+            part = manifest["partitions"].get(t, {}).get(year)
+            if part is None:
+                status = "new"
+            elif (force or part["sheet_sha256"] != info["sheets"][t] or part["source"] != name
+                  or not os.path.exists(partition_path(out_dir, t, year))):
+                status = "changed"
+            else:
+                status = "unchanged"
+            plan.append((t, year, path, status))
+
+    for t, parts in manifest["partitions"].items():
+        for year, part in parts.items():
+            if t in tables and (t, year) not in seen:
+                plan.append((t, year, part["source"], "removed" if prune else "kept"))
+                if not prune and part["source"] in manifest["sources"]:
+                    sources.setdefault(part["source"], manifest["sources"][part["source"]])
+    return plan, sources
+
+
+def run_incremental(paths=files, tables=target_tables, out_dir=".", dry_run=False, force=False, workers=None,
+                    excel=False, prune=False):
+    """Re-extract only new/changed partitions and rewrite the outputs they belong to.
+
+    Years whose workbook is neither given nor on disk any more keep their
+    partitions; prune=True deletes them (cache, Parquet partition, manifest).
+
+    Output is the partitioned Parquet dataset under PARQUET_DIR (only the
+    touched YEAR= partitions are written); excel=True also exports the
+    combined <table>_new.xlsx for analysts. Without pyarrow only the xlsx
+    export is written.
+    """
+    manifest = load_manifest(out_dir)
+    plan, sources = plan_extraction(paths, tables, manifest, out_dir, force, prune)
+
+    parquet = pyarrow is not None
+    if not parquet:
+        print("pyarrow is not installed: writing xlsx only")
+        excel = True
+
+    # outputs to (re)write: parquet partitions that are stale or missing, xlsx of touched tables
+    to_write = [(t, year) for t, year, _, status in plan if status != "removed" and parquet
+                and (status in ("new", "changed") or not os.path.exists(parquet_partition_path(out_dir, t, year)))
+                and (status != "kept" or os.path.exists(partition_path(out_dir, t, year)))]
+    dirty = set()
+    if excel:
+        dirty = {t for t, _, _, status in plan if status not in ("unchanged", "kept")}
+        dirty |= {t for t, _, _, _ in plan if not os.path.exists(os.path.join(out_dir, f"{t}_new.xlsx"))}
+
+    for t, year, path, status in plan:
+        print(f"{t:<10}{year:<6}{status:<10}{os.path.basename(path)}")
+    for t in tables:
+        if all(p[0] != t for p in plan): # check
+            print(f"Not found for {t}")
+    outputs = [f"{PARQUET_DIR}/{t}/YEAR={year}" for t, year in to_write] + [f"{t}_new.xlsx" for t in sorted(dirty)]
+    print(("Would write: " if dry_run else "Writing: ") + (", ".join(outputs) or "nothing"))
+    removed = [f"{PARQUET_DIR}/{t}/YEAR={year}" for t, year, _, status in plan if status == "removed"]
+    if removed:
+        print(("Would remove: " if dry_run else "Removing: ") + ", ".join(removed))
+    if any(status == "kept" for *_, status in plan):
+        print("Partitions marked kept have no workbook on disk; --prune removes them")
+    if dry_run:
+        return plan
+
+    # parse each workbook that has work to do once, only for the stale tables
+    todo = {}
+    for t, year, path, status in plan:
+        if status in ("new", "changed"):
+            todo.setdefault(path, []).append(t)
+    todo_paths = list(todo)
+    workers = workers or min(len(todo_paths), os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            extracted = list(pool.map(extract_year, todo_paths, [todo[p] for p in todo_paths]))
+    else:
+        extracted = [extract_year(p, todo[p]) for p in todo_paths]
+
+    for path, year_tables in zip(todo_paths, extracted):
+        name = os.path.basename(path)
+        year = name[:4]
+        for t, df in year_tables.items():
+            out_path = partition_path(out_dir, t, year)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            df.to_pickle(out_path)
+            manifest["partitions"].setdefault(t, {})[year] = {
+                "source": name, "sheet_sha256": sources[name]["sheets"][t], "rows": len(df),
+            }
+
+    for t, year, _, status in plan:
+        if status == "removed":
+            manifest["partitions"][t].pop(year, None)
+            if os.path.exists(partition_path(out_dir, t, year)):
+                os.remove(partition_path(out_dir, t, year))
+            shutil.rmtree(os.path.dirname(parquet_partition_path(out_dir, t, year)), ignore_errors=True)
+
+    for t, year in to_write:
+        out_path = parquet_partition_path(out_dir, t, year)
+        write_parquet_partition(pd.read_pickle(partition_path(out_dir, t, year)), out_path)
+        print(f"Saved {out_path}")
+
+    # restack the touched tables from their partitions, in year order
+    for t in sorted(dirty):
+        years = sorted(manifest["partitions"].get(t, {}))
+        parts = [pd.read_pickle(partition_path(out_dir, t, y)) for y in years]
+        out_file = os.path.join(out_dir, f"{t}_new.xlsx")
+        if parts:
+            pd.concat(parts, ignore_index=True).to_excel(out_file, sheet_name=t, index=False)
+            print(f"Saved {out_file}")
+        else: # check
+            print(f"Not found for {t}")
+
+    manifest["sources"] = sources
+    write_json_atomic(os.path.join(out_dir, MANIFEST), manifest)
+    return plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the NES-D dashboard tables from the yearly workbooks.")
+    parser.add_argument("workbooks", nargs="*", default=files, help="yearly workbooks (default: the files list)")
+    parser.add_argument("--dry-run", action="store_true", help="only report which partitions would be rebuilt")
+    parser.add_argument("--force", action="store_true", help="re-extract every partition")
+    parser.add_argument("--workers", type=int, default=None, help="process pool size")
+    parser.add_argument("--excel", action="store_true", help="also export <table>_new.xlsx")
+    parser.add_argument("--prune", action="store_true",
+                        help="delete the years whose workbook is no longer given or on disk")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    run_incremental(args.workbooks, target_tables, dry_run=args.dry_run, force=args.force, workers=args.workers,
+                    excel=args.excel, prune=args.prune)
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Prometheus metrics for the dashboard, served at /metrics.
+
+Server-side Dash callbacks are timed at the Flask level (one before/after
+hook pair on /_dash-update-component), so every callback is covered without
+touching its code: call counts, errors, latency and response-size
+histograms, labelled with the callback's function name. The page's polls for
+a background callback's result (?cacheKey=...&job=...) are only counted, as
+nesd_callback_polls_total, so they don't inflate the calls or skew the
+latencies. Dataset load times and figure cache counters are exported as
+gauges.
+
+Under gunicorn, PROMETHEUS_MULTIPROC_DIR must point at a directory shared by
+the workers (gunicorn.conf.py sets one up); each worker then writes its
+samples there and /metrics aggregates all of them, whichever worker serves
+the scrape. Without prometheus_client everything here is a no-op.
+"""
+import os
+import time
+
+from flask import Response, g, request
+
+try:
+    import prometheus_client
+    from prometheus_client import Counter, Gauge, Histogram, multiprocess
+except ImportError:  # metrics are optional
+    prometheus_client = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+PAYLOAD_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+if prometheus_client is not None:
+    callback_calls = Counter("nesd_callback_calls_total", "Dash callback requests", ["callback"])
+    callback_polls = Counter("nesd_callback_polls_total", "Polls for a background callback's result", ["callback"])
+    callback_errors = Counter("nesd_callback_errors_total", "Dash callback requests that failed (HTTP 4xx/5xx)",
+                              ["callback"])
+    callback_latency = Histogram("nesd_callback_latency_seconds", "Dash callback request latency", ["callback"],
+                                 buckets=LATENCY_BUCKETS)
+    callback_bytes = Histogram("nesd_callback_response_bytes", "Dash callback response payload size", ["callback"],
+                               buckets=PAYLOAD_BUCKETS)
+    stage_latency = Histogram("nesd_callback_stage_seconds", "Time per chart stage (see nesd_trace)",
+                              ["callback", "stage"], buckets=LATENCY_BUCKETS)
+    dataset_load = Gauge("nesd_dataset_load_seconds", "Time spent loading data at startup", ["stage"],
+                         multiprocess_mode="max")
+    # per-process counters (hits, misses, local cache size), summed over live workers
+    cache_stat = Gauge("nesd_figure_cache", "Figure cache counters, summed over workers", ["cache", "stat"],
+                       multiprocess_mode="livesum")
+    # box-wide values every worker sees the same (shared cache size)
+    cache_size = Gauge("nesd_shared_figure_cache", "Shared figure cache size", ["stat"], multiprocess_mode="max")
+
+PROCESS_CACHE_STATS = ("hits", "misses", "evictions", "entries", "bytes")
+
+
+def observe_load(stage, seconds):
+    if prometheus_client is not None:
+        dataset_load.labels(stage).set(seconds)
+
+
+def observe_stages(callback, stages):
+    # {stage: seconds} of one request, from nesd_trace
+    if prometheus_client is not None:
+        for stage, seconds in stages.items():
+            stage_latency.labels(callback, stage).observe(seconds)
+
+
+def callback_namer(app):
+    """-> fn(request payload) giving the callback's function name."""
+    names = {}
+
+    def callback_name(payload):
+        output = (payload or {}).get("output")
+        if output not in names:
+            fn = app.callback_map.get(output, {}).get("callback") if isinstance(output, str) else None
+            if fn is None:
+                return "unknown"  # don't let arbitrary request bodies mint label values
+            names[output] = getattr(fn, "__name__", None) or output
+        return names[output]
+
+    return callback_name
+
+
+def instrument(app, process_stats=None, shared_stats=None):
+    """Time the Dash app's callbacks and serve /metrics from its Flask server.
+
+    process_stats() -> {cache name: stats dict} is read after each callback
+    (must be cheap); shared_stats() -> stats dict only when /metrics is
+    scraped.
+    """
+    server = app.server
+    callback_name = callback_namer(app)
+
+    @server.before_request
+    def _start_timer():
+        if request.path.endswith("_dash-update-component"):
+            g.nesd_callback_start = time.perf_counter()
+
+    @server.after_request
+    def _record_callback(response):
+        start = g.pop("nesd_callback_start", None)
+        if start is None or prometheus_client is None:
+            return response
+        name = callback_name(request.get_json(silent=True))
+        if "cacheKey" in request.args:  # a background job's result poll
+            callback_polls.labels(name).inc()
+            return response
+        callback_calls.labels(name).inc()
+        callback_latency.labels(name).observe(time.perf_counter() - start)
+        callback_bytes.labels(name).observe(response.calculate_content_length() or 0)
+        if response.status_code >= 400:
+            callback_errors.labels(name).inc()
+        if process_stats is not None:
+            for cache, stats in process_stats().items():
+                for stat in PROCESS_CACHE_STATS:
+                    if stats.get(stat) is not None:
+                        cache_stat.labels(cache, stat).set(stats[stat])
+        return response
+
+    @server.route("/metrics")
+    def metrics():
+        if prometheus_client is None:
+            return Response("prometheus_client is not installed\n", status=503, mimetype="text/plain")
+        if shared_stats is not None:
+            stats = shared_stats() or {}
+            for stat in ("entries", "bytes"):
+                if stats.get(stat) is not None:
+                    cache_size.labels(stat).set(stats[stat])
+
+        if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+            registry = prometheus_client.CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = prometheus_client.REGISTRY
+        return Response(prometheus_client.generate_latest(registry), mimetype=prometheus_client.CONTENT_TYPE_LATEST)
@@ -0,0 +1,718 @@
+"""
+Aggregation pipelines behind the dashboard charts, plus a precomputed cube.
+
+Each chart's data is declared as a Query (bar_query / line_query /
+area_query: table, filters, group columns, metric, share of total) and run by
+a QueryEngine, which shares filter masks and groupbys between queries.
+bar_frame / line_frame / area_frame run a single chart's query and return the
+small aggregated frame it plots. AggregateCube runs them once, as one batch,
+for every input combination the UI can produce, so a chart request is a dict
+lookup.
+
+Filters run against a RowIndex: boolean row masks for every (column, value)
+pair, built once per table. A request's filters are mask ANDs and only the
+rows that reach the final groupby are materialized -- no per-request copy of
+the table and no per-request string scans.
+
+Label columns are usually Categorical (see nesd_data.normalize_tables), so
+every groupby passes observed=True to keep unobserved categories out.
+"""
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import re
+import threading
+import warnings
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # no flock (Windows) -> every process builds the cube itself
+    fcntl = None
+
+from nesd_data import LazyTable, derived_metrics
+from nesd_trace import span
+
+dem_labels = ["SEX_LABEL", "RACE_GROUP_LABEL", "ETH_GROUP_LABEL", "FOREIGN_BORN_GROUP_LABEL", "LFO_LABEL",
+              "VET_GROUP_LABEL", "W2_GROUP_LABEL" ]
+
+# firm-level dem column -> owner table column
+owner_label_map = {
+    "SEX_LABEL": "OWNER_SEX_LABEL",
+    "RACE_GROUP_LABEL": "OWNER_RACE_LABEL",
+    "ETH_GROUP_LABEL": "OWNER_ETH_LABEL",
+    "VET_GROUP_LABEL": "OWNER_VET_LABEL",
+    "FOREIGN_BORN_GROUP_LABEL": "OWNER_FOREIGN_BORN_LABEL",
+    "W2_GROUP_LABEL": "OWNER_W2_LABEL",
+}
+
+# how each firm-level metric is aggregated ("ratio": a nesd_data.derived_metrics
+# ratio, aggregated as sum(numerator) / sum(denominator))
+firm_metric_aggs = {
+    "FIRMNOPD": "sum",
+    "RCPNOPD": "sum",
+    "AVG_REVENUE_PER_FIRM": "ratio",
+}
+
+metrics = ["FIRMNOPD", "OWNNOPD", "RCPNOPD", "AVG_REVENUE_PER_FIRM"]
+
+# the only columns any view reads (nesd_data.normalize_tables drops the rest);
+# a derived metric is read as its numerator and denominator
+table_columns = {
+    "table1": ["YEAR", "NAICS2017_LABEL", *dem_labels,
+               *dict.fromkeys(col for m in firm_metric_aggs for col in derived_metrics.get(m, (m,)))],
+    "table_owner": ["YEAR", "NAICS2017_LABEL", *owner_label_map.values(), "OWNNOPD"],
+}
+
+# the columns the views filter on (these get a RowIndex mask per value)
+filter_columns = {
+    "table1": ["YEAR", "NAICS2017_LABEL", *dem_labels],
+    "table_owner": ["YEAR", "NAICS2017_LABEL", *owner_label_map.values()],
+}
+
+ALL_SECTORS = "Total for all sectors"
+ALL_OWNERS = "All owners of nonemployer firms"
+
+
+#------------------- Filter Engine ---------------#
+class RowIndex:
+    """Boolean row masks for every (column, value) pair of one table.
+
+    Masks are shared and read-only: combine them with `&` / `~` (which return
+    new arrays), never in place. Columns that weren't indexed fall back to a
+    plain comparison; columns the table doesn't have raise KeyError, like
+    df[col] would.
+    """
+
+    def __init__(self, df, columns=None):
+        self.df = df
+        self.columns = df.columns
+        self._masks = {}
+        self._values = {}
+        self._contains = {}
+
+        for col in (columns if columns is not None else df.columns):
+            if col not in df.columns:
+                continue
+            series = df[col]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                codes, uniques = series.cat.codes.to_numpy(), series.cat.categories
+            else:
+                codes, uniques = pd.factorize(series)
+            observed = np.unique(codes[codes >= 0])  # NaN rows (-1) match no value
+            self._values[col] = [uniques[code] for code in observed]
+            for code, value in zip(observed, self._values[col]):
+                mask = codes == code
+                mask.flags.writeable = False
+                self._masks[(col, value)] = mask
+
+    def __len__(self):
+        return len(self.df)
+
+    def all(self):
+        return np.ones(len(self.df), dtype=bool)
+
+    def eq(self, col, value):
+        if col not in self._values:
+            if col not in self.columns:
+                raise KeyError(col)
+            return (self.df[col] == value).to_numpy()
+        try:
+            mask = self._masks.get((col, value))
+        except TypeError:  # unhashable value can't match anything
+            mask = None
+        return mask if mask is not None else np.zeros(len(self.df), dtype=bool)
+
+    def ne(self, col, value):
+        return ~self.eq(col, value)
+
+    def isin(self, col, values):
+        mask = np.zeros(len(self.df), dtype=bool)
+        for value in values:
+            mask = mask | self.eq(col, value)
+        return mask
+
+    def contains(self, col, pattern):
+        """Rows whose lower-cased value matches `pattern` (str.lower().str.contains)."""
+        if col not in self._values:
+            if col not in self.columns:
+                raise KeyError(col)
+            return self.df[col].str.lower().str.contains(pattern, na=False).to_numpy()
+        key = (col, pattern)
+        if key not in self._contains:
+            regex = re.compile(pattern)
+            hits = [v for v in self._values[col] if isinstance(v, str) and regex.search(v.lower())]
+            mask = self.isin(col, hits)
+            mask.flags.writeable = False
+            self._contains[key] = mask
+        return self._contains[key]
+
+    def present(self, mask, col, value):
+        """`value in df[mask][col].unique()` without materializing df[mask]."""
+        return bool((mask & self.eq(col, value)).any())
+
+    def nunique(self, mask, col):
+        if col not in self._values:
+            return self.df.loc[mask, col].nunique()
+        return sum(1 for value in self._values[col] if self.present(mask, col, value))
+
+    def take(self, mask, columns):
+        """Materialize only the selected rows of `columns`."""
+        positions = [self.columns.get_loc(col) for col in columns]
+        return self.df.iloc[np.flatnonzero(mask), positions]
+
+
+#------------------- Query specs ---------------#
+# A chart's rows are described by a Query: the table, its filters, the group
+# columns, the metric and its reduction, and whether to add each group's share
+# of its year's total. Filters are (op, column, value) tuples applied in order:
+#   eq / ne / isin / not_contains   plain row filters
+#   eq_if_present                   keep only `value` rows, if the rows so far have any
+#   ne_if_varies                    drop `value` rows, if the column still varies
+# `where` holds the filters that depend only on year / sector (identical for
+# many charts, so their mask is computed once), `rules` the chart-specific rest.
+Query = namedtuple("Query", "table where rules dims metric agg share")
+
+
+def _firm_base_filters(columns):
+    # remove minority, nonminority, and equally
+    where = []
+    if "RACE_GROUP_LABEL" in columns:
+        where.append(("not_contains", "RACE_GROUP_LABEL", "minority|nonminority|equally"))
+    if "ETH_GROUP_LABEL" in columns:
+        where.append(("not_contains", "ETH_GROUP_LABEL", "equally"))
+    return where
+
+
+def _sector_filters(industry):
+    # line / area: no sector is "All", which keeps the all-sectors rows if the table has them
+    if industry and industry != "All":
+        return [("eq", "NAICS2017_LABEL", industry)]
+    return [("eq_if_present", "NAICS2017_LABEL", ALL_SECTORS)]
+
+
+def _firm_total_rules(columns, used):
+    # keep only Total vals in unused dem cols to avoid double counts (LFO is never reduced)
+    return [("eq_if_present", col, "Total") for col in dem_labels
+            if col in columns and col not in used and col != "LFO_LABEL"]
+
+
+def _owner_total_rules(columns, used):
+    # if an unused owner dem still varies, drop its all-owners rows
+    return [("ne_if_varies", col, ALL_OWNERS) for col in owner_label_map.values()
+            if col in columns and col not in used]
+
+
+def bar_query(columns, group_by, year_select, selected_industry, y_metric, color_group=None):
+    """Query for the bar chart; columns(table) -> that table's columns."""
+    # owner counts ignore year + sector (the owner table is summed across both)
+    if y_metric == "OWNNOPD":
+        owner_cols = columns("owners")
+        group_by_owner = owner_label_map.get(group_by, group_by)
+        color_group_owner = owner_label_map.get(color_group, color_group) if color_group else None
+
+        where = [("ne", "OWNER_RACE_LABEL", ALL_OWNERS), ("ne", "NAICS2017_LABEL", ALL_SECTORS)]
+        # remove totals from active dimensions
+        rules = [("ne", group_by_owner, ALL_OWNERS)] if group_by_owner in owner_cols else []
+        if color_group_owner and color_group_owner != group_by_owner and color_group_owner in owner_cols:
+            rules.append(("ne", color_group_owner, ALL_OWNERS))
+        rules += _owner_total_rules(owner_cols, [group_by_owner, color_group_owner])
+
+        dims = [group_by_owner]
+        if color_group_owner and color_group_owner != group_by_owner:
+            dims.append(color_group_owner)
+        return Query("owners", tuple(where), tuple(rules), tuple(dims), "OWNNOPD", "sum", False)
+
+    if y_metric not in firm_metric_aggs:
+        raise ValueError(f"unknown metric: {y_metric}")
+
+    firm_cols = columns("firms")
+    where = _firm_base_filters(firm_cols)
+    if year_select:
+        years = year_select if isinstance(year_select, (list, tuple)) else [year_select]
+        where.append(("isin", "YEAR", tuple(years)))
+    if selected_industry != "All":
+        where.append(("eq", "NAICS2017_LABEL", selected_industry))
+    else:
+        where.append(("eq_if_present", "NAICS2017_LABEL", ALL_SECTORS))
+
+    # filtering out Totals for active dems used:
+    rules = [("ne", group_by, "Total")] if group_by in firm_cols else []
+    if color_group and color_group != group_by and color_group in firm_cols:
+        rules.append(("ne", color_group, "Total"))
+    rules += _firm_total_rules(firm_cols, [group_by, color_group])
+
+    dims = list(dict.fromkeys([group_by, color_group] if color_group else [group_by]))
+    return Query("firms", tuple(where), tuple(rules), tuple(dims), y_metric, firm_metric_aggs[y_metric], False)
+
+
+def line_query(columns, selected_industry, y_metric, x_dem):
+    """Query for the line chart (one point per year)."""
+    x_dem = x_dem or "NAICS2017_LABEL"
+
+    if y_metric == "OWNNOPD":
+        owner_cols = columns("owners")
+        group_by_owner = owner_label_map.get(x_dem, x_dem)
+        rules = [("ne", group_by_owner, ALL_OWNERS)] if group_by_owner in owner_cols else []
+        rules += _owner_total_rules(owner_cols, [group_by_owner])
+        dims = ("YEAR", group_by_owner) if group_by_owner in owner_cols else ("YEAR",)
+        return Query("owners", tuple(_sector_filters(selected_industry)), tuple(rules), dims, "OWNNOPD", "sum", False)
+
+    firm_cols = columns("firms")
+    where = _firm_base_filters(firm_cols) + _sector_filters(selected_industry)
+    # Remove "Total", keep only totals for unused dem cols
+    rules = [("ne", x_dem, "Total")] if x_dem in firm_cols else []
+    rules += _firm_total_rules(firm_cols, [x_dem])
+    dims = ("YEAR", x_dem) if x_dem in firm_cols else ("YEAR",)
+    return Query("firms", tuple(where), tuple(rules), dims, y_metric, firm_metric_aggs.get(y_metric, "sum"), False)
+
+
+def area_query(columns, industry, y_metric, x_dem):
+    """Query for the stacked area chart: each group's share of its year."""
+    sector = [("eq", "NAICS2017_LABEL", industry)] if industry and industry != "All" else []
+
+    # owner count ratio:
+    if y_metric == "OWNNOPD":
+        group_col = owner_label_map.get(x_dem, x_dem)
+        where = [("ne", "NAICS2017_LABEL", ALL_SECTORS)] + sector
+        return Query("owners", tuple(where), (("ne", group_col, ALL_OWNERS),), ("YEAR", group_col),
+                     "OWNNOPD", "sum", True)
+
+    # firm count ratio + business receipt ratio:
+    return Query("firms", tuple(sector), (("ne", x_dem, "Total"),), ("YEAR", x_dem), y_metric,
+                 firm_metric_aggs.get(y_metric, "sum"), True)
+
+
+#------------------- Planner ---------------#
+def base_aggs(metric, agg):
+    """The (column, reduction) pairs a metric's aggregate is computed from."""
+    if agg == "ratio":
+        return [(col, "sum") for col in derived_metrics[metric]]
+    return [(metric, agg)]
+
+
+def filter_mask(index, filters, mask=None):
+    """Apply (op, column, value) filters in order to `mask` (default: every row)."""
+    m = index.all() if mask is None else mask
+    for op, col, value in filters:
+        if op == "eq":
+            m = m & index.eq(col, value)
+        elif op == "ne":
+            m = m & index.ne(col, value)
+        elif op == "isin":
+            m = m & index.isin(col, value)
+        elif op == "not_contains":
+            m = m & ~index.contains(col, value)
+        elif op == "eq_if_present":
+            if index.present(m, col, value):
+                m = m & index.eq(col, value)
+        elif op == "ne_if_varies":
+            if index.nunique(m, col) > 1:
+                m = m & index.ne(col, value)
+        else:
+            raise ValueError(f"unknown filter op: {op}")
+    return m
+
+
+class QueryEngine:
+    """Runs Queries against the RowIndex of each table, sharing work between them.
+
+    Filters are all evaluated as RowIndex masks before any row is
+    materialized, and only the group + metric columns are taken. `where`
+    masks are kept in a small LRU, so charts on the same year / sector reuse
+    them across tabs; queries that differ only in their metric (or share
+    flag) run as one take + one groupby, and the share of total is computed
+    on that groupby's output. Derived ratios are summed part by part in the
+    same groupby and divided afterwards (see base_aggs).
+
+    Subclasses can run the filters + groupby elsewhere by overriding
+    columns / values / aggregate (see nesd_duckdb.DuckDBEngine).
+    """
+
+    def __init__(self, indexes, max_masks=128):
+        self._indexes = indexes  # table -> RowIndex, or a zero-arg callable returning one
+        self._masks = OrderedDict()
+        self._max_masks = max_masks
+        self._lock = threading.Lock()
+
+    def index(self, table):
+        index = self._indexes[table]
+        return index() if callable(index) else index
+
+    def columns(self, table):
+        return self.index(table).columns
+
+    def values(self, table, col):
+        """Sorted distinct non-null values of a column."""
+        return sorted(self.index(table).df[col].dropna().unique())
+
+    def warm(self):
+        """Load whatever the first query would (the lazy RowIndexes)."""
+        for table in self._indexes:
+            self.index(table)
+
+    def where_mask(self, table, where):
+        key = (table, where)
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+        mask = filter_mask(self.index(table), where)
+        mask.flags.writeable = False
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > self._max_masks:
+                self._masks.popitem(last=False)
+        return mask
+
+    def run(self, queries, skip_errors=False):
+        """-> {query: frame}. With skip_errors, queries that fail (missing columns, ...) are left out."""
+        groups = {}
+        for query in queries:
+            groups.setdefault(query[:4], []).append(query)
+
+        out = {}
+        # grouped by `where`, so each shared mask is computed once
+        for (table, where, rules, dims), group in sorted(groups.items(), key=lambda g: repr(g[0][:2])):
+            aggs = list(dict.fromkeys(spec for q in group for spec in base_aggs(q.metric, q.agg)))
+            try:
+                grouped = self.aggregate(table, where, rules, dims, aggs)
+            except (KeyError, ValueError, TypeError):
+                if skip_errors:
+                    continue
+                raise
+
+            for query in group:
+                parts = [grouped[f"_{aggs.index(spec)}"] for spec in base_aggs(query.metric, query.agg)]
+                if query.agg == "ratio":
+                    value = parts[0] / parts[1].where(parts[1] != 0)
+                else:
+                    value = parts[0]
+                if not query.share:
+                    out[query] = grouped[list(dims)].assign(y_value=value)
+                    continue
+                # calc total and percentage (ratio) per year
+                frame = grouped[list(dims)].assign(**{query.metric: value})
+                frame["TOTAL"] = frame.groupby("YEAR")[query.metric].transform("sum")
+                frame["PERCENTAGE"] = (frame[query.metric] / frame["TOTAL"]) * 100
+                out[query] = frame
+        return out
+
+    def frame(self, query):
+        return self.run([query])[query]
+
+    def aggregate(self, table, where, rules, dims, aggs):
+        """Filtered groupby: one row per group (sorted), the dims then `_i` = aggs[i] (metric, reduction)."""
+        with span("filter"):
+            index = self.index(table)
+            mask = filter_mask(index, rules, self.where_mask(table, where))
+            df = index.take(mask, list(dims) + list(dict.fromkeys(m for m, _ in aggs)))
+        with span("groupby"):
+            return df.groupby(list(dims), as_index=False, observed=True).agg(
+                **{f"_{i}": spec for i, spec in enumerate(aggs)})
+
+
+def _engine(firms, owners):
+    return QueryEngine({"firms": firms, "owners": owners})
+
+
+def bar_frame(firms, owners, group_by, year_select, selected_industry, y_metric, color_group=None):
+    """Bar chart rows; firms / owners are the RowIndex of table1 / table_owner."""
+    engine = _engine(firms, owners)
+    return engine.frame(bar_query(engine.columns, group_by, year_select, selected_industry, y_metric, color_group))
+
+
+def line_frame(firms, owners, selected_industry, y_metric, x_dem):
+    engine = _engine(firms, owners)
+    return engine.frame(line_query(engine.columns, selected_industry, y_metric, x_dem))
+
+
+def area_frame(firms, owners, industry, y_metric, x_dem):
+    engine = _engine(firms, owners)
+    return engine.frame(area_query(engine.columns, industry, y_metric, x_dem))
+
+
+#------------------ Aggregate Cube ---------------#
+CUBE_VERSION = 6
+
+
+def frame_fingerprint(*frames):
+    h = hashlib.sha256(str(CUBE_VERSION).encode())
+    for df in frames:
+        h.update(",".join(map(str, df.columns)).encode())
+        h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h.hexdigest()
+
+
+def version_fingerprint(data_version):
+    """Fingerprint of a cube built from the sources at `data_version` (known before loading it)."""
+    return hashlib.sha256(f"{CUBE_VERSION}:{data_version}".encode()).hexdigest()
+
+
+def _sector_key(industry):
+    # line/area treat a missing sector exactly like "All"
+    return industry if industry and industry != "All" else "All"
+
+
+def _year_key(year_select):
+    if isinstance(year_select, list):
+        if len(year_select) > 1:
+            return tuple(year_select)  # multi-year selections aren't precomputed
+        year_select = year_select[0] if year_select else None
+    return year_select or None
+
+
+class AggregateCube:
+    """Every (chart, metric, dems, year, sector) aggregate the UI can ask for.
+
+    Frames are stored pickled and decoded per lookup, which keeps loading the
+    cube cheap and hands every caller its own copy. Keys outside the
+    precomputed space run the chart's query live, and the build runs the same
+    queries (batched), so results never differ from bar_frame / line_frame /
+    area_frame. Keys the build tried but couldn't compute (e.g. owner counts
+    by LFO) are remembered, see failed().
+
+    The saved file is an index header followed by the concatenated frames;
+    loading memory-maps it, so all workers share one copy of the frames.
+    """
+
+    def __init__(self, table1, table_owner, data_version=None, engine=None):
+        # the tables may be nesd_data.LazyTables: a table (and its RowIndex) is
+        # only loaded when a query needs it -- a lookup that misses the cube, a
+        # build, the dropdown values or a preload
+        self._table1 = table1
+        self._table_owner = table_owner
+        self._firms = LazyTable("firm row index", lambda: RowIndex(self.table1, filter_columns["table1"]))
+        self._owners = LazyTable("owner row index",
+                                 lambda: RowIndex(self.table_owner, filter_columns["table_owner"]))
+        # queries run on the RowIndexes, or on `engine` (e.g. nesd_duckdb.DuckDBEngine
+        # over the Parquet files, which never loads the tables)
+        self.engine = engine or QueryEngine({"firms": self._firms, "owners": self._owners})
+        if data_version is not None:
+            # a version of the source files (nesd_data.tables_version) saves
+            # hashing -- and loading -- the tables themselves
+            self.fingerprint = version_fingerprint(data_version)
+        else:
+            self.fingerprint = frame_fingerprint(self.table1, self.table_owner)
+        self._index = {}  # key -> (offset, length) into self._data
+        self._data = b""
+        self._failed = frozenset()  # keys the build couldn't plan or run
+
+    @property
+    def table1(self):
+        return self._table1() if callable(self._table1) else self._table1
+
+    @property
+    def table_owner(self):
+        return self._table_owner() if callable(self._table_owner) else self._table_owner
+
+    @property
+    def firms(self):
+        return self._firms.get()
+
+    @property
+    def owners(self):
+        return self._owners.get()
+
+    def warm(self):
+        """Load what lookups outside the cube need, ahead of the first one."""
+        self.engine.warm()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def failed(self, key):
+        """True if the build tried `key` and it errored: a live lookup would raise too."""
+        return key in self._failed
+
+    def keys(self):
+        return self._index.keys()
+
+    def get(self, key):
+        loc = self._index.get(key)
+        if loc is None:
+            return None
+        offset, length = loc
+        return pickle.loads(self._data[offset:offset + length])
+
+    # ---- keys ---- #
+    @staticmethod
+    def bar_key(group_by, year_select, selected_industry, y_metric, color_group=None):
+        # a color equal to the x demographic groups exactly like no color
+        color_group = None if color_group == group_by else (color_group or None)
+        if y_metric == "OWNNOPD":
+            return ("bar", y_metric, group_by, color_group)
+        return ("bar", y_metric, group_by, color_group, _year_key(year_select), selected_industry)
+
+    @staticmethod
+    def line_key(selected_industry, y_metric, x_dem):
+        return ("line", y_metric, _sector_key(selected_industry), x_dem or "NAICS2017_LABEL")
+
+    @staticmethod
+    def area_key(industry, y_metric, x_dem):
+        return ("area", y_metric, _sector_key(industry), x_dem)
+
+    # ---- lookups ---- #
+    def bar(self, group_by, year_select, selected_industry, y_metric, color_group=None):
+        with span("cube"):
+            df = self.get(self.bar_key(group_by, year_select, selected_industry, y_metric, color_group))
+        if df is None:
+            # outside the precomputed space: plan + run the chart's query on the RowIndex
+            with span("pipeline"):
+                df = self.engine.frame(bar_query(self.engine.columns, group_by, year_select, selected_industry, y_metric, color_group))
+        return df
+
+    def line(self, selected_industry, y_metric, x_dem):
+        with span("cube"):
+            df = self.get(self.line_key(selected_industry, y_metric, x_dem))
+        if df is None:
+            with span("pipeline"):
+                df = self.engine.frame(line_query(self.engine.columns, selected_industry, y_metric, x_dem))
+        return df
+
+    def area(self, industry, y_metric, x_dem):
+        with span("cube"):
+            df = self.get(self.area_key(industry, y_metric, x_dem))
+        if df is None:
+            with span("pipeline"):
+                df = self.engine.frame(area_query(self.engine.columns, industry, y_metric, x_dem))
+        return df
+
+    # ---- build ---- #
+    def input_space(self):
+        """Years (plus None = no year filter) and sectors (plus "All") the dropdowns offer."""
+        years = self.engine.values("firms", "YEAR") + [None]
+        sectors = set(self.engine.values("firms", "NAICS2017_LABEL"))
+        sectors |= set(self.engine.values("owners", "NAICS2017_LABEL"))
+        return years, sorted(sectors) + ["All"]
+
+    def build(self):
+        years, sectors = self.input_space()
+        columns = self.engine.columns
+        firm_metrics = [m for m, agg in firm_metric_aggs.items()
+                        if all(col in columns("firms") for col, _ in base_aggs(m, agg))]
+
+        plan = {}  # cube key -> Query
+        failed = set()
+
+        def plan_query(key, build_query, *args):
+            # combos that can't be planned (e.g. an unknown metric) are left out;
+            # the live lookup raises the same error at request time
+            try:
+                plan[key] = build_query(columns, *args)
+            except (KeyError, ValueError, TypeError):
+                failed.add(key)
+
+        for group_by in dem_labels:
+            for color_group in [None] + [c for c in dem_labels if c != group_by]:
+                plan_query(self.bar_key(group_by, None, "All", "OWNNOPD", color_group),
+                           bar_query, group_by, None, "All", "OWNNOPD", color_group)
+                for year in years:
+                    for sector in sectors:
+                        for y_metric in firm_metrics:
+                            plan_query(self.bar_key(group_by, year, sector, y_metric, color_group),
+                                       bar_query, group_by, year, sector, y_metric, color_group)
+
+        for x_dem in dem_labels:
+            for sector in sectors:
+                for y_metric in firm_metrics + ["OWNNOPD"]:
+                    plan_query(self.line_key(sector, y_metric, x_dem), line_query, sector, y_metric, x_dem)
+                for y_metric in firm_metrics + ["OWNNOPD"]:
+                    plan_query(self.area_key(sector, y_metric, x_dem), area_query, sector, y_metric, x_dem)
+
+        # queries that fail to run (e.g. LFO on the owner table) are left out too
+        frames = self.engine.run(set(plan.values()), skip_errors=True)
+
+        index, chunks, offset = {}, [], 0
+        for key, query in plan.items():
+            if query not in frames:
+                failed.add(key)
+                continue
+            blob = pickle.dumps(frames[query], protocol=pickle.HIGHEST_PROTOCOL)
+            index[key] = (offset, len(blob))
+            chunks.append(blob)
+            offset += len(blob)
+
+        self._index, self._data = index, b"".join(chunks)
+        self._failed = frozenset(failed - index.keys())
+        return self
+
+    # ---- persistence ---- #
+    # file layout: <u64 header length><pickled {fingerprint, index, failed}><frames>
+    def save(self, path):
+        header = pickle.dumps({"fingerprint": self.fingerprint, "index": self._index, "failed": self._failed},
+                              protocol=pickle.HIGHEST_PROTOCOL)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(struct.pack("<Q", len(header)))
+            f.write(header)
+            f.write(self._data)
+        os.replace(tmp, path)
+
+    def _map(self, path):
+        """Point the cube at a saved file; False if it's unreadable or from other tables."""
+        with open(path, "rb") as f:
+            (header_len,) = struct.unpack("<Q", f.read(8))
+            header = pickle.loads(f.read(header_len))
+            if header.get("fingerprint") != self.fingerprint:
+                return False
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = 8 + header_len
+        self._index = {key: (start + offset, length) for key, (offset, length) in header["index"].items()}
+        self._failed = header["failed"]
+        self._data = data
+        return True
+
+    def _try_map(self, path):
+        try:
+            return self._map(path)
+        except Exception:  # missing, truncated or old-format file -> rebuild
+            return False
+
+    @classmethod
+    def load_or_build(cls, table1, table_owner, path, data_version=None, engine=None):
+        """Reuse the cube saved at `path` if it was built from these exact tables.
+
+        The build runs under a lock on `<path>.lock`: when several workers start
+        (or reload) together, one builds and saves the cube and the others wait
+        for it and map the saved file.
+        """
+        cube = cls(table1, table_owner, data_version, engine)
+        if cube._try_map(path):
+            return cube
+
+        with _build_lock(path):
+            # another worker may have saved it while this one waited
+            if cube._try_map(path):
+                return cube
+            cube.build()
+            try:
+                cube.save(path)
+            except OSError as e:
+                warnings.warn(f"could not save aggregate cube to {path}: {e}")
+        return cube
+
+
+@contextmanager
+def _build_lock(path):
+    """Exclusive flock on `<path>.lock` for as long as the block runs (a no-op without flock)."""
+    try:
+        f = open(f"{path}.lock", "a") if fcntl else None
+    except OSError:  # e.g. read-only dir: the save will fail too, so just build
+        f = None
+    if f is None:
+        yield
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX)  # released when f is closed
+        yield
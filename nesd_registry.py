@@ -0,0 +1,138 @@
+"""
+Hot reload of the dashboard data.
+
+DataRegistry holds the current Dataset -- the tables, the aggregate cube and
+anything else derived from one version of the source files -- behind a single
+reference. A watcher thread polls the sources' version (nesd_data.tables_version:
+mtime/size first, content hash only when those moved); once a new version has
+held still for one poll, so half-written files are skipped, it is loaded
+completely in the background and swapped in with one assignment.
+
+Requests read `registry.current` once and use that Dataset throughout, so
+they see the old data or the new, never a mix and never a half-loaded one.
+on_swap callbacks drop whatever was cached for the old version.
+
+With background=True the first dataset loads on a thread too, so the app can
+start serving before it is ready; `current` waits for it.
+"""
+import logging
+import threading
+import time
+
+from nesd_data import LazyTable, preload
+
+log = logging.getLogger("nesd")
+
+
+class Dataset:
+    """Everything derived from one version of the source files."""
+
+    def __init__(self, version, tables, cube, bundle=None):
+        self.version = version
+        self.tables = tables
+        self.cube = cube
+        self.bundle = bundle  # nesd_cache.FigureBundle built from this version, if any
+        self.loaded_at = time.time()
+
+
+class DataRegistry:
+    """The current Dataset, reloaded when the source files change.
+
+    load(version) -> Dataset builds a complete dataset; version() returns the
+    sources' current version; warm(dataset), if given, runs on a reloaded
+    dataset before it is swapped in (e.g. to load its lazy tables). With
+    background, the first dataset loads on a daemon thread instead of in the
+    constructor.
+    """
+
+    def __init__(self, load, version, warm=None, background=False):
+        self._load = load
+        self._version = version
+        self._warm = warm
+        self._on_swap = []
+        self._lock = threading.Lock()  # one check / reload at a time
+        self._pending = None  # changed version waiting to settle
+        self.reloads = 0
+        self.last_error = None
+        self._current = None
+        self._first_version = version()
+        self._first = LazyTable("dataset", self._load_first)
+        if background:
+            preload(self._first)
+        else:
+            self._first.get()
+
+    def _load_first(self):
+        self._current = self._load(self._first_version)
+        return True
+
+    @property
+    def current(self):
+        """The current Dataset (waits for the first one if it is still loading)."""
+        current = self._current
+        if current is None:
+            self._first.get()
+            current = self._current
+        return current
+
+    @property
+    def loaded(self):
+        """False while the first dataset is still loading."""
+        return self._current is not None
+
+    @property
+    def version(self):
+        """Version of the current dataset, known before it has loaded."""
+        current = self._current
+        return current.version if current is not None else self._first_version
+
+    def on_swap(self, fn):
+        """Register fn(old, new), called after every swap."""
+        self._on_swap.append(fn)
+        return fn
+
+    def check(self):
+        """Reload if the sources changed (and settled); True if a new dataset was swapped in."""
+        with self._lock:
+            version = self._version()
+            if version == self.current.version:
+                self._pending = None
+                return False
+            if version != self._pending:
+                self._pending = version
+                return False
+            return self._swap(version)
+
+    def reload(self):
+        """Load the sources as they are now and swap them in, changed or not."""
+        with self._lock:
+            return self._swap(self._version())
+
+    def _swap(self, version):
+        start = time.perf_counter()
+        new = self._load(version)
+        if self._warm is not None:
+            self._warm(new)
+        old, self._current = self.current, new
+        self._pending = None
+        self.reloads += 1
+        log.info("data reloaded (version %s) in %.1fs", version[:16], time.perf_counter() - start)
+        for fn in self._on_swap:
+            fn(old, new)
+        return True
+
+    def watch(self, interval):
+        """Poll for changes every `interval` seconds on a daemon thread."""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.check()
+                    self.last_error = None
+                except Exception as e:  # keep serving the old data; retry next poll
+                    self.last_error = repr(e)
+                    log.exception("data reload failed")
+
+        thread = threading.Thread(target=run, name="nesd-data-watch", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,159 @@
+"""
+Per-stage timings and on-demand profiling for Dash callback requests.
+
+Code on the chart path wraps its stages in `span("stage")`; during a
+/_dash-update-component request the time of each stage is summed, and one
+JSON line per request goes to the "nesd.trace" logger:
+
+    {"callback": "render_tab_content", "status": 200, "total_ms": 41.2,
+     "stages": {"cube": 0.4, "px": 28.1, "layout": 6.3, "serialize": 4.9, ...}}
+
+Stages may nest (`filter` and `groupby` run inside `pipeline`), so they can
+add up to more than the total. Outside a request (cube build, scripts) span()
+does nothing, unless the code runs under trace_job(): a callback in a Dash
+background job, whose spans are logged as one line of their own, marked
+"job". NESD_TRACE=0 turns the log lines off.
+
+Profiling is opt-in per request and only when both NESD_PROFILE_DIR and
+NESD_PROFILE_TOKEN are set at startup. A profile slows its worker and writes
+a file, so only a caller that knows the token can ask for one: a callback
+request carrying an `X-NESD-Profile: <token>` header, or sent by a browser
+that opened the page as `/?nesd_profile=<token>` (sets a cookie; `=0` clears
+it), runs under cProfile and the stats are dumped to
+NESD_PROFILE_DIR/<time>-<callback>-<pid>.prof (open with `python -m pstats`
+or snakeviz). Any other value is ignored. One request per process is
+profiled at a time.
+"""
+import contextlib
+import cProfile
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+log = logging.getLogger("nesd.trace")
+
+PROFILE_HEADER = "X-NESD-Profile"
+PROFILE_COOKIE = "nesd_profile"
+
+_profiler_lock = threading.Lock()  # cProfile can't run two profilers at once
+_job = threading.local()  # .spans while a trace_job() block runs
+
+
+@contextlib.contextmanager
+def span(stage):
+    spans = getattr(_job, "spans", None)
+    if spans is None and has_request_context():
+        spans = g.get("nesd_spans")
+    if spans is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans[stage] = spans.get(stage, 0.0) + time.perf_counter() - start
+
+
+@contextlib.contextmanager
+def trace_job(callback):
+    """Log the spans of a callback run outside a request (a background job) as one line.
+
+    A job process is forked from the request that started it, so it still sees
+    that request's context, but no response of it is ever traced.
+    """
+    if os.environ.get("NESD_TRACE", "1") == "0":
+        yield
+        return
+    _job.spans = {}
+    start = time.perf_counter()
+    record = {"callback": callback, "job": True, "status": "error"}
+    try:
+        yield
+        record["status"] = "ok"
+    finally:
+        spans, _job.spans = _job.spans, None
+        record["total_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        record["stages"] = {stage: round(seconds * 1000, 2) for stage, seconds in spans.items()}
+        log.info(json.dumps(record))
+
+
+def _has_token(value, token):
+    return bool(value) and hmac.compare_digest(value.encode(), token.encode())
+
+
+def _profile_requested(token):
+    flag = request.headers.get(PROFILE_HEADER) or request.cookies.get(PROFILE_COOKIE)
+    return _has_token(flag, token)
+
+
+def instrument(app, callback_name, on_stages=None):
+    """Trace (and on request profile) the Dash app's callback requests.
+
+    callback_name(payload) -> label for the log line; on_stages(name, stages)
+    is called with each request's {stage: seconds}.
+    """
+    server = app.server
+    enabled = os.environ.get("NESD_TRACE", "1") != "0"
+    profile_dir = os.environ.get("NESD_PROFILE_DIR")
+    profile_token = os.environ.get("NESD_PROFILE_TOKEN")
+    if profile_dir and not profile_token:
+        log.warning("NESD_PROFILE_DIR is set but NESD_PROFILE_TOKEN isn't: profiling stays off")
+        profile_dir = None
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+
+    @server.before_request
+    def _start_trace():
+        if not request.path.endswith("_dash-update-component"):
+            return
+        g.nesd_spans = {}
+        g.nesd_trace_start = time.perf_counter()
+        if profile_dir and _profile_requested(profile_token) and _profiler_lock.acquire(blocking=False):
+            g.nesd_profiler = cProfile.Profile()
+            g.nesd_profiler.enable()
+
+    @server.after_request
+    def _finish_trace(response):
+        if profile_dir and request.args.get(PROFILE_COOKIE) is not None:
+            # page opened with ?nesd_profile=<token> / =0: (un)flag this browser's callbacks
+            if _has_token(request.args[PROFILE_COOKIE], profile_token):
+                response.set_cookie(PROFILE_COOKIE, profile_token, httponly=True, samesite="Strict")
+            else:
+                response.delete_cookie(PROFILE_COOKIE)
+
+        spans = g.pop("nesd_spans", None)
+        if spans is None:
+            return response
+        total = time.perf_counter() - g.pop("nesd_trace_start")
+        name = callback_name(request.get_json(silent=True))
+
+        record = {"callback": name, "status": response.status_code, "total_ms": round(total * 1000, 2)}
+        profiler = g.pop("nesd_profiler", None)
+        if profiler is not None:
+            try:
+                profiler.disable()
+                path = os.path.join(profile_dir, f"{time.strftime('%Y%m%dT%H%M%S')}-{name}-{os.getpid()}.prof")
+                profiler.dump_stats(path)
+            finally:
+                _profiler_lock.release()
+            record["profile"] = path
+            response.headers[PROFILE_HEADER] = os.path.basename(path)
+
+        if on_stages is not None:
+            on_stages(name, spans)
+        if enabled or profiler is not None:
+            record["stages"] = {stage: round(seconds * 1000, 2) for stage, seconds in spans.items()}
+            log.info(json.dumps(record))
+        return response
+
+    @server.teardown_request
+    def _drop_profiler(exc):
+        profiler = g.pop("nesd_profiler", None)
+        if profiler is not None:  # the request failed before after_request ran
+            profiler.disable()
+            _profiler_lock.release()
@@ -0,0 +1,218 @@
+"""
+Benchmark suite: every chart function over the full dropdown matrix, plus
+app startup and the extractor, with JSON results and regression gates.
+
+    python scripts/benchmark_suite.py [--output results.json]
+        [--baseline old.json] [--max-p95-regression 0.10] [--max-memory-regression 0.10]
+        [--sample N] [--workbooks DIR] [--startup-runs 3]
+
+Suites
+  bar / line / stacked-plot   update_plot / update_line_plot /
+                              update_stacked_area_plot over the product of
+                              x demographic, color demographic (bar), metric,
+                              sector and year (bar); one call per case
+  startup                     `import app_v3` in a fresh interpreter (warm
+                              snapshots / cube on disk)
+  extract                     a cold default extraction (run_incremental into
+                              a scratch dir, Parquet output) of the yearly
+                              workbooks in --workbooks (skipped without it)
+
+Every suite runs in its own child process, so `peak_rss_mb` is that suite's
+peak resident memory. Latencies are in milliseconds. With --baseline the
+run exits 1 if any suite's p95 or peak memory grew by more than the given
+fraction.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+
+def _summary(times, errors=0):
+    ms = np.asarray(times) * 1000
+    if not len(ms):
+        return {"n": 0, "errors": errors}
+    return {
+        "n": int(len(ms)),
+        "errors": errors,
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "total_s": float(ms.sum() / 1000),
+    }
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    return resource.getrusage(who).ru_maxrss / 1024  # KiB on Linux
+
+
+# ---------------- Chart suites ---------------- #
+def chart_cases(app_v3, view):
+    from nesd_query import dem_labels as dems, metrics
+
+    years, sectors = app_v3.registry.current.cube.input_space()
+    if view == "bar":
+        # (group_by, year, sector, metric, color)
+        return [(x, year, sector, metric, color) for x, color, metric, sector, year
+                in itertools.product(dems, [None] + dems, metrics, sectors, years)]
+    # (sector, metric, x_dem)
+    return [(sector, metric, x) for x, metric, sector in itertools.product(dems, metrics, sectors)]
+
+
+def run_chart_suite(view, sample, conn):
+    os.chdir(ROOT)
+    import app_v3
+
+    fn = {"bar": app_v3.update_plot, "line": app_v3.update_line_plot,
+          "stacked-plot": app_v3.update_stacked_area_plot}[view]
+    cases = chart_cases(app_v3, view)
+    if sample and sample < len(cases):
+        cases = cases[::len(cases) // sample][:sample]  # evenly spread, deterministic
+
+    times, errors = [], 0
+    for args in cases:
+        t0 = time.perf_counter()
+        try:
+            fn(*args)
+        except Exception:  # combos the UI can't produce (e.g. LFO with owner counts)
+            errors += 1
+            continue
+        times.append(time.perf_counter() - t0)
+    conn.send(dict(_summary(times, errors), cases=len(cases), peak_rss_mb=_peak_rss_mb()))
+
+
+def run_extract_suite(workbooks, conn):
+    from nesd_extract_tables import files, run_incremental
+
+    paths = [os.path.join(workbooks, f) for f in files if os.path.exists(os.path.join(workbooks, f))]
+    with tempfile.TemporaryDirectory(prefix="nesd-extract-") as out_dir:
+        t0 = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # the per-partition report
+            run_incremental(paths, out_dir=out_dir)
+        elapsed = time.perf_counter() - t0
+    conn.send(dict(_summary([elapsed]), workbooks=len(paths),
+                   peak_rss_mb=max(_peak_rss_mb(), _peak_rss_mb(resource.RUSAGE_CHILDREN))))
+
+
+def in_child(target, *args):
+    parent, child = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.get_context("spawn").Process(target=target, args=(*args, child))
+    proc.start()
+    result = parent.recv()
+    proc.join()
+    return result
+
+
+# ---------------- Startup ---------------- #
+def run_startup(runs):
+    times, peaks = [], []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-c", "import app_v3"], cwd=ROOT,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode:
+            raise RuntimeError("import app_v3 failed")
+        times.append(time.perf_counter() - t0)
+        peaks.append(usage.ru_maxrss / 1024)
+    return dict(_summary(times), peak_rss_mb=max(peaks))
+
+
+# ---------------- Regression gate ---------------- #
+def compare(results, baseline, max_p95, max_mem):
+    failures = []
+    print(f"\n{'suite':<14}{'p95 ms':>12}{'baseline':>12}{'change':>9}{'peak MB':>10}{'baseline':>10}{'change':>9}")
+    for name, cur in results.items():
+        old = baseline.get(name)
+        if not old or not cur.get("n") or not old.get("n"):
+            continue
+        dp95 = cur["p95_ms"] / old["p95_ms"] - 1
+        dmem = cur["peak_rss_mb"] / old["peak_rss_mb"] - 1
+        print(f"{name:<14}{cur['p95_ms']:>12.2f}{old['p95_ms']:>12.2f}{dp95:>+9.0%}"
+              f"{cur['peak_rss_mb']:>10.0f}{old['peak_rss_mb']:>10.0f}{dmem:>+9.0%}")
+        if dp95 > max_p95:
+            failures.append(f"{name}: p95 {old['p95_ms']:.2f} -> {cur['p95_ms']:.2f} ms ({dp95:+.0%})")
+        if dmem > max_mem:
+            failures.append(f"{name}: peak memory {old['peak_rss_mb']:.0f} -> {cur['peak_rss_mb']:.0f} MB ({dmem:+.0%})")
+    return failures
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON of an earlier run to compare against")
+    parser.add_argument("--max-p95-regression", type=float, default=0.10, help="allowed p95 growth (fraction)")
+    parser.add_argument("--max-memory-regression", type=float, default=0.10, help="allowed peak RSS growth (fraction)")
+    parser.add_argument("--sample", type=int, default=0, help="cases per chart suite (default: the full matrix)")
+    parser.add_argument("--suites", nargs="+", default=["startup", "bar", "line", "stacked-plot", "extract"])
+    parser.add_argument("--startup-runs", type=int, default=3)
+    parser.add_argument("--workbooks", help="directory with the yearly workbooks for the extract suite")
+    args = parser.parse_args()
+
+    results = {}
+    for suite in args.suites:
+        t0 = time.perf_counter()
+        if suite == "startup":
+            results[suite] = run_startup(args.startup_runs)
+        elif suite == "extract":
+            if not args.workbooks:
+                continue
+            results[suite] = in_child(run_extract_suite, args.workbooks)
+        else:
+            results[suite] = in_child(run_chart_suite, suite, args.sample)
+        r = results[suite]
+        print(f"{suite:<14}{r['n']:>7} runs  p50 {r.get('p50_ms', 0):>9.2f} ms  p95 {r.get('p95_ms', 0):>9.2f} ms"
+              f"  peak {r['peak_rss_mb']:>6.0f} MB  ({time.perf_counter() - t0:.0f}s)")
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "sample": args.sample,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        failures = compare(results, baseline, args.max_p95_regression, args.max_memory_regression)
+        if failures:
+            print("\nREGRESSION:\n  " + "\n  ".join(failures))
+            sys.exit(1)
+        print("\nno regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""
+Cold-start report: import cost and time to first response, per boot mode.
+
+    python scripts/boot_report.py [--modes default fast cold] [--top 12]
+        [--boot-dir nesd_boot] [--port 8052] [--output report.json]
+
+For each mode it first imports app_v3 under `python -X importtime` and lists
+the slowest imports the app module makes (cumulative, children included),
+then starts `gunicorn app_v3:server` and times, from the moment the process
+is spawned: the port accepting connections, the first page (/), the layout
+(/_dash-layout, the dropdown options) and the first chart (the default
+view's callback).
+
+Modes: default is the app as configured; fast is NESD_FAST_BOOT=1 over the
+--boot-dir prebuilt by nesd_build_boot.py; cold is a fast boot over an empty
+boot dir, i.e. a fresh deploy without the build step, where the tables and
+the cube are built at boot.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the default view's chart render (same payload the browser sends on page load)
+RENDER_REQUEST = {
+    "output": "..plot-title.children...plot-info-tooltip.children...plot-graph.figure...plot-figure-inputs.data"
+              "...plot-render-request.data..",
+    "outputs": [
+        {"id": "plot-title", "property": "children"},
+        {"id": "plot-info-tooltip", "property": "children"},
+        {"id": "plot-graph", "property": "figure"},
+        {"id": "plot-figure-inputs", "property": "data"},
+        {"id": "plot-render-request", "property": "data"},
+    ],
+    "inputs": [
+        {"id": "plot-tabs", "property": "active_tab", "value": "bar"},
+        {"id": "bar-dem-dropdown", "property": "value", "value": "SEX_LABEL"},
+        {"id": "color-dem-dropdown", "property": "value", "value": "RACE_GROUP_LABEL"},
+        {"id": "yaxis-metric-dropdown", "property": "value", "value": "FIRMNOPD"},
+        {"id": "industry-dropdown", "property": "value", "value": "All"},
+        {"id": "year-dropdown", "property": "value", "value": 2019},
+        {"id": "compare-toggle", "property": "value", "value": False},
+    ],
+    "state": [{"id": "plot-figure-inputs", "property": "data", "value": None}],
+    "changedPropIds": [],
+}
+
+
+def mode_env(mode, boot_dir):
+    env = dict(os.environ, NESD_TRACE="0", NESD_RELOAD_INTERVAL="", NESD_BACKGROUND_DIR="")
+    if mode == "fast":
+        env.update(NESD_FAST_BOOT="1", NESD_BOOT_DIR=boot_dir)
+    elif mode == "cold":
+        env.update(NESD_FAST_BOOT="1", NESD_BOOT_DIR=tempfile.mkdtemp(prefix="nesd-cold-boot-"))
+    if mode != "default":
+        env.pop("NESD_SHARED_DATA_DIR", None)
+    return env
+
+
+def import_times(env):
+    # -> (seconds to import app_v3, [(module, cumulative seconds)] of its direct imports)
+    # then waits for the data: a process exiting while a fast boot still loads it in the
+    # background can hang in pyarrow's teardown
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app_v3; app_v3.registry.current"],
+                          cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    rows = []  # (depth, module, cumulative seconds); a module is listed after its imports
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "imported package" not in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            rows.append(((len(name) - len(name.lstrip()) - 1) // 2, name.strip(), int(cumulative) / 1e6))
+
+    app = max(i for i, (_, name, _) in enumerate(rows) if name == "app_v3")
+    depth, children = rows[app][0], []
+    for d, name, seconds in reversed(rows[:app]):
+        if d <= depth:
+            break
+        if d == depth + 1:
+            children.append((name, seconds))
+    return rows[app][2], sorted(children, key=lambda c: -c[1])
+
+
+def _port_open(port):
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+def first_response(env, port, timeout=600):
+    # -> {milestone: seconds since gunicorn was spawned}
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", "1", "-b", f"127.0.0.1:{port}", "--timeout", str(timeout),
+         "app_v3:server"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    out = {}
+    try:
+        while not _port_open(port):
+            if proc.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"port {port} not bound after {timeout}s")
+            time.sleep(0.01)
+        out["port"] = time.perf_counter() - start
+
+        # requests wait in the listen backlog until the worker has imported the app
+        urllib.request.urlopen(base_url + "/", timeout=timeout).read()
+        out["page"] = time.perf_counter() - start
+        urllib.request.urlopen(base_url + "/_dash-layout", timeout=timeout).read()
+        out["layout"] = time.perf_counter() - start
+        req = urllib.request.Request(base_url + "/_dash-update-component", data=json.dumps(RENDER_REQUEST).encode(),
+                                     headers={"Content-Type": "application/json"})
+        urllib.request.urlopen(req, timeout=timeout).read()
+        out["chart"] = time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--modes", nargs="+", default=["default", "fast", "cold"],
+                        choices=["default", "fast", "cold"])
+    parser.add_argument("--top", type=int, default=12, help="slowest imports listed per mode")
+    parser.add_argument("--boot-dir", default=os.path.join(ROOT, "nesd_boot"), help="nesd_build_boot.py output")
+    parser.add_argument("--port", type=int, default=8052)
+    parser.add_argument("--output", help="also write the results as JSON")
+    args = parser.parse_args()
+
+    if "fast" in args.modes and not os.path.exists(os.path.join(args.boot_dir, "boot.json")):
+        sys.exit(f"no boot files in {args.boot_dir} (run nesd_build_boot.py --out {args.boot_dir})")
+
+    results = {}
+    for mode in args.modes:
+        envs = [mode_env(mode, args.boot_dir) for _ in range(2)]  # cold: an empty boot dir each
+        try:
+            total, children = import_times(envs[0])
+            print(f"\n{mode}: import app_v3 {total:.2f}s; slowest imports")
+            for name, seconds in children[:args.top]:
+                print(f"  {name:<32}{seconds:>7.3f}s")
+            results[mode] = {"import_s": total, "imports": children, **first_response(envs[1], args.port)}
+        finally:
+            if mode == "cold":
+                for env in envs:
+                    shutil.rmtree(env["NESD_BOOT_DIR"], ignore_errors=True)
+
+    print(f"\n{'mode':<9}{'import s':>10}{'port s':>9}{'page s':>9}{'layout s':>10}{'chart s':>9}")
+    for mode, r in results.items():
+        print(f"{mode:<9}{r['import_s']:>10.2f}{r['port']:>9.2f}{r['page']:>9.2f}{r['layout']:>10.2f}{r['chart']:>9.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
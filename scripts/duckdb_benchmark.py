@@ -0,0 +1,161 @@
+"""
+Pandas vs. DuckDB query backends: same results, and cost at 100x the data.
+
+    python scripts/duckdb_benchmark.py [--parquet nesd_parquet] [--scale 100]
+        [--queries 200] [--out DIR] [--skip-check]
+
+--parquet is the extractor's output (nesd_extract_tables.py). First every
+chart query of the aggregate cube is run through both backends on those
+tables and the results are compared. Then a synthetic dataset --scale times
+larger is written (each row repeated under --scale synthetic GEO_ID
+geographies, the shape of a state/county release) and the same random
+chart queries are timed on each backend in its own process: load time, query
+latency and peak RSS. Pandas has to hold the tables plus their row masks in
+memory; DuckDB reads only the columns / partitions a query needs from the
+files.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import pyarrow  # noqa: E402
+import pyarrow.parquet  # noqa: E402
+
+from nesd_data import normalize_tables, read_parquet_table  # noqa: E402
+from nesd_duckdb import DuckDBEngine  # noqa: E402
+from nesd_query import (AggregateCube, area_query, bar_query, dem_labels, line_query, metrics,  # noqa: E402
+                        table_columns)
+
+TABLES = {"firms": ("table_5", "table1"), "owners": ("table_O1", "table_owner")}
+
+
+def pandas_cube(parquet_dir):
+    tables = normalize_tables({name: read_parquet_table(os.path.join(parquet_dir, d), table_columns[name])
+                               for d, name in TABLES.values()}, table_columns)
+    return AggregateCube(tables["table1"], tables["table_owner"], data_version="bench")
+
+
+def duckdb_engine(parquet_dir):
+    return DuckDBEngine({table: os.path.join(parquet_dir, d) for table, (d, _) in TABLES.items()})
+
+
+def check(parquet_dir):
+    # every cube entry from both backends; dims come back as text from DuckDB
+    start = time.perf_counter()
+    expected = pandas_cube(parquet_dir).build()
+    actual = AggregateCube(None, None, data_version="bench", engine=duckdb_engine(parquet_dir)).build()
+    assert set(expected.keys()) == set(actual.keys()), "backends produced different cube keys"
+    for key in expected.keys():
+        df = expected.get(key)
+        df = df.astype({c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+        pd.testing.assert_frame_equal(df, actual.get(key), check_dtype=False, rtol=1e-9)
+    print(f"{len(expected)} chart queries: pandas and DuckDB results match ({time.perf_counter() - start:.0f}s)")
+
+
+def synthesize(parquet_dir, out, scale):
+    # every partition repeated `scale` times, one copy per synthetic geography
+    rows = 0
+    for d, _ in TABLES.values():
+        for part in sorted(os.listdir(os.path.join(parquet_dir, d))):
+            table = pyarrow.parquet.ParquetFile(os.path.join(parquet_dir, d, part, "part-0.parquet")).read()
+            geo = np.repeat(np.array([f"G{i:03d}" for i in range(scale)]), table.num_rows)
+            big = pyarrow.concat_tables([table] * scale).append_column("GEO_ID", pyarrow.array(geo))
+            os.makedirs(os.path.join(out, d, part), exist_ok=True)
+            pyarrow.parquet.write_table(big, os.path.join(out, d, part, "part-0.parquet"))
+            rows += big.num_rows
+    print(f"synthetic data: {scale}x, {rows:,} rows in {out}")
+
+
+def sample_queries(engine, n, seed):
+    # random chart queries across the tabs / dropdowns (same list for both backends)
+    rng = random.Random(seed)
+    years = engine.values("firms", "YEAR") + [None]
+    sectors = engine.values("firms", "NAICS2017_LABEL") + ["All"]
+    queries = []
+    while len(queries) < n:
+        kind, dem, metric, sector = rng.choice(["bar", "line", "area"]), rng.choice(dem_labels), \
+            rng.choice(metrics), rng.choice(sectors)
+        try:
+            if kind == "bar":
+                color = rng.choice([None] + [c for c in dem_labels if c != dem])
+                queries.append(bar_query(engine.columns, dem, rng.choice(years), sector, metric, color))
+            elif kind == "line":
+                queries.append(line_query(engine.columns, sector, metric, dem))
+            else:
+                queries.append(area_query(engine.columns, sector, metric, dem))
+        except (KeyError, ValueError):
+            continue
+    return queries
+
+
+def run_backend(backend, parquet_dir, n, seed):
+    # in a child process, so peak RSS is this backend's alone
+    start = time.perf_counter()
+    if backend == "pandas":
+        engine = pandas_cube(parquet_dir).engine
+    else:
+        engine = duckdb_engine(parquet_dir)
+    engine.warm()
+    load = time.perf_counter() - start
+
+    queries = sample_queries(duckdb_engine(parquet_dir), n, seed)
+    times, failed = [], 0
+    for query in queries:
+        t0 = time.perf_counter()
+        if not engine.run([query], skip_errors=True):
+            failed += 1  # e.g. LFO on the owner table
+        times.append(time.perf_counter() - t0)
+    ms = np.array(times) * 1000
+    return {"load_s": load, "p50_ms": float(np.median(ms)), "p95_ms": float(np.percentile(ms, 95)),
+            "queries_s": float(ms.sum() / 1000), "failed": failed,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--parquet", default=os.path.join(ROOT, "nesd_parquet"), help="extractor Parquet output")
+    parser.add_argument("--scale", type=int, default=100, help="size of the synthetic dataset (x the real one)")
+    parser.add_argument("--queries", type=int, default=200, help="random chart queries per backend")
+    parser.add_argument("--out", default=os.path.join(tempfile.gettempdir(), "nesd-duckdb-benchmark"),
+                        help="where the synthetic Parquet tables are written")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip-check", action="store_true", help="don't compare the backends on the real tables")
+    parser.add_argument("--run", choices=["pandas", "duckdb"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(run_backend(args.run, args.parquet, args.queries, args.seed)))
+        return
+    if not all(os.path.isdir(os.path.join(args.parquet, d)) for d, _ in TABLES.values()):
+        sys.exit(f"no Parquet tables in {args.parquet} (run nesd_extract_tables.py)")
+
+    if not args.skip_check:
+        check(args.parquet)
+    synthesize(args.parquet, args.out, args.scale)
+
+    print(f"{args.queries} random chart queries per backend")
+    print(f"{'backend':<8}{'load s':>9}{'p50 ms':>9}{'p95 ms':>9}{'queries s':>11}{'peak RSS MB':>13}")
+    for backend in ("pandas", "duckdb"):
+        out = subprocess.run(
+            [sys.executable, __file__, "--run", backend, "--parquet", args.out,
+             "--queries", str(args.queries), "--seed", str(args.seed)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{backend:<8}{r['load_s']:>9.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['queries_s']:>11.1f}"
+              f"{r['peak_rss_mb']:>13.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Load test: simulated dashboard users against /_dash-update-component.
+
+    python scripts/load_test.py [--users 1 4 16 64] [--duration 30]
+        [--url http://127.0.0.1:8050 | --workers 4 [--cache all|local|none]]
+        [--think-ms 0] [--output results.json]
+
+Every virtual user is a thread that keeps its own dashboard state and walks
+through random interactions -- switch tab, change sector / metric /
+demographic / year, toggle compare and pick a color -- posting the same
+callback request the browser sends (with the figure on screen as state, so
+same-tab updates come back as a Patch). Charts the server hands to a
+background job are followed like the browser does: start the job, poll it
+until the figure arrives (a poll that isn't HTTP 200, or no figure within
+JOB_TIMEOUT seconds, counts as a failed request). Side effects the page
+applies in the browser (tab switch clears year and compare, no LFO with
+owner counts) are mirrored here.
+
+Each --users level runs for --duration seconds; the report gives
+throughput, latency percentiles and the error rate (exceptions, timeouts and
+HTTP >= 400) per level. Without --url a local `gunicorn app_v3:server` is
+started with --workers; --cache picks the figure caches it runs with (all:
+local + shared, local: per-worker only, none: every request renders).
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np  # noqa: E402
+
+INPUT_IDS = [
+    ("plot-tabs", "active_tab"),
+    ("bar-dem-dropdown", "value"),
+    ("color-dem-dropdown", "value"),
+    ("yaxis-metric-dropdown", "value"),
+    ("industry-dropdown", "value"),
+    ("year-dropdown", "value"),
+    ("compare-toggle", "value"),
+]
+OUTPUTS = [
+    ("plot-title", "children"),
+    ("plot-info-tooltip", "children"),
+    ("plot-graph", "figure"),
+    ("plot-figure-inputs", "data"),
+    ("plot-render-request", "data"),
+]
+
+TABS = ["bar", "line", "stacked-plot"]
+DEMS = ["SEX_LABEL", "RACE_GROUP_LABEL", "ETH_GROUP_LABEL", "VET_GROUP_LABEL",
+        "FOREIGN_BORN_GROUP_LABEL", "W2_GROUP_LABEL", "LFO_LABEL"]
+METRICS = ["FIRMNOPD", "OWNNOPD", "RCPNOPD", "AVG_REVENUE_PER_FIRM"]
+
+START = {"plot-tabs": "bar", "bar-dem-dropdown": "SEX_LABEL", "color-dem-dropdown": None,
+         "yaxis-metric-dropdown": "FIRMNOPD", "industry-dropdown": "All", "year-dropdown": 2019,
+         "compare-toggle": False}
+
+
+def dropdown_options(base_url):
+    # sector / year choices straight from the served layout
+    with urllib.request.urlopen(base_url + "/_dash-layout", timeout=60) as resp:
+        layout = json.load(resp)
+    options = {}
+
+    def walk(node):
+        if isinstance(node, dict):
+            props = node.get("props", {})
+            if props.get("id") in ("industry-dropdown", "year-dropdown"):
+                options[props["id"]] = [o["value"] for o in props.get("options", [])]
+            for value in props.values():
+                walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(layout)
+    return options["industry-dropdown"], options["year-dropdown"]
+
+
+def background_callback(base_url):
+    # -> (output string, poll seconds) of the background plot callback, None if the server renders inline
+    with urllib.request.urlopen(base_url + "/_dash-dependencies", timeout=60) as resp:
+        for dep in json.load(resp):
+            if dep.get("background") and any(i["id"] == "plot-render-request" for i in dep["inputs"]):
+                return dep["output"], dep["background"].get("interval", 1000) / 1000
+    return None
+
+
+def _post_json(url, payload):
+    req = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=60) as resp:
+        if resp.status != 200:  # e.g. 204: a cancelled job's poll, nothing to show
+            raise RequestFailed(f"HTTP {resp.status}")
+        return json.loads(resp.read())
+
+
+JOB_TIMEOUT = 60  # seconds a user waits for a background job's figure
+
+
+class RequestFailed(Exception):
+    """A callback answered with a non-200 status, or a background job with no figure within JOB_TIMEOUT."""
+
+
+# ---------------- Virtual user ---------------- #
+class User:
+    def __init__(self, base_url, sectors, years, rng, background=None):
+        self.url = base_url + "/_dash-update-component"
+        self.sectors, self.years = sectors, years
+        self.background = background  # (output, poll seconds) from background_callback()
+        self.rng = rng
+        self.values = dict(START)
+        self.shown = None  # figure inputs on screen (the plot-figure-inputs store)
+
+    def interact(self):
+        # -> (interaction, changed component) after applying one random change
+        v, rng = self.values, self.rng
+        kind = rng.choice(["tab", "sector", "metric", "dem", "year", "compare", "color"])
+        if kind == "tab":
+            v["plot-tabs"] = rng.choice([t for t in TABS if t != v["plot-tabs"]])
+            if v["plot-tabs"] == "bar":
+                v["year-dropdown"] = 2019
+            else:
+                v["year-dropdown"], v["compare-toggle"] = None, False
+            return kind, "plot-tabs"
+        if kind == "sector":
+            v["industry-dropdown"] = rng.choice(self.sectors)
+            return kind, "industry-dropdown"
+        if kind == "metric":
+            v["yaxis-metric-dropdown"] = rng.choice(METRICS)
+            if v["yaxis-metric-dropdown"] == "OWNNOPD" and v["bar-dem-dropdown"] == "LFO_LABEL":
+                v["bar-dem-dropdown"] = "SEX_LABEL"
+            return kind, "yaxis-metric-dropdown"
+        if kind == "dem":
+            owner = v["yaxis-metric-dropdown"] == "OWNNOPD"
+            v["bar-dem-dropdown"] = rng.choice([d for d in DEMS if not (owner and d == "LFO_LABEL")])
+            return kind, "bar-dem-dropdown"
+        if kind == "year" and v["plot-tabs"] == "bar":
+            v["year-dropdown"] = rng.choice(self.years + [None])
+            return kind, "year-dropdown"
+        if kind == "compare" and v["plot-tabs"] == "bar":
+            v["compare-toggle"] = not v["compare-toggle"]
+            return kind, "compare-toggle"
+        if kind == "color" and v["plot-tabs"] == "bar" and v["compare-toggle"]:
+            v["color-dem-dropdown"] = rng.choice([d for d in DEMS[:-1] if d != v["bar-dem-dropdown"]])
+            return kind, "color-dem-dropdown"
+        return self.interact()  # not reachable on this tab
+
+    def post(self, changed):
+        payload = {
+            "output": "..%s.." % "...".join(f"{i}.{p}" for i, p in OUTPUTS),
+            "outputs": [{"id": i, "property": p} for i, p in OUTPUTS],
+            "inputs": [{"id": i, "property": p, "value": self.values[i]} for i, p in INPUT_IDS],
+            "state": [{"id": "plot-figure-inputs", "property": "data", "value": self.shown}],
+            "changedPropIds": [f"{changed}.{dict(INPUT_IDS)[changed]}"],
+        }
+        response = _post_json(self.url, payload)["response"]
+        if "plot-render-request" in response:  # not rendered yet: a background job renders it
+            response = self.follow_job(response["plot-render-request"]["data"])
+        if "plot-figure-inputs" in response:
+            self.shown = response["plot-figure-inputs"]["data"]
+
+    def follow_job(self, render_request):
+        output, poll = self.background
+        payload = {
+            "output": output,
+            "outputs": [dict(zip(("id", "property"), o.split(".", 1))) for o in output.strip(".").split("...")],
+            "inputs": [{"id": "plot-render-request", "property": "data", "value": render_request}],
+            "state": [{"id": "plot-figure-inputs", "property": "data", "value": self.shown}],
+            "changedPropIds": ["plot-render-request.data"],
+        }
+        job = _post_json(self.url, payload)
+        deadline = time.perf_counter() + JOB_TIMEOUT
+        while time.perf_counter() < deadline:
+            time.sleep(poll)
+            # a failed job's poll is an HTTP 500 (urlopen raises), a cancelled one's a 204
+            body = _post_json(f"{self.url}?cacheKey={job['cacheKey']}&job={job['job']}", payload)
+            if "response" in body:
+                return body["response"]
+        raise RequestFailed(f"no figure after {JOB_TIMEOUT}s")
+
+
+def run_level(base_url, users, duration, think, sectors, years, seed, background=None):
+    results = []  # (interaction, seconds, ok)
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def worker(n):
+        user = User(base_url, sectors, years, random.Random(seed * 1000 + n), background)
+        kind, changed = "load", "plot-tabs"  # page load renders the first chart
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            try:
+                user.post(changed)
+                ok = True
+            except (urllib.error.URLError, OSError, KeyError, ValueError, RequestFailed):  # HTTPError included
+                ok = False
+                user.shown = None  # the page would re-render from scratch
+            with lock:
+                results.append((kind, time.perf_counter() - t0, ok))
+            if think:
+                time.sleep(think)
+            kind, changed = user.interact()
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(users)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(results, time.perf_counter() - t0)
+
+
+def summarize(results, elapsed):
+    ok = np.array([r[2] for r in results], dtype=bool)
+    ms = np.array([r[1] for r in results]) * 1000
+    out = {
+        "requests": len(results),
+        "errors": int((~ok).sum()),
+        "error_rate": float((~ok).mean()) if len(results) else 0.0,
+        "throughput_rps": float(ok.sum() / elapsed),
+    }
+    if ok.any():
+        good = ms[ok]
+        out.update({f"p{q}_ms": float(np.percentile(good, q)) for q in (50, 90, 95, 99)})
+        out["max_ms"] = float(good.max())
+    out["by_interaction"] = {
+        kind: {"n": int(sum(1 for r in results if r[0] == kind)),
+               "p50_ms": float(np.median([r[1] * 1000 for r in results if r[0] == kind and r[2]] or [0]))}
+        for kind in sorted({r[0] for r in results})
+    }
+    return out
+
+
+# ---------------- Local server ---------------- #
+def start_server(workers, cache, port):
+    env = dict(os.environ)
+    if cache in ("local", "none"):
+        env["NESD_SHARED_CACHE_DIR"] = ""
+    if cache == "none":
+        env["NESD_FIGURE_CACHE_ENTRIES"] = "0"
+    env.setdefault("NESD_TRACE", "0")  # keep the server's stderr quiet
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}",
+         "--timeout", "300", "app_v3:server"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 600
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            urllib.request.urlopen(base_url + "/", timeout=2).read()
+            return proc, base_url
+        except OSError:
+            time.sleep(0.5)
+    proc.terminate()
+    raise RuntimeError("gunicorn not ready after 600s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16, 64], help="concurrency levels")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument("--think-ms", type=float, default=0, help="pause between a user's interactions")
+    parser.add_argument("--url", help="server to test (default: start gunicorn locally)")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers for the local server")
+    parser.add_argument("--cache", choices=["all", "local", "none"], default="all",
+                        help="figure caches of the local server")
+    parser.add_argument("--port", type=int, default=8052)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results JSON here")
+    args = parser.parse_args()
+
+    proc = None
+    if args.url:
+        base_url = args.url.rstrip("/")
+    else:
+        proc, base_url = start_server(args.workers, args.cache, args.port)
+    try:
+        sectors, years = dropdown_options(base_url)
+        background = background_callback(base_url)
+        report = {"meta": {"url": base_url, "workers": None if args.url else args.workers,
+                           "cache": None if args.url else args.cache, "duration_s": args.duration,
+                           "think_ms": args.think_ms},
+                  "levels": {}}
+        print(f"{'users':>6}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p90 ms':>9}{'p95 ms':>9}"
+              f"{'p99 ms':>9}{'max ms':>9}{'errors':>9}")
+        for users in args.users:
+            r = run_level(base_url, users, args.duration, args.think_ms / 1000, sectors, years, args.seed,
+                          background)
+            report["levels"][users] = r
+            print(f"{users:>6}{r['requests']:>10}{r['throughput_rps']:>9.1f}"
+                  + "".join(f"{r.get(k, float('nan')):>9.1f}" for k in ("p50_ms", "p90_ms", "p95_ms", "p99_ms", "max_ms"))
+                  + f"{r['error_rate']:>9.1%}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
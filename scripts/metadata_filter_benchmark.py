@@ -0,0 +1,78 @@
+"""
+Scaling of the metadata-row filter: row-wise apply vs. metadata_row_mask.
+
+    python scripts/metadata_filter_benchmark.py [--rows 1000 10000 100000 1000000] [--legacy-max 100000]
+
+Builds sheets shaped like the NES-D tables (code + label text columns,
+count columns, "Meaning of ... code" annotation rows mixed in) at each row
+count, times both filters and checks they drop exactly the same rows. The
+row-wise version is skipped above --legacy-max rows.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from nesd_extract_tables import metadata_row_mask  # noqa: E402
+
+LABELS = {
+    "NAICS2017_LABEL": ["Total for all sectors", "Construction", "Utilities", "Retail trade", "Manufacturing"],
+    "SEX_LABEL": ["Total", "Female", "Male", "Equally male/female"],
+    "RACE_GROUP_LABEL": ["Total", "White", "Black or African American", "Asian", "Minority"],
+    "OWNNOPD": [12, 250, 4100, "N < 15", "S"],  # suppressed cells make it a mixed column
+}
+
+
+def legacy_mask(df):
+    return df.apply(lambda row: row.astype(str).str.contains("Meaning|code", case=False).any(), axis=1).to_numpy()
+
+
+def make_sheet(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "NAICS2017": rng.choice(["00", "23", "22", "44-45", "31-33"], rows).astype(object),
+        **{col: rng.choice(np.array(values, dtype=object), rows) for col, values in LABELS.items()},
+        "FIRMNOPD": rng.integers(0, 10**6, rows),
+        "RCPNOPD": rng.random(rows) * 1e6,
+    })
+    # an annotation row under the header plus a few scattered through the sheet
+    meta_rows = np.concatenate([[0], rng.choice(rows, max(1, rows // 5000), replace=False)])
+    for i, col in enumerate(df.columns[:4]):
+        df.loc[meta_rows, col] = f"Meaning of {col} code" if i % 2 == 0 else "see code list"
+    return df
+
+
+def _timed(fn, df):
+    t0 = time.perf_counter()
+    out = fn(df)
+    return out, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--legacy-max", type=int, default=100000, help="largest sheet the row-wise apply runs on")
+    args = parser.parse_args()
+
+    print(f"{'rows':>10}{'row-wise apply':>16}{'vectorized':>12}{'speed-up':>10}{'dropped':>9}")
+    for rows in args.rows:
+        df = make_sheet(rows)
+        new, t_new = _timed(metadata_row_mask, df)
+        if rows <= args.legacy_max:
+            old, t_old = _timed(legacy_mask, df)
+            assert (old == new).all(), f"masks differ at {rows} rows"
+            legacy = f"{t_old:>15.3f}s"
+            speedup = f"{t_old / t_new:>9.0f}x"
+        else:
+            legacy, speedup = f"{'(skipped)':>16}", f"{'':>10}"
+        print(f"{rows:>10,}{legacy}{t_new:>11.4f}s{speedup}{int(new.sum()):>9}")
+
+
+if __name__ == "__main__":
+    main()
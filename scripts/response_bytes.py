@@ -0,0 +1,93 @@
+"""
+Response bytes per interaction for the plot callback: full figure vs. Patch.
+
+    python scripts/response_bytes.py
+
+Replays a short session (year, compare toggle, color, metric, sector and tab
+changes) against /_dash-update-component through Flask's test client. Each
+step is posted twice: without the on-screen figure inputs, which makes the
+callback send the whole figure (what every update used to cost), and with
+them, which lets it send a dash.Patch of only what changed.
+"""
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault("NESD_BACKGROUND_DIR", "")  # render inline: measure the plot callback's own response
+
+import app_v3  # noqa: E402
+
+INPUT_IDS = [
+    ("plot-tabs", "active_tab"),
+    ("bar-dem-dropdown", "value"),
+    ("color-dem-dropdown", "value"),
+    ("yaxis-metric-dropdown", "value"),
+    ("industry-dropdown", "value"),
+    ("year-dropdown", "value"),
+    ("compare-toggle", "value"),
+]
+OUTPUTS = [
+    ("plot-title", "children"),
+    ("plot-info-tooltip", "children"),
+    ("plot-graph", "figure"),
+    ("plot-figure-inputs", "data"),
+    ("plot-render-request", "data"),
+]
+
+START = {"plot-tabs": "bar", "bar-dem-dropdown": "SEX_LABEL", "color-dem-dropdown": "RACE_GROUP_LABEL",
+         "yaxis-metric-dropdown": "FIRMNOPD", "industry-dropdown": "All", "year-dropdown": 2019,
+         "compare-toggle": False}
+
+# (description, changed component, new value)
+SESSION = [
+    ("year 2019 -> 2018", "year-dropdown", 2018),
+    ("year 2018 -> all", "year-dropdown", None),
+    ("compare on", "compare-toggle", True),
+    ("color race -> ethnicity", "color-dem-dropdown", "ETH_GROUP_LABEL"),
+    ("compare off", "compare-toggle", False),
+    ("metric firms -> receipts", "yaxis-metric-dropdown", "RCPNOPD"),
+    ("sector -> Construction", "industry-dropdown", "Construction"),
+    ("x dem sex -> race", "bar-dem-dropdown", "RACE_GROUP_LABEL"),
+    ("tab -> line", "plot-tabs", "line"),
+    ("line metric -> firms", "yaxis-metric-dropdown", "FIRMNOPD"),
+    ("line x dem -> veteran", "bar-dem-dropdown", "VET_GROUP_LABEL"),
+]
+
+
+def post(client, values, shown_inputs, changed):
+    payload = {
+        "output": "..%s.." % "...".join(f"{i}.{p}" for i, p in OUTPUTS),
+        "outputs": [{"id": i, "property": p} for i, p in OUTPUTS],
+        "inputs": [{"id": i, "property": p, "value": values[i]} for i, p in INPUT_IDS],
+        "state": [{"id": "plot-figure-inputs", "property": "data", "value": shown_inputs}],
+        "changedPropIds": [f"{changed}.{dict(INPUT_IDS)[changed]}"],
+    }
+    resp = client.post("/_dash-update-component", json=payload)
+    assert resp.status_code == 200, resp.status_code
+    # -> bytes sent, the figure inputs the page now shows (the store's new value)
+    return len(resp.data), resp.get_json()["response"]["plot-figure-inputs"]["data"]
+
+
+def main():
+    client = app_v3.server.test_client()
+    values = dict(START)
+    _, shown = post(client, values, None, "plot-tabs")  # warm the figure caches
+
+    print(f"{'interaction':<28}{'full (B)':>12}{'patch (B)':>12}{'saved':>8}")
+    total_full = total_patch = 0
+    for label, component, value in SESSION:
+        values[component] = value
+        post(client, values, None, component)  # render once so both timings hit the cache
+        full, _ = post(client, values, None, component)
+        patch, shown = post(client, values, shown, component)
+        total_full += full
+        total_patch += patch
+        print(f"{label:<28}{full:>12,}{patch:>12,}{1 - patch / full:>8.0%}")
+    print(f"{'total':<28}{total_full:>12,}{total_patch:>12,}{1 - total_patch / total_full:>8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Memory of the gunicorn deployment vs. worker count, shared tables on and off.
+
+    python scripts/rss_vs_workers.py [--workers 1 2 4 8] [--port 8051]
+
+For each worker count it starts `gunicorn app_v3:server` twice -- once with
+the memory-mapped shared tables (NESD_SHARED_DATA_DIR) and once with private
+per-worker copies (NESD_SHARED_DATA_DIR="") -- renders one chart per worker,
+then sums the workers' RSS, PSS and USS. RSS counts shared pages in every
+worker; PSS splits them between the workers that map them, so its total is
+what the box actually spends. Needs gunicorn and psutil (PSS/USS are
+Linux-only).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import psutil
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# a chart render through the Dash callback endpoint (same payload the browser sends)
+RENDER_REQUEST = {
+    "output": "..plot-title.children...plot-info-tooltip.children...plot-graph.figure...plot-figure-inputs.data"
+              "...plot-render-request.data..",
+    "outputs": [
+        {"id": "plot-title", "property": "children"},
+        {"id": "plot-info-tooltip", "property": "children"},
+        {"id": "plot-graph", "property": "figure"},
+        {"id": "plot-figure-inputs", "property": "data"},
+        {"id": "plot-render-request", "property": "data"},
+    ],
+    "inputs": [
+        {"id": "plot-tabs", "property": "active_tab", "value": "bar"},
+        {"id": "bar-dem-dropdown", "property": "value", "value": "SEX_LABEL"},
+        {"id": "color-dem-dropdown", "property": "value", "value": None},
+        {"id": "yaxis-metric-dropdown", "property": "value", "value": "FIRMNOPD"},
+        {"id": "industry-dropdown", "property": "value", "value": "All"},
+        {"id": "year-dropdown", "property": "value", "value": None},
+        {"id": "compare-toggle", "property": "value", "value": []},
+    ],
+    "state": [{"id": "plot-figure-inputs", "property": "data", "value": None}],
+    "changedPropIds": ["plot-tabs.active_tab"],
+}
+
+
+def _wait_ready(url, proc, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            urllib.request.urlopen(url, timeout=2).read()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f"gunicorn not ready after {timeout}s")
+
+
+def _render(base_url, n):
+    body = json.dumps(RENDER_REQUEST).encode()
+    for _ in range(n):
+        req = urllib.request.Request(base_url + "/_dash-update-component", data=body,
+                                     headers={"Content-Type": "application/json"})
+        urllib.request.urlopen(req, timeout=60).read()
+
+
+def measure(workers, shared, port):
+    env = dict(os.environ)
+    env["NESD_SHARED_DATA_DIR"] = os.path.join(tempfile.gettempdir(), "nesd-dashboard-data") if shared else ""
+    env["NESD_SHARED_CACHE_DIR"] = ""  # every worker renders for itself
+    env["NESD_BACKGROUND_DIR"] = ""  # ...in its own process, not a background job
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}",
+         "--timeout", "300", "app_v3:server"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_ready(base_url + "/", proc, timeout=600)
+        _render(base_url, 4 * workers)  # spread over the workers
+        time.sleep(1)
+
+        totals = {"rss": 0, "pss": 0, "uss": 0}
+        for child in psutil.Process(proc.pid).children():
+            info = child.memory_full_info()
+            for field in totals:
+                totals[field] += getattr(info, field, 0)
+        return {field: value / 1e6 for field, value in totals.items()}
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--port", type=int, default=8051)
+    args = parser.parse_args()
+
+    print(f"{'workers':>7}  {'tables':<8}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}{'PSS/worker':>12}")
+    for workers in args.workers:
+        for shared in (False, True):
+            mem = measure(workers, shared, args.port)
+            print(f"{workers:>7}  {'mmap' if shared else 'private':<8}"
+                  f"{mem['rss']:>10.0f}{mem['pss']:>10.0f}{mem['uss']:>10.0f}{mem['pss'] / workers:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Startup-time comparison: plain pd.read_excel vs. the snapshot loader.
+
+    python scripts/startup_benchmark.py [--repeat N]
+
+For each workbook it times the original read_excel path, a cold snapshot
+build (parse + write) and a warm snapshot load, then prints a small table.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd  # noqa: E402
+
+from nesd_data import build_snapshot, load_table  # noqa: E402
+
+WORKBOOKS = {
+    "table_5_new.xlsx": (),
+    "table_O1_new.xlsx": ("OWNNOPD",),
+}
+
+
+def _best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (best is kept)")
+    args = parser.parse_args()
+
+    print(f"{'workbook':<22}{'read_excel':>12}{'cold build':>12}{'warm load':>12}{'speed-up':>10}")
+    for name, numeric_cols in WORKBOOKS.items():
+        path = os.path.join(ROOT, name)
+        if not os.path.exists(path):
+            print(f"{name:<22}  (missing, skipped)")
+            continue
+
+        excel = _best_of(lambda: pd.read_excel(path), args.repeat)
+        cold = _best_of(lambda: build_snapshot(path, numeric_cols), 1)
+        warm = _best_of(lambda: load_table(path, numeric_cols), args.repeat)
+        print(f"{name:<22}{excel:>11.2f}s{cold:>11.2f}s{warm:>11.3f}s{excel / warm:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+The aggregate cube against a frozen copy of the original chart pipelines.
+
+    python -m pytest tests/test_cube.py
+
+Every input combination the UI can send (tab x demographic x color x compare
+x metric x sector x year, from the dropdowns' own options) must either come
+back from the cube identical to the reference below -- the plain pandas
+filter + groupby code the charts ran before the query planner, kept here
+unchanged on purpose so it doesn't share a bug with the engine -- or fail
+with the same exception the reference raises. A combination the build
+skipped shows up as a miss instead of passing unnoticed.
+
+Needs table_5_new.xlsx / table_O1_new.xlsx in the repo root (skipped
+otherwise). Builds the cube once, ~1 min.
+"""
+import itertools
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from nesd_data import load_table, normalize_tables  # noqa: E402
+from nesd_query import AggregateCube, table_columns  # noqa: E402
+
+WORKBOOKS = [os.path.join(ROOT, "table_5_new.xlsx"), os.path.join(ROOT, "table_O1_new.xlsx")]
+pytestmark = pytest.mark.skipif(not all(os.path.exists(p) for p in WORKBOOKS),
+                                reason="needs table_5_new.xlsx / table_O1_new.xlsx")
+
+# ---------------- reference pipeline (frozen: don't route through nesd_query) ---------------- #
+DEM_LABELS = ["SEX_LABEL", "RACE_GROUP_LABEL", "ETH_GROUP_LABEL", "FOREIGN_BORN_GROUP_LABEL", "LFO_LABEL",
+              "VET_GROUP_LABEL", "W2_GROUP_LABEL"]
+OWNER_LABELS = {
+    "SEX_LABEL": "OWNER_SEX_LABEL",
+    "RACE_GROUP_LABEL": "OWNER_RACE_LABEL",
+    "ETH_GROUP_LABEL": "OWNER_ETH_LABEL",
+    "VET_GROUP_LABEL": "OWNER_VET_LABEL",
+    "FOREIGN_BORN_GROUP_LABEL": "OWNER_FOREIGN_BORN_LABEL",
+    "W2_GROUP_LABEL": "OWNER_W2_LABEL",
+}
+# derived metrics: sum(numerator) / sum(denominator) over the same rows
+RATIOS = {"AVG_REVENUE_PER_FIRM": ("RCPNOPD", "FIRMNOPD")}
+ALL_OWNERS = "All owners of nonemployer firms"
+ALL_SECTORS = "Total for all sectors"
+
+
+def ref_sum(df, group_cols, y_metric, name="y_value"):
+    if y_metric in RATIOS:
+        num, den = RATIOS[y_metric]
+        out = df.groupby(group_cols, as_index=False, observed=True)[[num, den]].sum()
+        out[name] = out[num] / out[den].where(out[den] != 0)
+        return out.drop(columns=[num, den])
+    return df.groupby(group_cols, as_index=False, observed=True).agg(**{name: (y_metric, "sum")})
+
+
+def ref_sector(df, industry):
+    if industry and industry != "All":
+        return df[df["NAICS2017_LABEL"] == industry]
+    if ALL_SECTORS in df["NAICS2017_LABEL"].unique():
+        return df[df["NAICS2017_LABEL"] == ALL_SECTORS]
+    return df
+
+
+def ref_unused_owner_totals(df, used):
+    for owner_col in OWNER_LABELS.values():
+        if owner_col in df.columns and owner_col not in used and df[owner_col].nunique() > 1:
+            df = df[df[owner_col] != ALL_OWNERS]
+    return df
+
+
+def ref_unused_dem_totals(df, used):
+    # keep only Total vals in unused cols to avoid double counts (LFO only when used)
+    for col in DEM_LABELS:
+        if col in df.columns and col not in used and col != "LFO_LABEL" and "Total" in df[col].unique():
+            df = df[df[col] == "Total"]
+    return df
+
+
+def ref_firm_base(table1):
+    df = table1[~table1["RACE_GROUP_LABEL"].str.lower().str.contains("minority|nonminority|equally", na=False)]
+    return df[~df["ETH_GROUP_LABEL"].str.lower().str.contains("equally", na=False)]
+
+
+def ref_bar(firm_base, table_owner, group_by, year, industry, y_metric, color_group):
+    if y_metric == "OWNNOPD":
+        # owner counts ignore year + sector
+        group_col = OWNER_LABELS.get(group_by, group_by)
+        color_col = OWNER_LABELS.get(color_group, color_group) if color_group else None
+        df = table_owner[(table_owner["OWNER_RACE_LABEL"] != ALL_OWNERS)
+                         & (table_owner["NAICS2017_LABEL"] != ALL_SECTORS)]
+        if group_col in df.columns:
+            df = df[df[group_col] != ALL_OWNERS]
+        if color_col and color_col != group_col and color_col in df.columns:
+            df = df[df[color_col] != ALL_OWNERS]
+        df = ref_unused_owner_totals(df, [group_col, color_col])
+        return ref_sum(df, list(dict.fromkeys(c for c in [group_col, color_col] if c)), y_metric)
+
+    df = firm_base
+    if year:
+        df = df[df["YEAR"].isin([year])]
+    df = ref_sector(df, industry)
+    df = df[df[group_by] != "Total"]
+    if color_group and color_group != group_by:
+        df = df[df[color_group] != "Total"]
+    df = ref_unused_dem_totals(df, [group_by, color_group])
+    return ref_sum(df, list(dict.fromkeys(c for c in [group_by, color_group] if c)), y_metric)
+
+
+def ref_line(firm_base, table_owner, industry, y_metric, x_dem):
+    if y_metric == "OWNNOPD":
+        group_col = OWNER_LABELS.get(x_dem, x_dem)
+        df = ref_sector(table_owner, industry)
+        if group_col not in df.columns:
+            # e.g. LFO: the owner table has no such column, so the line is the yearly total
+            return ref_sum(ref_unused_owner_totals(df, []), ["YEAR"], y_metric)
+        df = df[df[group_col] != ALL_OWNERS]
+        df = ref_unused_owner_totals(df, [group_col])
+        return ref_sum(df, ["YEAR", group_col], y_metric)
+
+    df = ref_sector(firm_base, industry)
+    df = df[df[x_dem] != "Total"]
+    df = ref_unused_dem_totals(df, [x_dem])
+    return ref_sum(df, ["YEAR", x_dem], y_metric)
+
+
+def ref_area(table1, table_owner, industry, y_metric, x_dem):
+    if y_metric == "OWNNOPD":
+        group_col = OWNER_LABELS.get(x_dem, x_dem)
+        df = table_owner[table_owner["NAICS2017_LABEL"] != ALL_SECTORS]
+        if industry and industry != "All":
+            df = df[df["NAICS2017_LABEL"] == industry]
+        df = df[df[group_col] != ALL_OWNERS]
+    else:
+        group_col = x_dem
+        df = table1
+        if industry and industry != "All":
+            df = df[df["NAICS2017_LABEL"] == industry]
+        df = df[df[x_dem] != "Total"]
+
+    # share of each group per year
+    out = ref_sum(df, ["YEAR", group_col], y_metric, name=y_metric)
+    out["TOTAL"] = out.groupby("YEAR")[y_metric].transform("sum")
+    out["PERCENTAGE"] = (out[y_metric] / out["TOTAL"]) * 100
+    return out
+
+
+# ---------------- the UI's input space ---------------- #
+# the dropdowns' options (app_v3): the x demographic drops LFO for owner counts,
+# the color dropdown doesn't; the year is cleared on the line / area tabs
+METRICS = ["FIRMNOPD", "OWNNOPD", "RCPNOPD", "AVG_REVENUE_PER_FIRM"]
+TABS = ["bar", "line", "stacked-plot"]
+
+
+def ui_requests(years, sectors):
+    """-> {cube key: (tab, x_dem, color, metric, sector, year)}, one request per distinct chart."""
+    out = {}
+    for tab, metric, sector in itertools.product(TABS, METRICS, sectors + ["All"]):
+        x_dems = [d for d in DEM_LABELS if not (metric == "OWNNOPD" and d == "LFO_LABEL")]
+        if tab != "bar":
+            for x_dem in x_dems:
+                key = (AggregateCube.line_key if tab == "line" else AggregateCube.area_key)(sector, metric, x_dem)
+                out.setdefault(key, (tab, x_dem, None, metric, sector, None))
+            continue
+        for x_dem, color, compare_on, year in itertools.product(x_dems, DEM_LABELS, [True, False], years + [None]):
+            # app_v3.figure_key: the color counts only while compare is on and it differs from x
+            color = color if compare_on and color != x_dem else None
+            out.setdefault(AggregateCube.bar_key(x_dem, year, sector, metric, color),
+                           ("bar", x_dem, color, metric, sector, year))
+    return out
+
+
+def reference(request, table1, table_owner, firm_base):
+    tab, x_dem, color, metric, sector, year = request
+    if tab == "bar":
+        return ref_bar(firm_base, table_owner, x_dem, year, sector, metric, color)
+    if tab == "line":
+        return ref_line(firm_base, table_owner, sector, metric, x_dem)
+    return ref_area(table1, table_owner, sector, metric, x_dem)
+
+
+def cube_frame(request, cube):
+    # what the chart callbacks get: the cube entry, or the live query on a miss
+    tab, x_dem, color, metric, sector, year = request
+    if tab == "bar":
+        return cube.bar(x_dem, year, sector, metric, color)
+    if tab == "line":
+        return cube.line(sector, metric, x_dem)
+    return cube.area(sector, metric, x_dem)
+
+
+@pytest.fixture(scope="module")
+def tables():
+    table1 = load_table(WORKBOOKS[0])
+    table_owner = load_table(WORKBOOKS[1], numeric_cols=["OWNNOPD"])
+    tables = normalize_tables({"table1": table1, "table_owner": table_owner}, keep_columns=table_columns)
+    return tables["table1"], tables["table_owner"]
+
+
+def test_cube_covers_ui_and_matches_reference(tables):
+    table1, table_owner = tables
+    cube = AggregateCube(table1, table_owner).build()
+    firm_base = ref_firm_base(table1)
+    years = sorted(table1["YEAR"].dropna().unique().tolist())
+    sectors = sorted(table1["NAICS2017_LABEL"].dropna().unique().tolist())
+
+    failures = []
+    for key, request in ui_requests(years, sectors).items():
+        try:
+            expected = reference(request, table1, table_owner, firm_base)
+        except Exception as e:  # noqa: BLE001 -- the old code's error is the expectation
+            try:
+                cube_frame(request, cube)
+                failures.append(f"{request}: reference raised {type(e).__name__}, the cube didn't")
+            except Exception as got:  # noqa: BLE001
+                if type(got) is not type(e):
+                    failures.append(f"{request}: reference raised {type(e).__name__}, cube {type(got).__name__}")
+            continue
+
+        if cube.failed(key):  # the app answers these with "no data" instead of a job
+            failures.append(f"{request}: marked failed, the reference renders it")
+            continue
+        if key not in cube:
+            failures.append(f"{request}: not in the cube")
+            continue
+        try:
+            pd.testing.assert_frame_equal(cube.get(key), expected)
+        except AssertionError as e:
+            failures.append(f"{request}: {e}")
+
+    assert not failures, f"{len(failures)} mismatches, first ones:\n" + "\n".join(failures[:5])